@@ -0,0 +1,288 @@
+import argparse
+import glob
+import logging
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import pandas as pd
+from category_cache import CACHE_PATH, open_keyword_cache, open_model_cache
+from dedup_index import DEDUP_INDEX_PATH, DuplicateIndex
+from extraction_cache import EXTRACTION_CACHE_DIR
+from pipeline_metrics import add_logging_arguments, configure_logging, metrics, report_metrics
+from sheets_outbox import FLUSH_TIMEOUT
+from statement_extractor import extract_transactions_from_pdf, extract_transactions_from_pdf_parallel
+from statement_parser import DEFAULT_LAYOUT, load_layouts
+from transaction_categorizer import (
+    RULES_PATH,
+    categorize_dataframe,
+    categorize_dataframe_ml,
+    load_model,
+    re_categorize_miscellaneous,
+)
+
+logger = logging.getLogger(__name__)
+
+# File paths
+MODEL_PATH = 'transaction_categorizer_model.pkl'
+DEFAULT_OUTPUT = 'combined_transactions.csv'
+
+# Model and caches set up once per worker process by init_worker
+_worker_model = None
+_worker_cache = None
+_worker_extraction_cache = EXTRACTION_CACHE_DIR
+_worker_layout = DEFAULT_LAYOUT
+
+# Function to expand directories and glob patterns into a sorted list of PDF files
+def collect_pdf_paths(inputs):
+    paths = []
+    for item in inputs:
+        if os.path.isdir(item):
+            matches = [os.path.join(item, f) for f in os.listdir(item) if f.lower().endswith('.pdf')]
+        else:
+            matches = glob.glob(item, recursive=True)
+        for path in sorted(matches):
+            if os.path.isfile(path) and path not in paths:
+                paths.append(path)
+    return paths
+
+# Function to open the category cache matching the categorizer in use
+def open_category_cache(model_path, cache_path):
+    if not cache_path:
+        return None
+    if model_path:
+        return open_model_cache(model_path, cache_path)
+    return open_keyword_cache(RULES_PATH, cache_path)
+
+# Function to load the model and open the cache once when a worker process starts
+def init_worker(model_path, cache_path, extraction_cache_dir, layout=DEFAULT_LAYOUT):
+    global _worker_model, _worker_cache, _worker_extraction_cache, _worker_layout
+    _worker_extraction_cache = extraction_cache_dir
+    _worker_layout = layout
+    if model_path:
+        _worker_model = load_model(model_path)
+    _worker_cache = open_category_cache(model_path, cache_path)
+
+# Function to build and categorize the DataFrame for one statement's transactions
+def categorize_statement(transactions, pdf_path, model=None, cache=None):
+    df = pd.DataFrame(transactions, columns=['date', 'description', 'amount'])
+    if model is not None:
+        df = categorize_dataframe_ml(df, model, cache)
+    else:
+        df = categorize_dataframe(df, cache=cache)
+    df = re_categorize_miscellaneous(df, model)
+    df['source_file'] = pdf_path
+    return df
+
+# Function to categorize a statement and return the cache hits and misses it caused
+def categorize_statement_cached(transactions, pdf_path, model, cache):
+    if cache is None:
+        return categorize_statement(transactions, pdf_path, model), (0, 0)
+    hits, misses = cache.hits, cache.misses
+    df = categorize_statement(transactions, pdf_path, model, cache)
+    cache.save()
+    return df, (cache.hits - hits, cache.misses - misses)
+
+# Function to drop or flag transactions already ingested from other statements, then categorize the rest
+# source_key identifies this version of the statement (see DuplicateIndex)
+def screen_and_categorize(transactions, pdf_path, model, cache, duplicates, year=None, source_key=None):
+    transactions, flags = duplicates.screen(transactions, year, pdf_path, source_key)
+    df, cache_hits = categorize_statement_cached(transactions, pdf_path, model, cache)
+    if duplicates.mode == 'flag':
+        df['duplicate'] = flags
+    return df, cache_hits
+
+# Function to extract one statement inside a worker process
+# Returns the transactions and the worker's metrics for them, to be merged in the parent
+def extract_statement(pdf_path):
+    metrics.reset()
+    transactions = extract_transactions_from_pdf(pdf_path, cache_dir=_worker_extraction_cache, layout=_worker_layout)
+    return transactions, metrics.snapshot()
+
+# Function to extract and categorize one statement inside a worker process
+def process_statement(pdf_path):
+    metrics.reset()
+    transactions = extract_transactions_from_pdf(pdf_path, cache_dir=_worker_extraction_cache, layout=_worker_layout)
+    df, cache_hits = categorize_statement_cached(transactions, pdf_path, _worker_model, _worker_cache)
+    return df, cache_hits, metrics.snapshot()
+
+# Function to process every statement across a process pool and merge the results
+def ingest_statements(pdf_paths, model_path=None, workers=None, cache_path=CACHE_PATH,
+                      extraction_cache_dir=EXTRACTION_CACHE_DIR, layout=DEFAULT_LAYOUT):
+    results = {}
+    failures = {}
+    cache_stats = {'hits': 0, 'misses': 0}
+    with ProcessPoolExecutor(max_workers=workers or os.cpu_count(),
+                             initializer=init_worker, initargs=(model_path, cache_path, extraction_cache_dir, layout)) as executor:
+        futures = {executor.submit(process_statement, path): path for path in pdf_paths}
+        for future in as_completed(futures):
+            path = futures[future]
+            try:
+                results[path], (hits, misses), snapshot = future.result()
+                metrics.merge(snapshot)
+                cache_stats['hits'] += hits
+                cache_stats['misses'] += misses
+                logger.info("Processed %s: %s transactions", path, len(results[path]))
+            except Exception as e:
+                failures[path] = e
+                logger.error("Failed to process %s: %s", path, e)
+
+    return merge_results(pdf_paths, results), failures, cache_stats
+
+# Function to extract statements across the pool, then screen them for duplicates and categorize
+# them in input order; screening one statement after another is what catches overlaps between them
+def ingest_statements_screened(pdf_paths, duplicates, model_path=None, workers=None, cache_path=CACHE_PATH,
+                               extraction_cache_dir=EXTRACTION_CACHE_DIR, year=None, layout=DEFAULT_LAYOUT):
+    model = load_model(model_path) if model_path else None
+    cache = open_category_cache(model_path, cache_path)
+    results = {}
+    failures = {}
+    cache_stats = {'hits': 0, 'misses': 0}
+    with ProcessPoolExecutor(max_workers=workers or os.cpu_count(),
+                             initializer=init_worker, initargs=(None, None, extraction_cache_dir, layout)) as executor:
+        futures = {path: executor.submit(extract_statement, path) for path in pdf_paths}
+        for path in pdf_paths:
+            try:
+                transactions, snapshot = futures[path].result()
+                metrics.merge(snapshot)
+                results[path], (hits, misses) = screen_and_categorize(transactions, path, model, cache, duplicates, year)
+                cache_stats['hits'] += hits
+                cache_stats['misses'] += misses
+                logger.info("Processed %s: %s transactions", path, len(results[path]))
+            except Exception as e:
+                failures[path] = e
+                logger.error("Failed to process %s: %s", path, e)
+    return merge_results(pdf_paths, results), failures, cache_stats
+
+# Function to process statements one at a time, spreading each statement's pages across the pool
+def ingest_statements_by_page(pdf_paths, model_path=None, workers=None, cache_path=CACHE_PATH,
+                              extraction_cache_dir=EXTRACTION_CACHE_DIR, duplicates=None, year=None,
+                              layout=DEFAULT_LAYOUT):
+    model = load_model(model_path) if model_path else None
+    cache = open_category_cache(model_path, cache_path)
+    results = {}
+    failures = {}
+    cache_stats = {'hits': 0, 'misses': 0}
+    for path in pdf_paths:
+        try:
+            transactions = extract_transactions_from_pdf_parallel(path, workers, cache_dir=extraction_cache_dir,
+                                                                  layout=layout)
+            if duplicates is not None:
+                results[path], (hits, misses) = screen_and_categorize(transactions, path, model, cache, duplicates, year)
+            else:
+                results[path], (hits, misses) = categorize_statement_cached(transactions, path, model, cache)
+            cache_stats['hits'] += hits
+            cache_stats['misses'] += misses
+            logger.info("Processed %s: %s transactions", path, len(results[path]))
+        except Exception as e:
+            failures[path] = e
+            logger.error("Failed to process %s: %s", path, e)
+    return merge_results(pdf_paths, results), failures, cache_stats
+
+# Function to merge per-file results in input order regardless of completion order
+def merge_results(pdf_paths, results):
+    frames = [results[path] for path in pdf_paths if path in results]
+    if frames:
+        return pd.concat(frames, ignore_index=True)
+    return pd.DataFrame(columns=['date', 'description', 'amount', 'category', 'source_file'])
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Extract and categorize a folder of bank statement PDFs without the GUI.")
+    parser.add_argument('inputs', nargs='+', help="PDF files, directories or glob patterns (e.g. 'statements/**/*.pdf')")
+    parser.add_argument('--categorizer', choices=['ml', 'keywords'], default='ml',
+                        help="Use the trained model (default) or the keyword rules")
+    parser.add_argument('--model', default=MODEL_PATH, help="Path to the trained model file")
+    parser.add_argument('--workers', type=int, default=None, help="Number of worker processes (default: one per core)")
+    parser.add_argument('--split-pages', action='store_true',
+                        help="Spread each statement's pages across the workers instead of one statement per worker "
+                             "(faster for a few very large statements)")
+    parser.add_argument('--cache', default=CACHE_PATH, help="Category cache file shared across runs")
+    parser.add_argument('--no-cache', action='store_true', help="Categorize every description from scratch")
+    parser.add_argument('--no-extraction-cache', action='store_true',
+                        help="Re-read every PDF instead of reusing transactions extracted on earlier runs")
+    parser.add_argument('--dedup', choices=['skip', 'flag'], default=None,
+                        help="Check transactions against those ingested on earlier runs and skip them "
+                             "or keep them with a duplicate column")
+    parser.add_argument('--dedup-index', default=DEDUP_INDEX_PATH, help="Duplicate index file shared across runs")
+    parser.add_argument('--output', default=DEFAULT_OUTPUT, help="CSV file to write the merged transactions to")
+    parser.add_argument('--sheet-url', default=None,
+                        help="Also send the merged transactions to this Google Sheet (through the outbox, see sheets_outbox.py)")
+    parser.add_argument('--sheet-title', default=None,
+                        help="Worksheet to add the transactions to (default: a new Transactions_<date>_<time> worksheet "
+                             "for each run; pass the same title every run to keep adding to one worksheet)")
+    parser.add_argument('--flush-timeout', type=float, default=FLUSH_TIMEOUT,
+                        help="Seconds to wait at exit for the rows to reach the sheet; the rest are sent on the next run "
+                             "(default: %(default)s)")
+    parser.add_argument('--ledger', default=None, help="Also add the transactions to this SQLite ledger file")
+    parser.add_argument('--year', type=int, default=None, help="Year for the dates of statements whose period is not printed in the PDF (default: this year)")
+    parser.add_argument('--layout', default=DEFAULT_LAYOUT, choices=sorted(load_layouts()),
+                        help="Bank statement layout from statement_layouts.json (default: %(default)s)")
+    add_logging_arguments(parser)
+    args = parser.parse_args(argv)
+    configure_logging(args.verbose, args.quiet)
+
+    pdf_paths = collect_pdf_paths(args.inputs)
+    if not pdf_paths:
+        logger.error("No PDF files found")
+        return 1
+
+    model_path = None
+    if args.categorizer == 'ml':
+        if not os.path.exists(args.model):
+            logger.error("Model file not found: %s (train it with 'Banking Model.py' or use --categorizer keywords)", args.model)
+            return 1
+        model_path = args.model
+
+    logger.info("Processing %s statements", len(pdf_paths))
+    cache_path = None if args.no_cache else args.cache
+    extraction_cache_dir = None if args.no_extraction_cache else EXTRACTION_CACHE_DIR
+    duplicates = DuplicateIndex(args.dedup_index, args.dedup) if args.dedup else None
+    if args.split_pages:
+        combined, failures, cache_stats = ingest_statements_by_page(pdf_paths, model_path, args.workers, cache_path,
+                                                                    extraction_cache_dir, duplicates, args.year, args.layout)
+    elif duplicates is not None:
+        combined, failures, cache_stats = ingest_statements_screened(pdf_paths, duplicates, model_path, args.workers,
+                                                                     cache_path, extraction_cache_dir, args.year, args.layout)
+    else:
+        combined, failures, cache_stats = ingest_statements(pdf_paths, model_path, args.workers, cache_path,
+                                                            extraction_cache_dir, args.layout)
+    if cache_path:
+        lookups = cache_stats['hits'] + cache_stats['misses']
+        hit_rate = cache_stats['hits'] / lookups * 100 if lookups else 0.0
+        logger.info("Category cache: %s hits, %s misses (%.1f%% hit rate)", cache_stats['hits'], cache_stats['misses'], hit_rate)
+    with metrics.stage('write_csv'):
+        combined.to_csv(args.output, index=False)
+    logger.info("Wrote %s transactions to %s", len(combined), args.output)
+
+    flusher = None
+    if args.sheet_url:
+        from sheets_outbox import BackgroundFlusher, SheetsOutbox
+        from sheets_upload import new_worksheet_title
+        # The rows are safe in the outbox once committed; they are sent in the background while the ledger is written
+        outbox = SheetsOutbox()
+        outbox.enqueue(combined, args.sheet_url, args.sheet_title or new_worksheet_title())
+        outbox.close()
+        flusher = BackgroundFlusher().start()
+
+    if args.ledger:
+        from ledger import Ledger
+        with metrics.stage('ledger'):
+            ledger = Ledger(args.ledger)
+            for source_file, statement in combined.groupby('source_file', sort=False):
+                ledger.add_transactions(statement, source_file, args.year)
+            ledger.close()
+        logger.info("Added %s transactions to the ledger %s", len(combined), args.ledger)
+
+    if duplicates is not None:
+        # Only remember these transactions now that every output has them
+        duplicates.commit()
+        duplicates.close()
+        action = 'Skipped' if args.dedup == 'skip' else 'Flagged'
+        logger.info("%s %s transactions already ingested", action, duplicates.duplicates_found)
+
+    if flusher is not None:
+        flusher.stop(args.flush_timeout)
+
+    report_metrics(args.metrics)
+    return 1 if failures else 0
+
+if __name__ == '__main__':
+    raise SystemExit(main())
@@ -0,0 +1,227 @@
+import argparse
+import json
+import os
+import platform
+import random
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime
+import pandas as pd
+from sheets_outbox import OutboxFlusher, SheetsOutbox
+from sheets_upload import FakeSheetsBackend, SheetsWriter, new_worksheet_title
+from statement_extractor import extract_transactions_from_pdf, iter_region_transactions
+from statement_parser import DEFAULT_LAYOUT, StatementLayout, StatementParser, load_layouts
+from transaction_categorizer import (
+    categorize_transaction,
+    categorize_transaction_ml,
+    load_model,
+    re_categorize_miscellaneous,
+)
+
+# File paths
+MODEL_PATH = 'transaction_categorizer_model.pkl'
+BENCHMARK_DIR = 'benchmark_statements'
+DEFAULT_OUTPUT = 'benchmark_results.json'
+
+# Statement sizes (in pages) measured by default
+DEFAULT_PAGES = [1, 10, 100, 500]
+ROWS_PER_PAGE = 30
+
+# Sheet URL handed to the fake Sheets backend; nothing is sent anywhere
+FAKE_SHEET_URL = 'https://docs.google.com/spreadsheets/d/benchmark/edit'
+
+# A stage more than this much slower than the baseline is reported as a regression,
+# unless the difference is below timer noise
+REGRESSION_THRESHOLD = 1.2
+REGRESSION_MIN_SECONDS = 0.01
+
+# Merchants used for synthetic descriptions: some the keyword rules know, some they don't
+MERCHANTS = [
+    'STARBUCKS STORE 1234', 'EXXONMOBIL 4455', 'ZELLE PAYMENT TO J SMITH', 'SPOTIFY USA', 'SHOPRITE HOLMDEL',
+    'AMAZON MKTPLACE PMTS', 'NETFLIX.COM', 'VERIZON WIRELESS', 'WAWA 8123', 'VALENTINOS RESTAURANT',
+    'PSEG ELECTRIC PAYMENT', 'RANDOM MERCHANT LLC', 'CVS PHARMACY 0091', 'SHELL OIL 5541', 'ACME HARDWARE',
+]
+
+# Function to write a synthetic statement PDF in the layout extract_transactions_from_pdf expects:
+# an "Electronic Payments" section, MM/DD dates, trailing amounts and wrapped description lines
+def generate_statement(pdf_path, pages, rows_per_page=ROWS_PER_PAGE, seed=0):
+    from reportlab.lib.pagesizes import letter
+    from reportlab.pdfgen import canvas
+
+    rng = random.Random(seed)
+    pdf = canvas.Canvas(pdf_path, pagesize=letter)
+    for page in range(pages):
+        y = 750
+        pdf.drawString(50, y, f"Statement page {page + 1} of {pages}   Account ending 1234")
+        y -= 20
+        if page == 0:
+            # Deposits come before the payments section and must not be picked up
+            pdf.drawString(50, y, "Electronic Deposits")
+            y -= 15
+            pdf.drawString(50, y, "01/02 PAYROLL DIRECT DEPOSIT 2,000.00")
+            y -= 15
+            pdf.drawString(50, y, "Electronic Payments")
+            y -= 15
+        for _ in range(rows_per_page):
+            date = f"{rng.randint(1, 12):02d}/{rng.randint(1, 28):02d}"
+            amount = f"{rng.randint(1, 500)}.{rng.randint(0, 99):02d}"
+            pdf.drawString(50, y, f"{date} {rng.choice(MERCHANTS)} {amount}")
+            y -= 11
+            if rng.random() < 0.5:
+                pdf.drawString(60, y, f"REF{rng.randint(1000, 9999)} CARD 1234")
+                y -= 11
+        pdf.showPage()
+    pdf.save()
+
+# Function to get the synthetic statement for a size, generating it the first time
+def statement_for(pages, bench_dir=BENCHMARK_DIR, seed=0):
+    os.makedirs(bench_dir, exist_ok=True)
+    pdf_path = os.path.join(bench_dir, f"statement_{pages}p_seed{seed}.pdf")
+    if not os.path.exists(pdf_path):
+        generate_statement(pdf_path, pages, seed=seed)
+    return pdf_path
+
+# Function to time one stage, then run it again under tracemalloc for its peak memory
+# (tracing slows Python down, so the timed runs are untraced and the best one is kept)
+def measure(run, repeat=1):
+    seconds = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = run()
+        elapsed = time.perf_counter() - start
+        seconds = elapsed if seconds is None else min(seconds, elapsed)
+    tracemalloc.start()
+    try:
+        run()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return result, seconds, peak
+
+# Function to build the result record for one stage
+def stage_result(stage, pages, rows, seconds, peak, **extra):
+    result = {
+        'stage': stage,
+        'pages': pages,
+        'rows': rows,
+        'seconds': round(seconds, 6),
+        'rows_per_sec': round(rows / seconds, 1) if seconds > 0 else None,
+        'peak_memory_bytes': peak,
+    }
+    result.update(extra)
+    return result
+
+# Function to run every stage on one statement size
+def benchmark_statement(pages, model=None, repeat=1, bench_dir=BENCHMARK_DIR):
+    pdf_path = statement_for(pages, bench_dir)
+    results = []
+
+    # Always read the PDF; a cache hit would only measure the JSON reader
+    transactions, seconds, peak = measure(lambda: extract_transactions_from_pdf(pdf_path, cache_dir=None), repeat)
+    rows = len(transactions)
+    results.append(stage_result('extract_transactions_from_pdf', pages, rows, seconds, peak))
+
+    # The same layout read from word positions inside the table region, for comparison with the page text above
+    # Each run starts with no saved regions, so it always includes learning the region and leaves no file behind
+    region_layout = StatementLayout(f"{DEFAULT_LAYOUT}-region", dict(load_layouts()[DEFAULT_LAYOUT], extraction='region'))
+    def extract_table_region():
+        with tempfile.TemporaryDirectory() as folder:
+            return list(iter_region_transactions(pdf_path, StatementParser(region_layout),
+                                                 os.path.join(folder, 'table_regions.json')))
+    region_transactions, seconds, peak = measure(extract_table_region, repeat)
+    results.append(stage_result('extract_table_region', pages, len(region_transactions), seconds, peak))
+
+    descriptions = [t['description'] for t in transactions]
+    df = pd.DataFrame(transactions, columns=['date', 'description', 'amount'])
+
+    categories, seconds, peak = measure(lambda: [categorize_transaction(d) for d in descriptions], repeat)
+    results.append(stage_result('categorize_transaction', pages, rows, seconds, peak))
+    df['category'] = categories
+
+    _, seconds, peak = measure(lambda: re_categorize_miscellaneous(df.copy()), repeat)
+    results.append(stage_result('re_categorize_miscellaneous', pages, rows, seconds, peak))
+
+    if model is not None:
+        _, seconds, peak = measure(lambda: [categorize_transaction_ml(d, model) for d in descriptions], repeat)
+        results.append(stage_result('categorize_transaction_ml', pages, rows, seconds, peak))
+
+    # Each upload gets a fresh fake backend so the request count is per upload
+    backends = []
+    def upload():
+        backends.append(FakeSheetsBackend())
+        return SheetsWriter(backends[-1]).write_dataframe(df, FAKE_SHEET_URL)
+    _, seconds, peak = measure(upload, repeat)
+    results.append(stage_result('sheets_upload', pages, rows, seconds, peak, requests=backends[-1].request_count))
+
+    # The same rows committed to a fresh outbox and flushed, as batch_ingest and streaming_pipeline send them
+    def send_through_outbox():
+        backends.append(FakeSheetsBackend())
+        with tempfile.TemporaryDirectory() as folder:
+            outbox = SheetsOutbox(os.path.join(folder, 'outbox.sqlite'))
+            outbox.enqueue(df, FAKE_SHEET_URL, new_worksheet_title())
+            OutboxFlusher(backends[-1]).flush(outbox)
+            outbox.close()
+    _, seconds, peak = measure(send_through_outbox, repeat)
+    results.append(stage_result('sheets_outbox', pages, rows, seconds, peak, requests=backends[-1].request_count))
+
+    return results
+
+# Function to compare this run with a saved one; returns the stages that got slower
+def find_regressions(results, baseline, threshold=REGRESSION_THRESHOLD):
+    previous = {(r['stage'], r['pages']): r for r in baseline['results']}
+    regressions = []
+    for result in results:
+        before = previous.get((result['stage'], result['pages']))
+        if (before and result['seconds'] > before['seconds'] * threshold
+                and result['seconds'] - before['seconds'] > REGRESSION_MIN_SECONDS):
+            regressions.append((result, before))
+    return regressions
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Time extraction, categorization and upload on synthetic statements.")
+    parser.add_argument('--pages', type=int, nargs='+', default=DEFAULT_PAGES, help="Statement sizes to measure, in pages")
+    parser.add_argument('--model', default=MODEL_PATH, help="Trained model for the ML stages (skipped if missing)")
+    parser.add_argument('--repeat', type=int, default=1, help="Timed runs per stage; the fastest is reported")
+    parser.add_argument('--bench-dir', default=BENCHMARK_DIR, help="Folder for the generated statement PDFs")
+    parser.add_argument('--output', default=DEFAULT_OUTPUT, help="JSON file to write the results to")
+    parser.add_argument('--baseline', default=None, help="Earlier results file to compare against")
+    args = parser.parse_args(argv)
+
+    model = None
+    if os.path.exists(args.model):
+        model = load_model(args.model)
+    else:
+        print(f"Model file not found: {args.model} (skipping the ML stages)")
+
+    results = []
+    for pages in args.pages:
+        for result in benchmark_statement(pages, model, args.repeat, args.bench_dir):
+            print(f"{result['stage']:<32}{pages:>5} pages {result['rows']:>7} rows {result['seconds']:>10.3f}s "
+                  f"{result['rows_per_sec'] or 0:>12.0f} rows/s {result['peak_memory_bytes'] / 1e6:>9.1f} MB")
+            results.append(result)
+
+    report = {
+        'created': datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'model': args.model if model is not None else None,
+        'results': results,
+    }
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"Wrote benchmark results to {args.output}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = find_regressions(results, baseline)
+        for result, before in regressions:
+            print(f"Slower: {result['stage']} at {result['pages']} pages took {result['seconds']:.3f}s "
+                  f"(was {before['seconds']:.3f}s)")
+        if regressions:
+            return 1
+    return 0
+
+if __name__ == '__main__':
+    raise SystemExit(main())
@@ -0,0 +1,299 @@
+import argparse
+import json
+import logging
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.request import Request, urlopen
+
+logger = logging.getLogger(__name__)
+
+# File paths
+MODEL_PATH = 'transaction_categorizer_model.pkl'
+# /statement only reads PDFs inside this folder (by default the folder the service runs from)
+STATEMENT_DIR = '.'
+
+# Where the service listens; only local connections are accepted by default
+HOST = '127.0.0.1'
+PORT = 8765
+SERVICE_URL = f"http://{HOST}:{PORT}"
+
+# Descriptions from concurrent requests are gathered for up to MAX_WAIT_SECONDS,
+# or until MAX_BATCH_SIZE of them are waiting, then categorized in one call
+MAX_BATCH_SIZE = 1024
+MAX_WAIT_SECONDS = 0.002
+
+# The category cache is written back at most this often while the service runs
+CACHE_SAVE_INTERVAL = 60
+
+# Gathers descriptions from concurrent callers into micro-batches for a single predict call
+# predict takes a list of descriptions and returns a tuple of arrays with one entry per description;
+# each caller gets back its own slice of every array
+class MicroBatcher:
+    def __init__(self, predict, max_batch_size=MAX_BATCH_SIZE, max_wait=MAX_WAIT_SECONDS):
+        self.predict = predict
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.jobs = queue.Queue()
+        self.requests = 0
+        self.batches = 0
+        self.items = 0
+        self.thread = threading.Thread(target=self.run, name='micro-batcher', daemon=True)
+        self.thread.start()
+
+    # Function to queue descriptions and get a Future for their results
+    def submit(self, descriptions):
+        future = Future()
+        self.jobs.put((list(descriptions), future))
+        return future
+
+    def run(self):
+        while True:
+            job = self.jobs.get()
+            if job is None:
+                return
+            batch = [job]
+            size = len(job[0])
+            deadline = time.monotonic() + self.max_wait
+            while size < self.max_batch_size:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    job = self.jobs.get(timeout=timeout)
+                except queue.Empty:
+                    break
+                if job is None:
+                    # Finish this batch, then stop
+                    self.jobs.put(None)
+                    break
+                batch.append(job)
+                size += len(job[0])
+            self.run_batch(batch)
+
+    def run_batch(self, batch):
+        descriptions = [description for job_descriptions, _ in batch for description in job_descriptions]
+        try:
+            results = self.predict(descriptions)
+        except Exception as e:
+            for _, future in batch:
+                future.set_exception(e)
+            return
+        start = 0
+        for job_descriptions, future in batch:
+            end = start + len(job_descriptions)
+            future.set_result(tuple(result[start:end] for result in results))
+            start = end
+        self.requests += len(batch)
+        self.batches += 1
+        self.items += len(descriptions)
+
+    def close(self):
+        self.jobs.put(None)
+        self.thread.join()
+
+    def stats(self):
+        return {'requests': self.requests, 'batches': self.batches, 'descriptions': self.items,
+                'mean_batch_size': self.items / self.batches if self.batches else 0.0}
+
+# Keeps the model, keyword rules, merchant index and category cache loaded between requests
+# The cache is only touched from the batcher thread; the model is shared under model_lock
+class CategorizationService:
+    def __init__(self, model_path=None, cache_path=None, max_batch_size=MAX_BATCH_SIZE, max_wait=MAX_WAIT_SECONDS,
+                 statement_dir=STATEMENT_DIR):
+        from category_cache import open_keyword_cache, open_model_cache
+        from merchant_index import get_merchant_index
+        from transaction_categorizer import RULES_PATH, get_category_matcher, load_model
+
+        self.model = load_model(model_path) if model_path else None
+        self.model_lock = threading.Lock()
+        self.cache = None
+        if cache_path:
+            self.cache = open_model_cache(model_path, cache_path) if self.model is not None else \
+                open_keyword_cache(RULES_PATH, cache_path)
+        get_category_matcher()  # Compile the keyword rules now rather than on the first request
+        # Built now so request threads only ever read it
+        self.merchant_index = get_merchant_index()
+        self.statement_dir = os.path.realpath(statement_dir)
+        self.last_save = time.monotonic()
+        self.batcher = MicroBatcher(self.predict, max_batch_size, max_wait)
+
+    # Function to categorize one micro-batch (runs on the batcher thread)
+    def predict(self, descriptions):
+        from transaction_categorizer import categorize_transaction, predict_categories
+
+        if self.model is not None:
+            with self.model_lock:
+                categories, confidences = predict_categories(descriptions, self.model, self.cache)
+            result = ([str(c) for c in categories], [float(c) for c in confidences])
+        else:
+            result = ([categorize_transaction(d, cache=self.cache) for d in descriptions], [None] * len(descriptions))
+        if self.cache is not None and time.monotonic() - self.last_save > CACHE_SAVE_INTERVAL:
+            self.cache.save()
+            self.last_save = time.monotonic()
+        return result
+
+    # Function to categorize descriptions; returns the categories and confidences (None for keywords)
+    def categorize(self, descriptions):
+        return self.batcher.submit(descriptions).result()
+
+    # Function to resolve a requested statement path, refusing anything outside statement_dir
+    # Symlinks and '..' are resolved first, so they cannot lead out of the folder
+    def statement_path(self, path):
+        resolved = os.path.realpath(os.path.join(self.statement_dir, path))
+        if os.path.commonpath([resolved, self.statement_dir]) != self.statement_dir:
+            raise PermissionError(f"{path} is outside the statement folder")
+        return resolved
+
+    # Function to extract, categorize and re-categorize one statement
+    def categorize_statement(self, pdf_path):
+        import pandas as pd
+        from statement_extractor import extract_transactions_from_pdf
+        from transaction_categorizer import re_categorize_miscellaneous
+
+        transactions = extract_transactions_from_pdf(pdf_path)
+        df = pd.DataFrame(transactions, columns=['date', 'description', 'amount'])
+        categories, confidences = self.categorize(df['description'].tolist())
+        df['category'] = categories
+        if self.model is not None:
+            df['confidence'] = confidences
+        df = re_categorize_miscellaneous(df, index=self.merchant_index)
+        # Rows that were not re-categorized have no match_similarity; JSON gets null for them
+        return df.astype(object).where(df.notna(), None).to_dict(orient='records')
+
+    def stats(self):
+        stats = {'categorizer': 'ml' if self.model is not None else 'keywords', 'batching': self.batcher.stats()}
+        if self.cache is not None:
+            stats['cache'] = self.cache.stats()
+        return stats
+
+    def close(self):
+        self.batcher.close()
+        if self.cache is not None:
+            self.cache.save()
+
+# HTTP front end: POST /categorize {"descriptions": [...]}, POST /statement {"path": "..."}, GET /health
+# /statement paths are relative to (and must stay inside) the service's statement folder
+class ServiceHandler(BaseHTTPRequestHandler):
+    service = None
+
+    def send_json(self, status, payload):
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path == '/health':
+            self.send_json(200, self.service.stats())
+        else:
+            self.send_json(404, {'error': f"Unknown endpoint {self.path}"})
+
+    def do_POST(self):
+        try:
+            length = int(self.headers.get('Content-Length', 0))
+            request = json.loads(self.rfile.read(length) or b'{}')
+            if self.path == '/categorize':
+                categories, confidences = self.service.categorize([str(d) for d in request['descriptions']])
+                self.send_json(200, {'categories': categories, 'confidences': confidences})
+            elif self.path == '/statement':
+                try:
+                    path = self.service.statement_path(str(request['path']))
+                except PermissionError as e:
+                    self.send_json(403, {'error': str(e)})
+                    return
+                if not os.path.isfile(path):
+                    self.send_json(404, {'error': f"No such file: {request['path']}"})
+                    return
+                self.send_json(200, {'transactions': self.service.categorize_statement(path)})
+            else:
+                self.send_json(404, {'error': f"Unknown endpoint {self.path}"})
+        except (KeyError, TypeError, ValueError) as e:
+            self.send_json(400, {'error': f"Bad request: {e}"})
+        except Exception as e:
+            logger.exception("Request to %s failed", self.path)
+            self.send_json(500, {'error': str(e)})
+
+    def log_message(self, format, *args):
+        logger.debug(format, *args)
+
+# One thread per connection; a deep listen backlog so bursts of callers are queued, not refused
+class ServiceServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 256
+
+# Function to start the HTTP server for a service (call serve_forever() on the result)
+def make_server(service, host=HOST, port=PORT):
+    handler = type('BoundServiceHandler', (ServiceHandler,), {'service': service})
+    return ServiceServer((host, port), handler)
+
+# Client for tools that categorize through a running service instead of loading the model themselves
+class ServiceClient:
+    def __init__(self, url=SERVICE_URL, timeout=60):
+        self.url = url.rstrip('/')
+        self.timeout = timeout
+
+    def request(self, path, payload=None):
+        data = None if payload is None else json.dumps(payload).encode()
+        request = Request(self.url + path, data=data, headers={'Content-Type': 'application/json'})
+        with urlopen(request, timeout=self.timeout) as response:
+            return json.loads(response.read())
+
+    def categorize(self, descriptions):
+        result = self.request('/categorize', {'descriptions': list(descriptions)})
+        return result['categories'], result['confidences']
+
+    def categorize_statement(self, pdf_path):
+        return self.request('/statement', {'path': os.path.abspath(pdf_path)})['transactions']
+
+    def health(self):
+        return self.request('/health')
+
+def main(argv=None):
+    from category_cache import CACHE_PATH
+    from pipeline_metrics import add_logging_arguments, configure_logging, report_metrics
+
+    parser = argparse.ArgumentParser(description="Keep the categorizer loaded and serve requests over local HTTP.")
+    parser.add_argument('--categorizer', choices=['ml', 'keywords'], default='ml',
+                        help="Use the trained model (default) or the keyword rules")
+    parser.add_argument('--model', default=MODEL_PATH, help="Path to the trained model file")
+    parser.add_argument('--host', default=HOST, help="Address to listen on (default: this machine only)")
+    parser.add_argument('--port', type=int, default=PORT, help="Port to listen on")
+    parser.add_argument('--batch-size', type=int, default=MAX_BATCH_SIZE, help="Most descriptions per model call")
+    parser.add_argument('--max-wait-ms', type=float, default=MAX_WAIT_SECONDS * 1000,
+                        help="How long to wait for more requests before categorizing a batch")
+    parser.add_argument('--no-cache', action='store_true', help="Categorize every description from scratch")
+    parser.add_argument('--statement-dir', default=STATEMENT_DIR,
+                        help="Folder of PDFs that /statement may read (default: the current folder)")
+    add_logging_arguments(parser)
+    args = parser.parse_args(argv)
+    configure_logging(args.verbose, args.quiet)
+
+    model_path = None
+    if args.categorizer == 'ml':
+        if not os.path.exists(args.model):
+            logger.error("Model file not found: %s (train it with 'Banking Model.py' or use --categorizer keywords)", args.model)
+            return 1
+        model_path = args.model
+    service = CategorizationService(model_path, None if args.no_cache else CACHE_PATH,
+                                    args.batch_size, args.max_wait_ms / 1000, args.statement_dir)
+    server = make_server(service, args.host, args.port)
+    logger.info("Serving %s categorization on http://%s:%s", args.categorizer, args.host, server.server_port)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        service.close()
+        logger.info("Batching: %s", service.batcher.stats())
+        report_metrics(args.metrics)
+    return 0
+
+if __name__ == '__main__':
+    raise SystemExit(main())
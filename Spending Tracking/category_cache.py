@@ -0,0 +1,110 @@
+import hashlib
+import sqlite3
+import time
+from collections import OrderedDict
+
+# File paths
+CACHE_PATH = 'category_cache.sqlite'
+MAX_ENTRIES = 50000
+
+# Bumped when the keyword matcher changes how descriptions match, so cached keyword results are redone
+KEYWORD_MATCHER_VERSION = 2
+
+# Function to fingerprint a file (model or keyword rules) so cached results can be tied to it
+def file_signature(path):
+    digest = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+# Persistent normalized description -> category memo shared across runs
+# Entries live in memory as an LRU during a run and are written back by save().
+# Each categorizer gets its own namespace, which is wiped when its signature changes.
+class CategoryCache:
+    def __init__(self, namespace, signature, cache_path=CACHE_PATH, max_entries=MAX_ENTRIES):
+        self.namespace = namespace
+        self.signature = signature
+        self.cache_path = cache_path
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.dirty = set()
+        self.hits = 0
+        self.misses = 0
+        self._load()
+
+    def _connect(self):
+        conn = sqlite3.connect(self.cache_path, timeout=30)
+        conn.execute("CREATE TABLE IF NOT EXISTS cache_meta (namespace TEXT PRIMARY KEY, signature TEXT NOT NULL)")
+        conn.execute("CREATE TABLE IF NOT EXISTS cache_entries ("
+                     "namespace TEXT NOT NULL, description TEXT NOT NULL, category TEXT NOT NULL, "
+                     "confidence REAL, last_used REAL NOT NULL, PRIMARY KEY (namespace, description))")
+        return conn
+
+    def _load(self):
+        with self._connect() as conn:
+            row = conn.execute("SELECT signature FROM cache_meta WHERE namespace = ?", (self.namespace,)).fetchone()
+            if row is None or row[0] != self.signature:
+                # The model or rules changed since these entries were written
+                conn.execute("DELETE FROM cache_entries WHERE namespace = ?", (self.namespace,))
+                conn.execute("INSERT OR REPLACE INTO cache_meta (namespace, signature) VALUES (?, ?)",
+                             (self.namespace, self.signature))
+                return
+            rows = conn.execute("SELECT description, category, confidence FROM cache_entries "
+                                "WHERE namespace = ? ORDER BY last_used DESC LIMIT ?",
+                                (self.namespace, self.max_entries)).fetchall()
+        for description, category, confidence in reversed(rows):
+            self.entries[description] = (category, confidence)
+
+    # Function to look up a normalized description, returning (category, confidence) or None
+    def get(self, description):
+        entry = self.entries.get(description)
+        if entry is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.entries.move_to_end(description)
+        self.dirty.add(description)
+        return entry
+
+    # Function to remember the category for a normalized description
+    def put(self, description, category, confidence=None):
+        self.entries[description] = (category, confidence)
+        self.entries.move_to_end(description)
+        self.dirty.add(description)
+        if len(self.entries) > self.max_entries:
+            evicted, _ = self.entries.popitem(last=False)
+            self.dirty.discard(evicted)
+
+    # Function to write new and recently used entries back to disk and trim it to max_entries
+    def save(self):
+        now = time.time()
+        # Keep the in-memory LRU order when stamping entries with their last use
+        rows = [(self.namespace, description, category, confidence, now + n * 1e-6)
+                for n, (description, (category, confidence)) in enumerate(self.entries.items())
+                if description in self.dirty]
+        with self._connect() as conn:
+            row = conn.execute("SELECT signature FROM cache_meta WHERE namespace = ?", (self.namespace,)).fetchone()
+            if row is not None and row[0] != self.signature:
+                # Another run has already moved on to a newer model or rules file
+                return
+            conn.executemany("INSERT OR REPLACE INTO cache_entries "
+                             "(namespace, description, category, confidence, last_used) VALUES (?, ?, ?, ?, ?)", rows)
+            conn.execute("DELETE FROM cache_entries WHERE namespace = ? AND description NOT IN ("
+                         "SELECT description FROM cache_entries WHERE namespace = ? ORDER BY last_used DESC LIMIT ?)",
+                         (self.namespace, self.namespace, self.max_entries))
+        self.dirty.clear()
+
+    # Function to report the hit/miss counters
+    def stats(self):
+        total = self.hits + self.misses
+        hit_rate = self.hits / total if total else 0.0
+        return {'hits': self.hits, 'misses': self.misses, 'hit_rate': hit_rate, 'entries': len(self.entries)}
+
+# Function to open the cache for the keyword rules categorizer
+def open_keyword_cache(rules_path, cache_path=CACHE_PATH, max_entries=MAX_ENTRIES):
+    return CategoryCache('keywords', f"{file_signature(rules_path)}-v{KEYWORD_MATCHER_VERSION}", cache_path, max_entries)
+
+# Function to open the cache for a trained model
+def open_model_cache(model_path, cache_path=CACHE_PATH, max_entries=MAX_ENTRIES):
+    return CategoryCache('ml', file_signature(model_path), cache_path, max_entries)
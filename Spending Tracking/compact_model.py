@@ -0,0 +1,311 @@
+import argparse
+import json
+import os
+import re
+import numpy as np
+from category_cache import file_signature
+
+# Compact model artifacts: the fitted text features and linear classifier of a trained
+# pipeline, saved as plain arrays in an uncompressed .npz (no pickled objects), plus a
+# NumPy-only predictor that reproduces the pipeline's predict and predict_proba
+
+# File paths
+MODEL_PATH = 'transaction_categorizer_model.pkl'
+
+COMPACT_FORMAT = 'spending-compact-model'
+COMPACT_FORMAT_VERSION = 1
+
+# Runs of whitespace, collapsed before character n-grams are taken (as in scikit-learn)
+WHITE_SPACES = re.compile(r'\s\s+')
+
+# Function to get the compact artifact path that goes with a pickled model
+def compact_path_for(model_path):
+    return os.path.splitext(model_path)[0] + '.npz'
+
+# Function to compute MurmurHash3 (x86, 32-bit) as a signed int, the hash HashingVectorizer uses
+def murmurhash3_32(data, seed=0):
+    c1, c2 = 0xcc9e2d51, 0x1b873593
+    length = len(data)
+    h = seed
+    rounded_end = length & ~3
+    for i in range(0, rounded_end, 4):
+        k = data[i] | data[i + 1] << 8 | data[i + 2] << 16 | data[i + 3] << 24
+        k = (k * c1) & 0xFFFFFFFF
+        k = ((k << 15) | (k >> 17)) & 0xFFFFFFFF
+        k = (k * c2) & 0xFFFFFFFF
+        h ^= k
+        h = ((h << 13) | (h >> 19)) & 0xFFFFFFFF
+        h = (h * 5 + 0xe6546b64) & 0xFFFFFFFF
+    k = 0
+    tail = length & 3
+    if tail == 3:
+        k ^= data[rounded_end + 2] << 16
+    if tail >= 2:
+        k ^= data[rounded_end + 1] << 8
+    if tail >= 1:
+        k ^= data[rounded_end]
+        k = (k * c1) & 0xFFFFFFFF
+        k = ((k << 15) | (k >> 17)) & 0xFFFFFFFF
+        k = (k * c2) & 0xFFFFFFFF
+        h ^= k
+    h ^= length
+    h ^= h >> 16
+    h = (h * 0x85ebca6b) & 0xFFFFFFFF
+    h ^= h >> 13
+    h = (h * 0xc2b2ae35) & 0xFFFFFFFF
+    h ^= h >> 16
+    return h - 0x100000000 if h & 0x80000000 else h
+
+# Function to check that a vectorizer only uses options the compact predictor reproduces
+def check_vectorizer(vectorizer):
+    unsupported = []
+    if vectorizer.analyzer not in ('word', 'char', 'char_wb'):
+        unsupported.append(f"analyzer={vectorizer.analyzer!r}")
+    for option in ('preprocessor', 'tokenizer', 'stop_words', 'strip_accents'):
+        if getattr(vectorizer, option) is not None:
+            unsupported.append(option)
+    if vectorizer.input != 'content':
+        unsupported.append(f"input={vectorizer.input!r}")
+    if unsupported:
+        raise ValueError(f"Cannot export {type(vectorizer).__name__} with {', '.join(unsupported)}")
+
+# Function to export a fitted TF-IDF or hashing text pipeline with a linear classifier
+# source_signature records which pickled model the artifact was made from
+def export_model(model, path, source_signature=None):
+    vectorizer, clf = model.steps[0][1], model.steps[-1][1]
+    check_vectorizer(vectorizer)
+    kind = type(vectorizer).__name__
+    coef = np.asarray(clf.coef_, dtype=np.float64)
+    meta = {
+        'format': COMPACT_FORMAT,
+        'version': COMPACT_FORMAT_VERSION,
+        'source_signature': source_signature,
+        'vectorizer': kind,
+        'analyzer': vectorizer.analyzer,
+        'lowercase': bool(vectorizer.lowercase),
+        'token_pattern': vectorizer.token_pattern,
+        'ngram_range': list(vectorizer.ngram_range),
+        'binary': bool(vectorizer.binary),
+        'norm': vectorizer.norm,
+    }
+    arrays = {}
+    if kind == 'TfidfVectorizer':
+        vocabulary = vectorizer.vocabulary_
+        terms = sorted(vocabulary, key=vocabulary.get)
+        arrays['terms'] = np.array(terms, dtype=str)
+        meta['sublinear_tf'] = bool(vectorizer.sublinear_tf)
+        meta['use_idf'] = bool(vectorizer.use_idf)
+        if vectorizer.use_idf:
+            arrays['idf'] = np.asarray(vectorizer.idf_, dtype=np.float64)
+        columns = np.arange(coef.shape[1])
+    elif kind == 'HashingVectorizer':
+        meta['n_features'] = int(vectorizer.n_features)
+        meta['alternate_sign'] = bool(vectorizer.alternate_sign)
+        # Only hashed features with a weight can change a prediction, so the rest are dropped
+        columns = np.flatnonzero(np.any(coef != 0, axis=0))
+        arrays['feature_index'] = columns.astype(np.int64)
+    else:
+        raise ValueError(f"Cannot export a model with a {kind}")
+
+    # Multinomial logistic regression uses a softmax; one-vs-rest models normalize per-class sigmoids
+    multinomial = type(clf).__name__ == 'LogisticRegression' and getattr(clf, 'multi_class', 'auto') != 'ovr' \
+        and clf.solver != 'liblinear'
+    meta['probability'] = 'softmax' if multinomial else 'ovr'
+    arrays['classes'] = np.array([str(c) for c in clf.classes_], dtype=str)
+    # Stored one row per feature so a document's features are gathered with a single index
+    arrays['coef'] = np.ascontiguousarray(coef[:, columns].T)
+    arrays['intercept'] = np.asarray(clf.intercept_, dtype=np.float64)
+    arrays['meta'] = np.array(json.dumps(meta))
+    with open(path, 'wb') as f:
+        np.savez(f, **arrays)
+    return path
+
+# Linear text classifier loaded from a compact artifact; offers the predict, predict_proba and
+# classes_ that the categorizer uses from the scikit-learn pipeline
+class CompactTextModel:
+    def __init__(self, arrays):
+        self.meta = json.loads(str(arrays['meta']))
+        if self.meta.get('format') != COMPACT_FORMAT or self.meta.get('version') != COMPACT_FORMAT_VERSION:
+            raise ValueError(f"Unsupported model artifact: {self.meta.get('format')} v{self.meta.get('version')}")
+        self.classes_ = arrays['classes'].astype(object)
+        self.coef = arrays['coef']
+        self.intercept = arrays['intercept']
+        self.token_pattern = re.compile(self.meta['token_pattern'])
+        self.min_n, self.max_n = self.meta['ngram_range']
+        self.idf = arrays['idf'] if 'idf' in arrays else None
+        if self.meta['vectorizer'] == 'TfidfVectorizer':
+            self.columns = {term: n for n, term in enumerate(arrays['terms'].tolist())}
+        else:
+            self.columns = {int(index): n for n, index in enumerate(arrays['feature_index'].tolist())}
+        # Hashed bucket and sign of every term seen so far, so each term is hashed once
+        self.hashed_terms = {}
+
+    # Function to split a description into the word or character n-grams the vectorizer counted
+    def analyze(self, description):
+        if self.meta['lowercase']:
+            description = description.lower()
+        analyzer = self.meta.get('analyzer', 'word')
+        if analyzer != 'word':
+            return self.char_ngrams(WHITE_SPACES.sub(' ', description), analyzer == 'char_wb')
+        tokens = self.token_pattern.findall(description)
+        if self.max_n == 1:
+            return tokens
+        # A copy, so longer n-grams are only ever built from the tokens
+        grams = list(tokens) if self.min_n == 1 else []
+        for n in range(max(self.min_n, 2), min(self.max_n, len(tokens)) + 1):
+            grams.extend(' '.join(tokens[i:i + n]) for i in range(len(tokens) - n + 1))
+        return grams
+
+    # Function to split text into character n-grams; for char_wb only within each space-padded word
+    def char_ngrams(self, text, within_words):
+        grams = []
+        if not within_words:
+            for n in range(self.min_n, self.max_n + 1):
+                grams.extend(text[i:i + n] for i in range(len(text) - n + 1))
+            return grams
+        for word in text.split():
+            word = f" {word} "
+            for n in range(self.min_n, self.max_n + 1):
+                if len(word) <= n:
+                    # A word no longer than n is one n-gram, counted once
+                    grams.append(word)
+                    break
+                grams.extend(word[i:i + n] for i in range(len(word) - n + 1))
+        return grams
+
+    # Function to scale a document's raw term counts the way the vectorizer does
+    def weigh(self, counts, columns=None):
+        if self.meta['binary']:
+            counts = np.sign(counts)
+        if self.meta.get('sublinear_tf'):
+            counts = np.log(counts) + 1
+        if self.idf is not None:
+            counts = counts * self.idf[columns]
+        if self.meta['norm'] == 'l2':
+            return counts / np.sqrt(np.dot(counts, counts))
+        if self.meta['norm'] == 'l1':
+            return counts / np.abs(counts).sum()
+        return counts
+
+    # Function to compute each description's feature values as (row, coefficient row, value) arrays
+    def transform(self, descriptions):
+        if self.meta['vectorizer'] == 'HashingVectorizer':
+            return self.transform_hashed(descriptions)
+        rows, columns, values = [], [], []
+        for row, description in enumerate(descriptions):
+            counts = {}
+            for term in self.analyze(description):
+                column = self.columns.get(term)
+                if column is not None:
+                    counts[column] = counts.get(column, 0.0) + 1
+            if counts:
+                cols = np.fromiter(counts.keys(), dtype=np.int64, count=len(counts))
+                weights = self.weigh(np.fromiter(counts.values(), dtype=np.float64, count=len(counts)), cols)
+                rows.extend([row] * len(cols))
+                columns.append(cols)
+                values.append(weights)
+        return self.as_arrays(rows, columns, values)
+
+    # Function to hash descriptions like HashingVectorizer
+    # The norm covers every hashed feature, so features without a weight are only dropped afterwards
+    def transform_hashed(self, descriptions):
+        rows, columns, values = [], [], []
+        n_features = self.meta['n_features']
+        for row, description in enumerate(descriptions):
+            counts = {}
+            for term in self.analyze(description):
+                if term not in self.hashed_terms:
+                    h = murmurhash3_32(term.encode('utf-8'))
+                    # Same bucket as scikit-learn for -2**31, whose abs() would overflow an int32
+                    index = (2147483647 - (n_features - 1)) % n_features if h == -2147483648 else abs(h) % n_features
+                    self.hashed_terms[term] = (index, -1.0 if self.meta['alternate_sign'] and h < 0 else 1.0)
+                index, sign = self.hashed_terms[term]
+                counts[index] = counts.get(index, 0.0) + sign
+            if counts:
+                weights = self.weigh(np.fromiter(counts.values(), dtype=np.float64, count=len(counts)))
+                kept = [(self.columns[index], weight) for index, weight in zip(counts, weights) if index in self.columns]
+                if kept:
+                    rows.extend([row] * len(kept))
+                    columns.append(np.array([column for column, _ in kept], dtype=np.int64))
+                    values.append(np.array([weight for _, weight in kept], dtype=np.float64))
+        return self.as_arrays(rows, columns, values)
+
+    @staticmethod
+    def as_arrays(rows, columns, values):
+        if not columns:
+            return np.array([], dtype=np.int64), np.array([], dtype=np.int64), np.array([], dtype=np.float64)
+        return np.array(rows, dtype=np.int64), np.concatenate(columns), np.concatenate(values)
+
+    def decision_function(self, descriptions):
+        descriptions = list(descriptions)
+        rows, columns, values = self.transform(descriptions)
+        scores = np.tile(self.intercept, (len(descriptions), 1))
+        np.add.at(scores, rows, values[:, None] * self.coef[columns])
+        return scores[:, 0] if self.coef.shape[1] == 1 else scores
+
+    def predict_proba(self, descriptions):
+        scores = self.decision_function(descriptions)
+        if scores.ndim == 1:
+            positive = 1 / (1 + np.exp(-scores))
+            return np.column_stack([1 - positive, positive])
+        if self.meta['probability'] == 'softmax':
+            scores = np.exp(scores - scores.max(axis=1, keepdims=True))
+        else:
+            scores = 1 / (1 + np.exp(-scores))
+        return scores / scores.sum(axis=1, keepdims=True)
+
+    def predict(self, descriptions):
+        scores = self.decision_function(descriptions)
+        if scores.ndim == 1:
+            return self.classes_[(scores > 0).astype(int)]
+        return self.classes_[scores.argmax(axis=1)]
+
+# Function to load a compact artifact; nothing in it is unpickled
+def load_compact_model(path):
+    with np.load(path, allow_pickle=False) as arrays:
+        return CompactTextModel({name: arrays[name] for name in arrays.files})
+
+# Function to read the signature of the pickled model a compact artifact was exported from
+def compact_source_signature(path):
+    with np.load(path, allow_pickle=False) as arrays:
+        return json.loads(str(arrays['meta'])).get('source_signature')
+
+# Function to check whether a compact artifact was exported from the current pickled model
+def is_compact_current(compact_path, model_path):
+    if not os.path.exists(compact_path):
+        return False
+    try:
+        return compact_source_signature(compact_path) == file_signature(model_path)
+    except (OSError, ValueError, KeyError):
+        return False
+
+# Function to export a pickled model next to itself
+def export_model_file(model_path, output=None):
+    import joblib
+    output = output or compact_path_for(model_path)
+    return export_model(joblib.load(model_path), output, file_signature(model_path))
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Export the trained model to a compact, scikit-learn-free .npz file.")
+    parser.add_argument('model', nargs='?', default=MODEL_PATH, help="Pickled model to export")
+    parser.add_argument('--output', default=None, help="Artifact to write (default: the model path with .npz)")
+    parser.add_argument('--check', default=None,
+                        help="CSV with a description column; confirm both models predict the same for every row")
+    args = parser.parse_args(argv)
+
+    output = export_model_file(args.model, args.output)
+    print(f"Exported {args.model} to {output} ({os.path.getsize(output)} bytes)")
+
+    if args.check:
+        import joblib
+        import pandas as pd
+        descriptions = pd.read_csv(args.check)['description'].astype(str).tolist()
+        expected = joblib.load(args.model).predict(descriptions)
+        actual = load_compact_model(output).predict(descriptions)
+        mismatches = int((expected != actual).sum())
+        print(f"Checked {len(descriptions)} descriptions: {mismatches} predictions differ")
+        return 1 if mismatches else 0
+    return 0
+
+if __name__ == '__main__':
+    raise SystemExit(main())
@@ -0,0 +1,105 @@
+import hashlib
+import sqlite3
+from collections import Counter
+from datetime import datetime
+from ledger import amount_to_cents, to_iso_date
+from transaction_categorizer import normalize_description
+
+# File paths
+DEDUP_INDEX_PATH = 'dedup_index.sqlite'
+
+# Function to build the identity of a transaction: date, amount in cents and normalized description
+# The date always carries a year, so the same charge a year later is not taken for a repeat
+# (read from the statement period, or given as year); year-less dates are refused, not fingerprinted
+def transaction_key(transaction, year=None):
+    date = str(transaction['date'])
+    if len(date) <= 5 and not year:
+        raise ValueError(f"Cannot fingerprint {date!r} without a year: pass --year for statements that do not print their period")
+    date = to_iso_date(date, year)
+    return f"{date}|{amount_to_cents(transaction['amount'])}|{normalize_description(transaction['description'])}"
+
+# Function to pair each of a statement's transactions with its fingerprint
+# Identical transactions within one statement get increasing ordinals, so two real
+# same-day, same-amount purchases are kept while a re-imported copy of either is caught
+def iter_fingerprints(transactions, year=None):
+    ordinals = Counter()
+    for transaction in transactions:
+        key = transaction_key(transaction, year)
+        yield transaction, hashlib.blake2b(f"{key}|{ordinals[key]}".encode(), digest_size=12).hexdigest()
+        ordinals[key] += 1
+
+# Persistent set of transaction fingerprints already ingested from any statement
+# All fingerprints are held in memory so each check is a dict lookup. New fingerprints
+# are only written to disk by commit(), once their transactions have been written out.
+# A fingerprint may carry the source key (such as a hash of the PDF) of the statement it came from,
+# so screening that same statement again, as a retried watch-folder job does, keeps its own rows.
+class DuplicateIndex:
+    def __init__(self, path=DEDUP_INDEX_PATH, mode='skip'):
+        if mode not in ('skip', 'flag'):
+            raise ValueError(f"Unknown duplicate mode: {mode}")
+        self.mode = mode
+        self.conn = sqlite3.connect(path, timeout=30)
+        self.conn.execute("CREATE TABLE IF NOT EXISTS seen_transactions ("
+                          "fingerprint TEXT PRIMARY KEY, source_file TEXT, first_seen TEXT NOT NULL, source_key TEXT)")
+        # Indexes made before source keys were recorded get the column
+        if 'source_key' not in {row[1] for row in self.conn.execute("PRAGMA table_info(seen_transactions)")}:
+            self.conn.execute("ALTER TABLE seen_transactions ADD COLUMN source_key TEXT")
+        self.seen = dict(self.conn.execute("SELECT fingerprint, source_key FROM seen_transactions"))
+        self.pending = []
+        self.duplicates_found = 0
+
+    def close(self):
+        self.conn.close()
+
+    # Function to check a statement against the index
+    # Returns the transactions to carry on with and their duplicate flags;
+    # in 'skip' mode duplicates are dropped, in 'flag' mode they are kept and flagged
+    def screen(self, transactions, year=None, source_file=None, source_key=None):
+        kept = []
+        flags = []
+        for transaction, fingerprint in iter_fingerprints(transactions, year):
+            duplicate = self.check(fingerprint, source_file, source_key)
+            if self.mode == 'flag' or not duplicate:
+                kept.append(transaction)
+                flags.append(duplicate)
+        return kept, flags
+
+    # Function to screen transactions one at a time for the streaming pipeline
+    # In 'flag' mode each transaction gets a 'duplicate' key
+    def iter_screen(self, transactions, year=None, source_file=None):
+        for transaction, fingerprint in iter_fingerprints(transactions, year):
+            duplicate = self.check(fingerprint, source_file)
+            if self.mode == 'flag':
+                yield dict(transaction, duplicate=duplicate)
+            elif not duplicate:
+                yield transaction
+
+    # Function to look up one fingerprint; a new one counts as seen for the rest of the run
+    # (so overlapping statements in the same run are caught) and is queued to be recorded
+    # One seen before under the same source key is the statement's own transaction, not a duplicate
+    def check(self, fingerprint, source_file=None, source_key=None):
+        if fingerprint in self.seen:
+            if source_key is not None and self.seen[fingerprint] == source_key:
+                return False
+            self.duplicates_found += 1
+            return True
+        self.seen[fingerprint] = source_key
+        self.pending.append((fingerprint, source_file, source_key))
+        return False
+
+    # Function to record the fingerprints screened since the last commit
+    def commit(self):
+        now = datetime.now().isoformat(timespec='seconds')
+        with self.conn:
+            self.conn.executemany("INSERT OR IGNORE INTO seen_transactions (fingerprint, source_file, first_seen, source_key) "
+                                  "VALUES (?, ?, ?, ?)", [(fingerprint, source_file, now, source_key)
+                                                          for fingerprint, source_file, source_key in self.pending])
+        recorded = len(self.pending)
+        self.pending = []
+        return recorded
+
+    # Function to forget the fingerprints screened since the last commit, when their statement was not written out
+    def rollback(self):
+        for fingerprint, _, _ in self.pending:
+            del self.seen[fingerprint]
+        self.pending = []
@@ -0,0 +1,78 @@
+import json
+import os
+import threading
+from category_cache import file_signature
+from pipeline_metrics import metrics
+
+# Folder holding one JSON-lines file of extracted transactions per (PDF content, parser version)
+EXTRACTION_CACHE_DIR = 'extraction_cache'
+
+# Function to get the cache file for a PDF; the content hash means renamed or moved copies still hit
+def cache_file_for(pdf_path, parser_version, cache_dir=EXTRACTION_CACHE_DIR):
+    return os.path.join(cache_dir, f"{file_signature(pdf_path)}_{parser_version}.jsonl")
+
+# Function to read cached transactions one at a time
+def iter_cached_transactions(cache_file):
+    with open(cache_file) as f:
+        for line in f:
+            yield json.loads(line)
+
+# Function to read cached transactions, or None if the PDF has not been extracted with this parser
+def load_cached_transactions(cache_file):
+    if not os.path.exists(cache_file):
+        return None
+    try:
+        return list(iter_cached_transactions(cache_file))
+    except (OSError, ValueError):
+        # A damaged entry is treated as a miss and rewritten
+        return None
+
+# Function to store extracted transactions, writing to a temporary file first so readers never see half an entry
+def save_cached_transactions(cache_file, transactions):
+    for _ in write_through_cache(cache_file, transactions):
+        pass
+
+# Function to pass transactions through while writing them to the cache
+# The entry only appears once the input is exhausted, so an abandoned run leaves nothing behind
+def write_through_cache(cache_file, transactions):
+    os.makedirs(os.path.dirname(cache_file) or '.', exist_ok=True)
+    # Unique per process and thread, so concurrent extractions of the same PDF never share a file
+    temp_file = f"{cache_file}.{os.getpid()}.{threading.get_ident()}.tmp"
+    completed = False
+    try:
+        with open(temp_file, 'w') as f:
+            for transaction in transactions:
+                f.write(json.dumps(transaction) + '\n')
+                yield transaction
+        os.replace(temp_file, cache_file)
+        completed = True
+    finally:
+        if not completed and os.path.exists(temp_file):
+            os.remove(temp_file)
+
+# Function to run an extraction function through the cache
+# Pass cache_dir=None to always extract from the PDF
+def cached_extraction(pdf_path, parser_version, extract, cache_dir=EXTRACTION_CACHE_DIR):
+    if cache_dir is None:
+        return extract(pdf_path)
+    cache_file = cache_file_for(pdf_path, parser_version, cache_dir)
+    transactions = load_cached_transactions(cache_file)
+    if transactions is None:
+        transactions = extract(pdf_path)
+        save_cached_transactions(cache_file, transactions)
+    else:
+        metrics.count('extraction_cache_hits')
+    return transactions
+
+# Function to stream transactions through the cache: replayed from disk on a hit,
+# otherwise yielded as the extraction generator produces them and saved once it finishes
+def cached_iteration(pdf_path, parser_version, iterate, cache_dir=EXTRACTION_CACHE_DIR):
+    if cache_dir is None:
+        yield from iterate(pdf_path)
+        return
+    cache_file = cache_file_for(pdf_path, parser_version, cache_dir)
+    if os.path.exists(cache_file):
+        metrics.count('extraction_cache_hits')
+        yield from iter_cached_transactions(cache_file)
+    else:
+        yield from write_through_cache(cache_file, iterate(pdf_path))
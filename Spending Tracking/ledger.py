@@ -0,0 +1,288 @@
+import argparse
+import json
+import sqlite3
+from collections import defaultdict
+from datetime import datetime
+from decimal import Decimal
+from statement_parser import leap_day_year
+from transaction_categorizer import normalize_description
+
+# File paths
+LEDGER_PATH = 'ledger.sqlite'
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS statements (
+    id INTEGER PRIMARY KEY,
+    source_file TEXT,
+    imported_at TEXT NOT NULL,
+    source_key TEXT
+);
+CREATE TABLE IF NOT EXISTS transactions (
+    id INTEGER PRIMARY KEY,
+    statement_id INTEGER NOT NULL REFERENCES statements(id),
+    date TEXT NOT NULL,
+    description TEXT NOT NULL,
+    merchant TEXT NOT NULL,
+    amount_cents INTEGER NOT NULL,
+    category TEXT,
+    confidence REAL
+);
+CREATE INDEX IF NOT EXISTS idx_transactions_date ON transactions(date);
+CREATE INDEX IF NOT EXISTS idx_transactions_category_date ON transactions(category, date);
+CREATE INDEX IF NOT EXISTS idx_transactions_merchant ON transactions(merchant);
+CREATE TABLE IF NOT EXISTS category_rollups (
+    month TEXT NOT NULL,
+    category TEXT NOT NULL,
+    total_cents INTEGER NOT NULL,
+    count INTEGER NOT NULL,
+    PRIMARY KEY (month, category)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS merchant_rollups (
+    month TEXT NOT NULL,
+    merchant TEXT NOT NULL,
+    total_cents INTEGER NOT NULL,
+    count INTEGER NOT NULL,
+    PRIMARY KEY (month, merchant)
+) WITHOUT ROWID;
+"""
+
+# Bumped when a ledger made by an older version needs upgrading on open
+SCHEMA_VERSION = 2
+
+# The rollup tables hold per-month totals and counts, kept up to date as transactions are added
+# or recategorized so summaries never rescan the transactions ('' is the uncategorized category)
+CATEGORY_ROLLUP_UPSERT = ("INSERT INTO category_rollups (month, category, total_cents, count) VALUES (?, ?, ?, ?) "
+                          "ON CONFLICT (month, category) DO UPDATE SET "
+                          "total_cents = total_cents + excluded.total_cents, count = count + excluded.count")
+MERCHANT_ROLLUP_UPSERT = ("INSERT INTO merchant_rollups (month, merchant, total_cents, count) VALUES (?, ?, ?, ?) "
+                          "ON CONFLICT (month, merchant) DO UPDATE SET "
+                          "total_cents = total_cents + excluded.total_cents, count = count + excluded.count")
+
+# Function to convert a statement amount such as '1,234.56' or '-12.00' to integer cents
+def amount_to_cents(amount):
+    if isinstance(amount, str):
+        amount = amount.replace(',', '').replace('$', '').strip()
+    return int((Decimal(str(amount)) * 100).to_integral_value())
+
+# Function to turn a statement 'MM/DD' date into an ISO date; statements leave out the year
+# (02/29 in a year that is not a leap year goes to the leap year before it)
+def to_iso_date(date, year):
+    if len(date) > 5:
+        return datetime.strptime(date, '%m/%d/%Y').strftime('%Y-%m-%d')
+    month, day = (int(part) for part in date.split('/'))
+    return f"{leap_day_year(month, day, year):04d}-{month:02d}-{day:02d}"
+
+# Function to total amounts and counts per (month, key) as rows for a rollup upsert
+def rollup_deltas(months, keys, amounts):
+    import pandas as pd
+
+    grouped = pd.DataFrame({'month': months, 'key': keys, 'amount': amounts}).groupby(['month', 'key'], sort=False)
+    totals = grouped['amount'].agg(['sum', 'count'])
+    return [(month, key, int(total), int(count))
+            for (month, key), total, count in zip(totals.index, totals['sum'], totals['count'])]
+
+# Function to check whether an ISO date range covers whole months, so the rollups can answer it
+def is_whole_months(start, end):
+    return start.endswith('-01') and end.endswith('-01')
+
+# Local SQLite ledger of categorized transactions
+class Ledger:
+    def __init__(self, path=LEDGER_PATH):
+        self.conn = sqlite3.connect(path)
+        self.conn.executescript(SCHEMA)
+        version = self.conn.execute("PRAGMA user_version").fetchone()[0]
+        if version < SCHEMA_VERSION:
+            self.upgrade(version)
+        # A statement with a source key is only ever imported once (keys are optional, and NULLs never clash)
+        self.conn.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_statements_source_key ON statements(source_key)")
+
+    def close(self):
+        self.conn.close()
+
+    # Function to bring a ledger made by an older version up to date
+    def upgrade(self, version):
+        columns = {row[1] for row in self.conn.execute("PRAGMA table_info(statements)")}
+        if 'source_key' not in columns:
+            self.conn.execute("ALTER TABLE statements ADD COLUMN source_key TEXT")
+        # Ledgers made before the rollup tables existed get them filled from their transactions once
+        if version < 1:
+            self.rebuild_rollups()
+        self.conn.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+
+    # Function to register a statement import and return its id
+    def add_statement(self, source_file=None):
+        with self.conn:
+            cursor = self.conn.execute("INSERT INTO statements (source_file, imported_at) VALUES (?, ?)",
+                                       (source_file, datetime.now().isoformat(timespec='seconds')))
+        return cursor.lastrowid
+
+    # Function to bulk insert a DataFrame of categorized transactions in a single transaction
+    # Without a year, dates get the latest year that does not put them in the future
+    def insert_transactions(self, df, statement_id, year=None):
+        with self.conn:
+            return self.write_transactions(df, statement_id, year)
+
+    # Function to insert transactions and update the rollups inside the caller's transaction,
+    # so the rollups always match the rows
+    def write_transactions(self, df, statement_id, year=None):
+        from transaction_frame import to_transaction_frame
+
+        frame = to_transaction_frame(df, year)
+        categories = frame['category'].astype(object)
+        categories = categories.where(categories.notna(), None).tolist()
+        confidences = frame['confidence'] if 'confidence' in frame.columns else [None] * len(frame)
+        dates = frame['date'].dt.strftime('%Y-%m-%d')
+        merchants = frame['merchant'].astype(str).tolist()
+        amounts = frame['amount_cents'].tolist()
+        rows = list(zip([statement_id] * len(frame), dates.tolist(), frame['description'].tolist(), merchants,
+                        amounts, categories, list(confidences)))
+        months = dates.str.slice(0, 7).tolist()
+        self.conn.executemany("INSERT INTO transactions "
+                              "(statement_id, date, description, merchant, amount_cents, category, confidence) "
+                              "VALUES (?, ?, ?, ?, ?, ?, ?)", rows)
+        self.conn.executemany(CATEGORY_ROLLUP_UPSERT,
+                              rollup_deltas(months, [category or '' for category in categories], amounts))
+        self.conn.executemany(MERCHANT_ROLLUP_UPSERT, rollup_deltas(months, merchants, amounts))
+        return len(rows)
+
+    # Function to correct the category of some transactions, moving their totals between category rollups
+    # Returns the number of transactions that changed
+    def recategorize(self, transaction_ids, category):
+        ids = json.dumps([int(transaction_id) for transaction_id in transaction_ids])
+        deltas = defaultdict(lambda: [0, 0])
+        with self.conn:
+            rows = self.conn.execute("SELECT substr(date, 1, 7), COALESCE(category, ''), amount_cents FROM transactions "
+                                     "WHERE id IN (SELECT value FROM json_each(?)) AND COALESCE(category, '') != ?",
+                                     (ids, category or '')).fetchall()
+            for month, old_category, amount in rows:
+                for key, sign in (((month, old_category), -1), ((month, category or ''), 1)):
+                    deltas[key][0] += sign * amount
+                    deltas[key][1] += sign
+            self.conn.execute("UPDATE transactions SET category = ? WHERE id IN (SELECT value FROM json_each(?))",
+                              (category, ids))
+            self.conn.executemany(CATEGORY_ROLLUP_UPSERT,
+                                  [(month, key, total, count) for (month, key), (total, count) in deltas.items()])
+            self.conn.execute("DELETE FROM category_rollups WHERE count = 0")
+        return len(rows)
+
+    # Function to correct the category of every transaction from a merchant
+    def recategorize_merchant(self, merchant, category):
+        ids = [row[0] for row in self.conn.execute("SELECT id FROM transactions WHERE merchant = ?",
+                                                   (normalize_description(merchant),))]
+        return self.recategorize(ids, category)
+
+    # Function to recompute the rollup tables from the transactions
+    def rebuild_rollups(self):
+        with self.conn:
+            self.conn.execute("DELETE FROM category_rollups")
+            self.conn.execute("DELETE FROM merchant_rollups")
+            self.conn.execute("INSERT INTO category_rollups (month, category, total_cents, count) "
+                              "SELECT substr(date, 1, 7), COALESCE(category, ''), SUM(amount_cents), COUNT(*) "
+                              "FROM transactions GROUP BY 1, 2")
+            self.conn.execute("INSERT INTO merchant_rollups (month, merchant, total_cents, count) "
+                              "SELECT substr(date, 1, 7), merchant, SUM(amount_cents), COUNT(*) "
+                              "FROM transactions GROUP BY 1, 2")
+
+    # Function to add a whole statement's transactions, together with the statement, in one transaction
+    # A source_key (such as a hash of the PDF) makes importing the same statement again a no-op:
+    # returns None when a statement with that key is already in the ledger
+    def add_transactions(self, df, source_file=None, year=None, source_key=None):
+        with self.conn:
+            cursor = self.conn.execute("INSERT OR IGNORE INTO statements (source_file, imported_at, source_key) "
+                                       "VALUES (?, ?, ?)",
+                                       (source_file, datetime.now().isoformat(timespec='seconds'), source_key))
+            if cursor.rowcount == 0:
+                return None
+            return self.write_transactions(df, cursor.lastrowid, year)
+
+    # Function to total spending per category between two ISO dates (end exclusive)
+    # Whole months are read from the rollups
+    def spending_by_category(self, start, end):
+        if is_whole_months(start, end):
+            return self.conn.execute("SELECT NULLIF(category, ''), SUM(total_cents) / 100.0, SUM(count) "
+                                     "FROM category_rollups WHERE month >= ? AND month < ? "
+                                     "GROUP BY category ORDER BY 2 DESC", (start[:7], end[:7])).fetchall()
+        return self.conn.execute("SELECT category, SUM(amount_cents) / 100.0, COUNT(*) FROM transactions "
+                                 "WHERE date >= ? AND date < ? GROUP BY category ORDER BY 2 DESC",
+                                 (start, end)).fetchall()
+
+    # Function to total one category per month between two ISO dates (end exclusive)
+    # Whole months are read from the rollups
+    def monthly_category_totals(self, category, start, end):
+        if is_whole_months(start, end):
+            return self.conn.execute("SELECT month, total_cents / 100.0, count FROM category_rollups "
+                                     "WHERE category = ? AND month >= ? AND month < ? ORDER BY month",
+                                     (category, start[:7], end[:7])).fetchall()
+        return self.conn.execute("SELECT substr(date, 1, 7), SUM(amount_cents) / 100.0, COUNT(*) FROM transactions "
+                                 "WHERE category = ? AND date >= ? AND date < ? GROUP BY 1 ORDER BY 1",
+                                 (category, start, end)).fetchall()
+
+    # Function to list the merchants with the highest totals between two months ('YYYY-MM', end exclusive)
+    def top_merchants(self, start_month, end_month, limit=10):
+        return self.conn.execute("SELECT merchant, SUM(total_cents) / 100.0, SUM(count) FROM merchant_rollups "
+                                 "WHERE month >= ? AND month < ? GROUP BY merchant ORDER BY 2 DESC LIMIT ?",
+                                 (start_month, end_month, limit)).fetchall()
+
+    # Function to list the transactions for a normalized merchant name
+    def merchant_transactions(self, merchant):
+        return self.conn.execute("SELECT date, description, amount_cents / 100.0, category FROM transactions "
+                                 "WHERE merchant = ? ORDER BY date", (normalize_description(merchant),)).fetchall()
+
+    # Function to count how often each merchant was given each category
+    def merchant_categories(self):
+        return self.conn.execute("SELECT merchant, category, COUNT(*) FROM transactions "
+                                 "WHERE category IS NOT NULL GROUP BY merchant, category").fetchall()
+
+# Sink for streaming_pipeline that writes each chunk to the ledger as one transaction
+class LedgerSink:
+    def __init__(self, path=LEDGER_PATH, year=None):
+        self.ledger = Ledger(path)
+        self.year = year
+        self.statements = {}
+
+    def write(self, chunk):
+        source_file = chunk['source_file'].iloc[0] if 'source_file' in chunk.columns else None
+        if source_file not in self.statements:
+            self.statements[source_file] = self.ledger.add_statement(source_file)
+        self.ledger.insert_transactions(chunk, self.statements[source_file], self.year)
+
+    def close(self):
+        self.ledger.close()
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Query the local transaction ledger.")
+    parser.add_argument('--ledger', default=LEDGER_PATH, help="Ledger database file")
+    parser.add_argument('--start', default=None, help="First date to include (YYYY-MM-DD)")
+    parser.add_argument('--end', default=None, help="Date to stop before (YYYY-MM-DD)")
+    parser.add_argument('--category', default=None, help="Show monthly totals for one category")
+    parser.add_argument('--top-merchants', type=int, default=None, metavar='N',
+                        help="Show the N merchants with the highest totals (whole months of --start to --end)")
+    parser.add_argument('--correct', nargs=2, default=None, metavar=('MERCHANT', 'CATEGORY'),
+                        help="Move every transaction from a merchant to another category")
+    parser.add_argument('--rebuild-rollups', action='store_true', help="Recompute the monthly rollups from the transactions")
+    args = parser.parse_args(argv)
+    if not (args.correct or args.rebuild_rollups) and not (args.start and args.end):
+        parser.error("--start and --end are required")
+
+    ledger = Ledger(args.ledger)
+    if args.correct or args.rebuild_rollups:
+        if args.rebuild_rollups:
+            ledger.rebuild_rollups()
+            print("Rebuilt the monthly rollups")
+        if args.correct:
+            merchant, category = args.correct
+            print(f"Moved {ledger.recategorize_merchant(merchant, category)} transactions to {category}")
+    elif args.top_merchants:
+        for merchant, total, count in ledger.top_merchants(args.start[:7], args.end[:7], args.top_merchants):
+            print(f"{merchant:<40}{total:12.2f}  ({count} transactions)")
+    elif args.category:
+        for month, total, count in ledger.monthly_category_totals(args.category, args.start, args.end):
+            print(f"{month}  {total:12.2f}  ({count} transactions)")
+    else:
+        for category, total, count in ledger.spending_by_category(args.start, args.end):
+            print(f"{category:<20}{total:12.2f}  ({count} transactions)")
+    ledger.close()
+    return 0
+
+if __name__ == '__main__':
+    raise SystemExit(main())
@@ -0,0 +1,193 @@
+import argparse
+import logging
+import math
+import os
+import re
+import threading
+from collections import Counter
+from pipeline_metrics import metrics
+from transaction_categorizer import DEFAULT_CATEGORY, RULES_PATH, load_category_rules, normalize_description
+
+logger = logging.getLogger(__name__)
+
+# File paths
+LABELLED_DATA_FOLDER = 'ModelTrainDoc'
+LEDGER_PATH = 'ledger.sqlite'
+
+# Merchants are compared as sets of character n-grams of their normalized description without spaces,
+# so 'VALENTINOSRESTAURANT' and 'Valentinos Restaurant' are the same merchant
+NGRAM_SIZE = 3
+# Words banks put in front of the merchant name, and digits (store numbers, dates, card numbers),
+# say nothing about the merchant, so they are left out of the key
+BANK_PREFIXES = re.compile(r'^(?:(?:pos|debit|card|checkcard|check|purchase|authorized|on|recurring|payment|ach|'
+                           r'visa|dbt|ppd|web|withdrawal)\s+)+')
+# A known merchant matches when its IDF-weighted Jaccard similarity to the description is at least this...
+MIN_SIMILARITY = 0.5
+# ...at least this share of the n-grams of each of the two names are shared...
+MIN_OVERLAP = 0.5
+# ...and at least this many, so very short names never match by accident
+MIN_SHARED_NGRAMS = 4
+
+# Indexes per (rules file, labeled data folder, ledger), filled in by get_merchant_index
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+# Function to get the key a description is indexed under: the normalized description without
+# bank prefixes, digits or spaces ('POS PURCHASE WAWA 1234 HOLMDEL NJ' -> 'wawaholmdelnj')
+def merchant_key(description):
+    text = re.sub(r'\d+', ' ', normalize_description(str(description)))
+    return re.sub(r'\s+', '', BANK_PREFIXES.sub('', ' '.join(text.split()) + ' '))
+
+# Function to split a merchant key into its set of character n-grams
+def key_ngrams(key):
+    return {key[i:i + NGRAM_SIZE] for i in range(len(key) - NGRAM_SIZE + 1)}
+
+# Inverted index from character n-grams to known merchants and the categories they were given
+# A lookup only scores the merchants that share an n-gram with the description, so it stays
+# well under a millisecond for the few thousand merchants of a household's statements.
+# N-grams are weighted by IDF, so ones many merchants share ('res', 'caf') count for less.
+class MerchantIndex:
+    def __init__(self):
+        self.keys = []
+        self.ids = {}
+        self.votes = []
+        self.sizes = []
+        self.postings = {}
+        self.matches = {}
+        # Total n-gram weight of each merchant, worked out again on the first lookup after an add
+        self.weights = None
+
+    def __len__(self):
+        return len(self.keys)
+
+    # Function to record that a description was given a category (weight times)
+    # A merchant seen with several categories takes the most common one; ties go to the one seen first
+    def add(self, description, category, weight=1):
+        key = merchant_key(description)
+        if not key or not category or category == DEFAULT_CATEGORY:
+            return
+        merchant = self.ids.get(key)
+        if merchant is None:
+            merchant = self.ids[key] = len(self.keys)
+            ngrams = key_ngrams(key)
+            self.keys.append(key)
+            self.votes.append(Counter())
+            self.sizes.append(len(ngrams))
+            for ngram in ngrams:
+                self.postings.setdefault(ngram, []).append(merchant)
+        self.votes[merchant][category] += weight
+        self.matches.clear()
+        self.weights = None
+
+    # Function to find the known merchant nearest to a description
+    # Returns (merchant key, category, similarity), or None when no merchant is close enough
+    def lookup(self, description):
+        key = merchant_key(description)
+        if key in self.matches:
+            return self.matches[key]
+        merchant = self.ids.get(key)
+        if merchant is not None:
+            match = (key, self.votes[merchant].most_common(1)[0][0], 1.0)
+        else:
+            match = self.nearest(key)
+        self.matches[key] = match
+        return match
+
+    # Function to get an n-gram's weight: rarer among the known merchants weighs more
+    def idf(self, ngram):
+        return math.log((len(self.keys) + 1) / (len(self.postings.get(ngram, ())) + 1)) + 1
+
+    def merchant_weights(self):
+        if self.weights is None:
+            self.weights = [0.0] * len(self.keys)
+            for ngram, merchants in self.postings.items():
+                weight = self.idf(ngram)
+                for merchant in merchants:
+                    self.weights[merchant] += weight
+        return self.weights
+
+    def nearest(self, key):
+        ngrams = key_ngrams(key)
+        if len(ngrams) < MIN_SHARED_NGRAMS:
+            return None
+        weights = self.merchant_weights()
+        shared = Counter()
+        shared_weight = Counter()
+        for ngram in ngrams:
+            merchants = self.postings.get(ngram, ())
+            shared.update(merchants)
+            weight = self.idf(ngram)
+            for merchant in merchants:
+                shared_weight[merchant] += weight
+        key_weight = sum(self.idf(ngram) for ngram in ngrams)
+        best = None
+        best_similarity = 0.0
+        for merchant, count in shared.items():
+            if count < MIN_SHARED_NGRAMS or count < MIN_OVERLAP * len(ngrams) or count < MIN_OVERLAP * self.sizes[merchant]:
+                continue
+            similarity = shared_weight[merchant] / (key_weight + weights[merchant] - shared_weight[merchant])
+            if similarity >= MIN_SIMILARITY and similarity > best_similarity:
+                best, best_similarity = merchant, similarity
+        if best is None:
+            return None
+        return self.keys[best], self.votes[best].most_common(1)[0][0], best_similarity
+
+# Function to build the index from the keyword rules, the labeled training data and the ledger's categorized rows
+# Sources that do not exist are skipped; later sources outvote earlier ones only by being more common.
+# Only reads: the training CSVs are read directly rather than through the corpus store, which writes,
+# so worker processes can each build the index at the same time.
+def build_merchant_index(rules_path=RULES_PATH, data_folder=LABELLED_DATA_FOLDER, ledger_path=LEDGER_PATH):
+    index = MerchantIndex()
+    with metrics.stage('merchant_index'):
+        for rule in load_category_rules(rules_path)['rules']:
+            for keyword in rule['keywords']:
+                index.add(keyword, rule['category'])
+        if data_folder and os.path.isdir(data_folder):
+            from training_corpus import list_training_files, read_training_csv
+            for name in list_training_files(data_folder):
+                data = read_training_csv(os.path.join(data_folder, name)).drop_duplicates()
+                for description, category in zip(data['description'], data['category']):
+                    index.add(description, category)
+        if ledger_path and os.path.exists(ledger_path):
+            from ledger import Ledger
+            ledger = Ledger(ledger_path)
+            try:
+                for merchant, category, count in ledger.merchant_categories():
+                    index.add(merchant, category, count)
+            finally:
+                ledger.close()
+    logger.debug("Indexed %s known merchants", len(index))
+    return index
+
+# Function to get the merchant index for a set of sources, building it only once per process
+# The lock keeps threads that ask at the same time from building it twice
+def get_merchant_index(rules_path=RULES_PATH, data_folder=LABELLED_DATA_FOLDER, ledger_path=LEDGER_PATH):
+    key = (rules_path, data_folder, ledger_path)
+    with _indexes_lock:
+        if key not in _indexes:
+            _indexes[key] = build_merchant_index(rules_path, data_folder, ledger_path)
+        return _indexes[key]
+
+def main(argv=None):
+    from pipeline_metrics import add_logging_arguments, configure_logging
+
+    parser = argparse.ArgumentParser(description="Find the known merchant nearest to transaction descriptions.")
+    parser.add_argument('descriptions', nargs='+', help="Transaction descriptions to look up")
+    parser.add_argument('--data', default=LABELLED_DATA_FOLDER, help="Folder of labeled training CSV files")
+    parser.add_argument('--ledger', default=LEDGER_PATH, help="Ledger whose categorized transactions are indexed")
+    add_logging_arguments(parser)
+    args = parser.parse_args(argv)
+    configure_logging(args.verbose, args.quiet)
+
+    index = get_merchant_index(data_folder=args.data, ledger_path=args.ledger)
+    for description in args.descriptions:
+        match = index.lookup(description)
+        if match is None:
+            print(f"{description}: no known merchant")
+        else:
+            merchant, category, similarity = match
+            print(f"{description}: {category} (like {merchant}, similarity {similarity:.2f})")
+    return 0
+
+if __name__ == '__main__':
+    raise SystemExit(main())
@@ -0,0 +1,239 @@
+import argparse
+import hashlib
+import json
+import logging
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+import joblib
+import numpy as np
+from scipy import sparse
+from sklearn.base import clone
+from sklearn.feature_extraction.text import HashingVectorizer, TfidfVectorizer
+from sklearn.linear_model import LogisticRegression, SGDClassifier
+from sklearn.model_selection import StratifiedKFold
+from sklearn.pipeline import Pipeline
+from category_cache import file_signature
+from model_training import LABELLED_DATA_FOLDER, MODEL_PATH, load_training_data, save_manifest, save_model
+from pipeline_metrics import add_logging_arguments, configure_logging
+from training_corpus import list_training_files
+
+logger = logging.getLogger(__name__)
+
+# Fitted features for each (training data, feature set, fold), reused by every classifier and later runs
+FEATURE_CACHE_DIR = 'feature_cache'
+FOLDS = 5
+# Descriptions categorized one at a time to measure per-row prediction latency
+LATENCY_SAMPLE = 200
+
+# Candidate text features: (pipeline step name, vectorizer); step names match model_training's pipelines
+FEATURES = {
+    'word': ('tfidf', TfidfVectorizer()),
+    'word-1-2': ('tfidf', TfidfVectorizer(ngram_range=(1, 2))),
+    'char_wb-2-4': ('tfidf', TfidfVectorizer(analyzer='char_wb', ngram_range=(2, 4))),
+    'char_wb-3-5': ('tfidf', TfidfVectorizer(analyzer='char_wb', ngram_range=(3, 5))),
+    'hashing': ('hashing', HashingVectorizer(alternate_sign=False, n_features=2 ** 18)),
+}
+
+# Candidate classifiers; all give the probabilities the categorizer reports as confidence
+CLASSIFIERS = {
+    'logreg-C0.3': LogisticRegression(C=0.3, max_iter=1000),
+    'logreg-C1': LogisticRegression(max_iter=1000),
+    'logreg-C3': LogisticRegression(C=3, max_iter=1000),
+    'logreg-C10': LogisticRegression(C=10, max_iter=1000),
+    'sgd-log': SGDClassifier(loss='log_loss', random_state=42),
+    'sgd-log-alpha1e-5': SGDClassifier(loss='log_loss', alpha=1e-5, random_state=42),
+}
+
+# Function to list the (feature set, classifier) pairs to try
+# Logistic regression on 2**18 hashed columns takes seconds per fit and scores no better than on TF-IDF
+# features; hashing is only there for the online model, so it is paired with the SGD classifiers
+def candidate_pairs(features, classifiers):
+    return [(feature, classifier) for feature in features for classifier in classifiers
+            if not (FEATURES[feature][0] == 'hashing' and isinstance(CLASSIFIERS[classifier], LogisticRegression))]
+
+# Function to fingerprint the training rows, the folds and a feature set's parameters
+def feature_key(descriptions, labels, folds, feature):
+    digest = hashlib.sha1()
+    for description, label in zip(descriptions, labels):
+        digest.update(f"{description}\t{label}\n".encode())
+    step, vectorizer = FEATURES[feature]
+    digest.update(f"{folds}|{step}|{sorted(vectorizer.get_params().items())!r}".encode())
+    return f"{feature}-{digest.hexdigest()[:16]}"
+
+# Function to get the cached files for one fold of a feature set
+def fold_cache_paths(cache_dir, key, fold):
+    base = os.path.join(cache_dir, f"{key}-fold{fold}")
+    return {'train': base + '-train.npz', 'test': base + '-test.npz', 'vectorizer': base + '-vectorizer.joblib'}
+
+# Function to fit a feature set on one fold's training rows and cache both sparse matrices (runs in a worker)
+# Returns the seconds spent, or 0 when the fold was already cached
+def build_fold_features(feature, fold, descriptions, train_index, test_index, cache_dir, key):
+    paths = fold_cache_paths(cache_dir, key, fold)
+    if all(os.path.exists(path) for path in paths.values()):
+        return 0.0
+    start = time.perf_counter()
+    vectorizer = clone(FEATURES[feature][1])
+    train = vectorizer.fit_transform([descriptions[i] for i in train_index])
+    test = vectorizer.transform([descriptions[i] for i in test_index])
+    # The vectorizer goes last: its file marks the fold as complete
+    sparse.save_npz(paths['train'], train.tocsr(), compressed=False)
+    sparse.save_npz(paths['test'], test.tocsr(), compressed=False)
+    joblib.dump(vectorizer, paths['vectorizer'])
+    return time.perf_counter() - start
+
+# Function to fit and score one classifier on one fold's cached features (runs in a worker)
+# The first fold's fitted classifier is sent back so its latency can be measured afterwards
+def evaluate_candidate(feature, classifier, fold, y_train, y_test, cache_dir, key):
+    paths = fold_cache_paths(cache_dir, key, fold)
+    X_train = sparse.load_npz(paths['train'])
+    X_test = sparse.load_npz(paths['test'])
+    clf = clone(CLASSIFIERS[classifier])
+    start = time.perf_counter()
+    clf.fit(X_train, y_train)
+    fit_seconds = time.perf_counter() - start
+    result = {'feature': feature, 'classifier': classifier, 'fold': fold,
+              'accuracy': float(clf.score(X_test, y_test)), 'fit_seconds': fit_seconds}
+    return result, clf if fold == 0 else None
+
+# Function to measure how long a fitted candidate takes to categorize one description at a time
+# Runs in the parent after the pool has finished, so candidates are not timed while competing for cores
+def measure_latency(feature, clf, descriptions, cache_dir, key):
+    pipeline = Pipeline([(FEATURES[feature][0], joblib.load(fold_cache_paths(cache_dir, key, 0)['vectorizer'])),
+                         ('clf', clf)])
+    start = time.perf_counter()
+    for description in descriptions:
+        pipeline.predict_proba([description])
+    return (time.perf_counter() - start) / len(descriptions) * 1e6
+
+# Function to cross-validate every feature set and classifier pair across a process pool
+# Each feature set is fitted once per fold, then shared by all classifiers through the cache
+def run_model_selection(data, features, classifiers, folds=FOLDS, workers=None, cache_dir=FEATURE_CACHE_DIR):
+    descriptions = data['description'].astype(str).tolist()
+    labels = data['category'].astype(str).to_numpy()
+    splits = list(StratifiedKFold(n_splits=folds, shuffle=True, random_state=42).split(descriptions, labels))
+    keys = {feature: feature_key(descriptions, labels, folds, feature) for feature in features}
+    rng = np.random.default_rng(42)
+    latency_descriptions = [descriptions[i] for i in rng.choice(splits[0][1], min(LATENCY_SAMPLE, len(splits[0][1])),
+                                                                 replace=False)]
+    os.makedirs(cache_dir, exist_ok=True)
+
+    with ProcessPoolExecutor(max_workers=workers or os.cpu_count()) as executor:
+        feature_seconds = {feature: 0.0 for feature in features}
+        futures = {executor.submit(build_fold_features, feature, fold, descriptions, train_index, test_index,
+                                   cache_dir, keys[feature]): feature
+                   for feature in features for fold, (train_index, test_index) in enumerate(splits)}
+        for future, feature in futures.items():
+            feature_seconds[feature] += future.result()
+        logger.info("Features ready for %s feature sets x %s folds", len(features), folds)
+
+        futures = [executor.submit(evaluate_candidate, feature, classifier, fold, labels[train_index], labels[test_index],
+                                   cache_dir, keys[feature])
+                   for feature, classifier in candidate_pairs(features, classifiers)
+                   for fold, (train_index, test_index) in enumerate(splits)]
+        results = []
+        fitted = []
+        for future in futures:
+            result, clf = future.result()
+            results.append(result)
+            if clf is not None:
+                fitted.append((result, clf))
+    for result, clf in fitted:
+        result['latency_us'] = measure_latency(result['feature'], clf, latency_descriptions, cache_dir,
+                                               keys[result['feature']])
+    return summarize_results(results, feature_seconds, folds)
+
+# Function to combine the per-fold results into one row per candidate, most accurate first
+def summarize_results(results, feature_seconds, folds):
+    candidates = {}
+    for result in results:
+        candidates.setdefault((result['feature'], result['classifier']), []).append(result)
+    summary = []
+    for (feature, classifier), rows in candidates.items():
+        accuracies = [row['accuracy'] for row in rows]
+        summary.append({
+            'name': f"{feature}+{classifier}",
+            'feature': feature,
+            'classifier': classifier,
+            'accuracy': float(np.mean(accuracies)),
+            'accuracy_std': float(np.std(accuracies)),
+            # Fitting the features once plus the classifier, per fold
+            'fit_seconds': feature_seconds[feature] / folds + float(np.mean([row['fit_seconds'] for row in rows])),
+            'latency_us': next(row['latency_us'] for row in rows if 'latency_us' in row),
+        })
+    summary.sort(key=lambda row: (-row['accuracy'], row['latency_us']))
+    return summary
+
+# Function to pick the most accurate candidate, only among those fast enough when a latency budget is given
+# Candidates within tolerance of the best accuracy count as tied, and the fastest of them wins
+def pick_winner(summary, max_latency_us=None, tolerance=0.0):
+    eligible = [row for row in summary if max_latency_us is None or row['latency_us'] <= max_latency_us]
+    if not eligible:
+        return None
+    best = max(row['accuracy'] for row in eligible)
+    return min((row for row in eligible if row['accuracy'] >= best - tolerance), key=lambda row: row['latency_us'])
+
+# Function to fit a candidate's pipeline on every training row
+def fit_candidate(data, feature, classifier):
+    step, vectorizer = FEATURES[feature]
+    pipeline = Pipeline([(step, clone(vectorizer)), ('clf', clone(CLASSIFIERS[classifier]))])
+    return pipeline.fit(data['description'].astype(str), data['category'].astype(str))
+
+# Function to log the candidates as a table
+def log_summary(summary, winner=None):
+    logger.info("%-34s%10s%8s%9s%9s", 'candidate', 'accuracy', '+/-', 'fit s', 'us/row')
+    for row in summary:
+        marker = '  <- selected' if winner is not None and row['name'] == winner['name'] else ''
+        logger.info("%-34s%9.2f%%%7.2f%%%9.3f%9.0f%s", row['name'], row['accuracy'] * 100, row['accuracy_std'] * 100,
+                    row['fit_seconds'], row['latency_us'], marker)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Cross-validate candidate categorizer models in parallel and save the best.")
+    parser.add_argument('--data', default=LABELLED_DATA_FOLDER, help="Folder of labeled training CSV files")
+    parser.add_argument('--model', default=MODEL_PATH, help="Where to save the selected model")
+    parser.add_argument('--features', nargs='+', choices=list(FEATURES), default=list(FEATURES),
+                        help="Feature sets to try (default: all)")
+    parser.add_argument('--classifiers', nargs='+', choices=list(CLASSIFIERS), default=list(CLASSIFIERS),
+                        help="Classifiers to try (default: all)")
+    parser.add_argument('--folds', type=int, default=FOLDS, help="Cross-validation folds")
+    parser.add_argument('--workers', type=int, default=None, help="Number of worker processes (default: one per core)")
+    parser.add_argument('--max-latency-us', type=float, default=None,
+                        help="Only select models that categorize one description within this many microseconds")
+    parser.add_argument('--tolerance', type=float, default=0.0,
+                        help="Accuracy difference (e.g. 0.005) within which the faster model is preferred")
+    parser.add_argument('--feature-cache', default=FEATURE_CACHE_DIR, help="Folder for the cached feature matrices")
+    parser.add_argument('--output', default=None, help="Also write every candidate's results to this JSON file")
+    parser.add_argument('--dry-run', action='store_true', help="Report the candidates without saving a model")
+    add_logging_arguments(parser)
+    args = parser.parse_args(argv)
+    configure_logging(args.verbose, args.quiet)
+
+    candidates = candidate_pairs(args.features, args.classifiers)
+    if not candidates:
+        # e.g. --features hashing --classifiers logreg-C1: hashed features are only tried with SGD
+        logger.error("No candidates to compare: hashed features are not paired with logistic regression classifiers")
+        return 1
+    data = load_training_data(args.data)
+    logger.info("Cross-validating %s candidates on %s rows with %s folds", len(candidates), len(data), args.folds)
+    summary = run_model_selection(data, args.features, args.classifiers, args.folds, args.workers, args.feature_cache)
+    winner = pick_winner(summary, args.max_latency_us, args.tolerance)
+    log_summary(summary, winner)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'candidates': summary, 'selected': winner and winner['name']}, f, indent=2)
+    if winner is None:
+        logger.error("No candidate categorizes within %.0f us per description", args.max_latency_us)
+        return 1
+    if args.dry_run:
+        return 0
+
+    pipeline = fit_candidate(data, winner['feature'], winner['classifier'])
+    save_model(pipeline, args.model)
+    fingerprints = {f: file_signature(os.path.join(args.data, f)) for f in list_training_files(args.data)}
+    save_manifest(args.model, fingerprints, winner['name'])
+    logger.info("Saved %s to %s (cross-validated accuracy %.2f%%, %.0f us per description)",
+                winner['name'], args.model, winner['accuracy'] * 100, winner['latency_us'])
+    return 0
+
+if __name__ == '__main__':
+    raise SystemExit(main())
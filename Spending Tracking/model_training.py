@@ -0,0 +1,188 @@
+import json
+import logging
+import os
+import joblib
+import numpy as np
+import pandas as pd
+from sklearn.base import clone
+from sklearn.feature_extraction.text import HashingVectorizer, TfidfVectorizer
+from sklearn.linear_model import LogisticRegression, SGDClassifier
+from sklearn.pipeline import Pipeline
+from sklearn.model_selection import train_test_split
+from category_cache import file_signature
+from compact_model import compact_path_for, export_model
+from training_corpus import list_training_files, load_training_corpus, read_training_csv
+
+logger = logging.getLogger(__name__)
+
+# File paths
+MODEL_PATH = 'transaction_categorizer_model.pkl'
+LABELLED_DATA_FOLDER = 'ModelTrainDoc'
+
+# Passes over the new rows when updating the online model
+INCREMENTAL_EPOCHS = 5
+
+# Function to load labeled data from all CSV files in a folder, read like the corpus store reads them
+def load_labeled_data(folder_path, file_names=None):
+    if file_names is None:
+        file_names = list_training_files(folder_path)
+    data_frames = [read_training_csv(os.path.join(folder_path, f)) for f in file_names]
+    combined_data = pd.concat(data_frames, ignore_index=True)
+    return combined_data
+
+# Function to load every training row, through the columnar corpus store when pyarrow is available
+def load_training_data(folder_path):
+    try:
+        return load_training_corpus(folder_path)
+    except ImportError:
+        return load_labeled_data(folder_path)
+
+# Function to save a trained pipeline along with its compact .npz export
+def save_model(pipeline, model_path):
+    joblib.dump(pipeline, model_path)
+    export_model(pipeline, compact_path_for(model_path), file_signature(model_path))
+
+# Function to train and save the model
+# A template pipeline (e.g. the saved model) is retrained with its own configuration instead of TF-IDF + LogisticRegression
+def train_and_save_model(data, model_path, template=None):
+    X = data['description']
+    y = data['category']
+
+    X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=0.2, random_state=42)
+
+    if template is not None:
+        pipeline = clone(template)
+    else:
+        pipeline = Pipeline([
+            ('tfidf', TfidfVectorizer()),
+            ('clf', LogisticRegression())
+        ])
+
+    pipeline.fit(X_train, y_train)
+    save_model(pipeline, model_path)
+    logger.info("Model trained and saved with accuracy: %.2f%%", pipeline.score(X_test, y_test) * 100)
+    return pipeline
+
+# Function to get the path of the manifest that records which training files a model has seen
+def manifest_path_for(model_path):
+    return os.path.splitext(model_path)[0] + '_manifest.json'
+
+# Function to load a model's training manifest ({file name: fingerprint}), or None if there is none
+def load_manifest(model_path):
+    path = manifest_path_for(model_path)
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        return json.load(f)['files']
+
+# Function to get the model_selection.py candidate a model was chosen as, or None
+def load_selected_candidate(model_path):
+    path = manifest_path_for(model_path)
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        return json.load(f).get('selected')
+
+# Function to save a model's training manifest, with the candidate it was selected as if any
+def save_manifest(model_path, fingerprints, selected=None):
+    manifest = {'files': fingerprints}
+    if selected:
+        manifest['selected'] = selected
+    with open(manifest_path_for(model_path), 'w') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+
+# Function to build the online model: stateless hashed features + a logistic-loss SGD classifier
+# Hashing needs no vocabulary, so new rows can be learned with partial_fit without refitting features
+def build_online_pipeline():
+    return Pipeline([
+        ('hashing', HashingVectorizer(alternate_sign=False, n_features=2 ** 18)),
+        ('clf', SGDClassifier(loss='log_loss', random_state=42))
+    ])
+
+# Function to check whether a saved model can be updated in place
+def is_online_model(model):
+    return isinstance(model, Pipeline) and 'hashing' in model.named_steps and hasattr(model.named_steps['clf'], 'partial_fit')
+
+# Function to train the online model from every training file and save it with its manifest
+# An online model chosen by model_selection.py is rebuilt with its own settings
+def rebuild_online_model(folder_path, model_path, fingerprints, template=None, selected=None):
+    data = load_training_data(folder_path)
+    X_train, X_test, y_train, y_test = train_test_split(data['description'], data['category'], test_size=0.2, random_state=42)
+
+    pipeline = clone(template) if template is not None else build_online_pipeline()
+    pipeline.fit(X_train, y_train)
+    save_model(pipeline, model_path)
+    save_manifest(model_path, fingerprints, selected)
+    logger.info("Model rebuilt from %s files and saved with accuracy: %.2f%%", len(fingerprints), pipeline.score(X_test, y_test) * 100)
+    return pipeline
+
+# Function to refit a model chosen by model_selection.py on every training file, keeping its configuration
+def refit_selected_model(model, folder_path, model_path, fingerprints, selected):
+    data = load_training_data(folder_path)
+    pipeline = clone(model).fit(data['description'].astype(str), data['category'].astype(str))
+    save_model(pipeline, model_path)
+    save_manifest(model_path, fingerprints, selected)
+    logger.info("Model %s refitted on %s rows from %s files", selected, len(data), len(fingerprints))
+    return pipeline
+
+# Function to retrain a model that cannot learn incrementally (e.g. TF-IDF + LogisticRegression) on every training file
+def retrain_model(model, folder_path, model_path, fingerprints):
+    pipeline = train_and_save_model(load_training_data(folder_path), model_path, template=model)
+    save_manifest(model_path, fingerprints)
+    return pipeline
+
+# Function to update the model with only the training files that are new or changed since the last run
+# Falls back to a full rebuild when asked to, when there is no model yet, or when
+# the new files introduce a category the model has never seen (SGD cannot add classes).
+# A saved model that cannot learn incrementally (the original TF-IDF pickle or a model chosen by
+# model_selection.py) is retrained as the same kind of model, unless switch_to_online asks for
+# the one-time move to the online model; later updates then learn only the new files.
+def update_model_incrementally(folder_path, model_path, full=False, switch_to_online=False):
+    fingerprints = {f: file_signature(os.path.join(folder_path, f)) for f in list_training_files(folder_path)}
+    manifest = load_manifest(model_path)
+    model = joblib.load(model_path) if os.path.exists(model_path) else None
+    selected = load_selected_candidate(model_path)
+    if model is not None and not is_online_model(model):
+        if switch_to_online:
+            logger.info("Replacing the %s model with the online model", type(model.steps[0][1]).__name__)
+            return rebuild_online_model(folder_path, model_path, fingerprints)
+        if not full and manifest == fingerprints:
+            logger.info("Model is already up to date with the training files")
+            return model
+        if not full:
+            logger.info("The saved model cannot learn new files on their own, so it is retrained from every file "
+                        "(switch to the online model once to make updates quick)")
+        if selected:
+            return refit_selected_model(model, folder_path, model_path, fingerprints, selected)
+        return retrain_model(model, folder_path, model_path, fingerprints)
+    if full or manifest is None or model is None:
+        template = model if selected and model is not None and is_online_model(model) else None
+        return rebuild_online_model(folder_path, model_path, fingerprints, template, selected if template else None)
+
+    changed = [f for f, fingerprint in fingerprints.items() if manifest.get(f) != fingerprint]
+    if not changed:
+        logger.info("Model is already up to date with the training files")
+        return model
+
+    data = load_labeled_data(folder_path, changed)
+    clf = model.named_steps['clf']
+    new_categories = set(data['category']) - set(clf.classes_)
+    if new_categories:
+        logger.info("New categories %s found, rebuilding the model", sorted(new_categories))
+        return rebuild_online_model(folder_path, model_path, fingerprints, model if selected else None, selected)
+
+    X = model.named_steps['hashing'].transform(data['description'])
+    y = data['category'].to_numpy()
+    # Score the new rows before learning them, as an estimate of accuracy on unseen data
+    accuracy = clf.score(X, y)
+
+    rng = np.random.default_rng(42)
+    for _ in range(INCREMENTAL_EPOCHS):
+        order = rng.permutation(len(y))
+        clf.partial_fit(X[order], y[order])
+
+    save_model(model, model_path)
+    save_manifest(model_path, fingerprints, selected)
+    logger.info("Model updated with %s rows from %s new or changed files (accuracy on them before the update: %.2f%%)",
+                len(y), len(changed), accuracy * 100)
+    return model
@@ -1,8 +1,9 @@
 import tkinter as tk
 from tkinter import filedialog, messagebox
 import pandas as pd
-import pdfplumber
 import os
+from statement_extractor import extract_transactions_from_pdf
+from transaction_frame import amounts_to_cents
 
 def categorize(description):
     description = description.lower()
@@ -21,46 +22,17 @@ def categorize(description):
     else:
         return 'Other'
 
+# Statements list both deposits and payments; their amounts may have thousands separators
+LAYOUT = 'deposits-and-payments'
+
 def extract_transactions(pdf_path):
-    transactions = []
-    with pdfplumber.open(pdf_path) as pdf:
-        for page in pdf.pages:
-            text = page.extract_text()
-            if "Electronic Deposits" in text:
-                lines = text.split('\n')
-                capture = False
-                for line in lines:
-                    if "Electronic Deposits" in line:
-                        capture = True
-                    if "Checks Paid" in line:
-                        capture = False
-                    if capture and any(char.isdigit() for char in line):
-                        parts = line.split()
-                        date = parts[0]
-                        amount = parts[-1]
-                        description = " ".join(parts[1:-1])
-                        transactions.append([date, description, amount])
-            elif "Electronic Payments" in text:
-                lines = text.split('\n')
-                capture = False
-                for line in lines:
-                    if "Electronic Payments" in line:
-                        capture = True
-                    if "Daily Balance Summary" in line:
-                        capture = False
-                    if capture and any(char.isdigit() for char in line):
-                        parts = line.split()
-                        date = parts[0]
-                        amount = parts[-1]
-                        description = " ".join(parts[1:-1])
-                        transactions.append([date, description, amount])
-    return transactions
+    return [[t['date'], t['description'], t['amount']] for t in extract_transactions_from_pdf(pdf_path, layout=LAYOUT)]
 
 def convert_and_process_pdf(file_path):
     try:
         transactions = extract_transactions(file_path)
         df = pd.DataFrame(transactions, columns=['Date', 'Description', 'Amount'])
-        df['Amount'] = df['Amount'].str.replace(',', '').astype(float)
+        df['Amount'] = amounts_to_cents(df['Amount']) / 100
         df['Category'] = df['Description'].apply(categorize)
         
         # Save DataFrame to CSV
@@ -0,0 +1,103 @@
+import json
+import logging
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+# Libraries that log heavily at DEBUG; they stay at WARNING even in verbose mode
+NOISY_LOGGERS = ['pdfminer', 'pdfplumber', 'PIL', 'urllib3', 'google', 'gspread']
+
+# Stage timers and counters for one run of the pipeline
+# Worker processes keep their own; send snapshot() back to the parent and merge() it there
+class PipelineMetrics:
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.seconds = defaultdict(float)
+        self.calls = defaultdict(int)
+        self.counters = defaultdict(int)
+
+    # Function to add to a counter such as pages or rows_extracted
+    def count(self, name, amount=1):
+        self.counters[name] += amount
+
+    # Function to time a block of code as a named stage; repeated stages add up
+    @contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.seconds[name] += time.perf_counter() - start
+            self.calls[name] += 1
+
+    # Function to pass through an iterator, timing only the work of producing its items
+    # (for generators whose consumer does other work between items)
+    def timed_iter(self, name, items):
+        iterator = iter(items)
+        self.calls[name] += 1
+        while True:
+            start = time.perf_counter()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+            finally:
+                self.seconds[name] += time.perf_counter() - start
+            yield item
+
+    def snapshot(self):
+        return {
+            'stages': {name: {'seconds': round(self.seconds[name], 6), 'calls': self.calls[name]} for name in self.seconds},
+            'counters': dict(self.counters),
+        }
+
+    def merge(self, snapshot):
+        for name, stage in snapshot['stages'].items():
+            self.seconds[name] += stage['seconds']
+            self.calls[name] += stage['calls']
+        for name, amount in snapshot['counters'].items():
+            self.counters[name] += amount
+
+    # Function to log one line per stage and counter
+    def log_summary(self, log=logger):
+        for name in self.seconds:
+            log.info("%-20s%10.3fs  (%s calls)", name, self.seconds[name], self.calls[name])
+        for name, amount in self.counters.items():
+            log.info("%-20s%10s", name, amount)
+
+    def write_json(self, path):
+        with open(path, 'w') as f:
+            json.dump(self.snapshot(), f, indent=2)
+
+# Metrics for this process, shared by every pipeline module
+metrics = PipelineMetrics()
+
+# Function to set up logging for a script: progress at INFO by default,
+# per-line parsing detail with verbose, warnings and errors only with quiet
+def configure_logging(verbose=False, quiet=False):
+    if verbose:
+        level = logging.DEBUG
+    elif quiet:
+        level = logging.WARNING
+    else:
+        level = logging.INFO
+    logging.basicConfig(level=level, format='%(message)s')
+    for name in NOISY_LOGGERS:
+        logging.getLogger(name).setLevel(max(level, logging.WARNING))
+
+# Function to add the logging and metrics options shared by the command-line scripts
+def add_logging_arguments(parser):
+    parser.add_argument('-v', '--verbose', action='store_true', help="Log every parsed line and transaction")
+    parser.add_argument('-q', '--quiet', action='store_true', help="Only log warnings and errors")
+    parser.add_argument('--metrics', default=None, help="Also write the stage timings and counters to this JSON file")
+
+# Function to log the run's metrics and write them to a JSON file if one was asked for
+def report_metrics(metrics_path=None):
+    metrics.log_summary()
+    if metrics_path:
+        metrics.write_json(metrics_path)
+        logger.info("Wrote metrics to %s", metrics_path)
@@ -0,0 +1,404 @@
+import argparse
+import json
+import logging
+import random
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+from pipeline_metrics import add_logging_arguments, configure_logging, metrics, report_metrics
+from sheets_upload import (
+    CREDENTIALS_PATH,
+    MAX_PAYLOAD_BYTES,
+    GspreadBackend,
+    SheetsRateLimitError,
+    chunk_rows,
+    new_worksheet_title,
+    spreadsheet_id_from_url,
+)
+
+logger = logging.getLogger(__name__)
+
+# File paths
+OUTBOX_PATH = 'sheets_outbox.sqlite'
+
+# The background flusher sends everything pending at most this often, so rows from
+# many statements and runs go out together in as few requests as possible
+FLUSH_INTERVAL = 2.0
+# How long a run waits by default for its rows to be sent before leaving them for the next run
+FLUSH_TIMEOUT = 15.0
+
+# After a failed send the destination waits RETRY_DELAY, doubling each time up to MAX_RETRY_DELAY
+# (truncated exponential backoff, with jitter, as the Sheets API documentation asks for)
+RETRY_DELAY = 1.0
+MAX_RETRY_DELAY = 64.0
+
+# The outbox holds rows waiting to be written to a worksheet. Each row is given its row number in the
+# worksheet before anything is sent, and sent as a values update of exactly that range. Sending a row
+# again after a crash or a lost response only writes the same values to the same cells, so every row
+# appears in the sheet exactly once however often it is retried.
+OUTBOX_SCHEMA = """
+CREATE TABLE IF NOT EXISTS destinations (
+    id INTEGER PRIMARY KEY,
+    sheet_url TEXT NOT NULL,
+    title TEXT NOT NULL,
+    header TEXT NOT NULL DEFAULT '[]',
+    header_written INTEGER NOT NULL DEFAULT 0,
+    next_row INTEGER NOT NULL DEFAULT 2,
+    delivered_rows INTEGER NOT NULL DEFAULT 0,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    next_attempt_at REAL NOT NULL DEFAULT 0,
+    last_error TEXT,
+    UNIQUE (sheet_url, title)
+);
+CREATE TABLE IF NOT EXISTS outbox (
+    id INTEGER PRIMARY KEY,
+    destination_id INTEGER NOT NULL REFERENCES destinations(id),
+    row_values TEXT NOT NULL,
+    queued_at TEXT NOT NULL,
+    sheet_row INTEGER
+);
+CREATE INDEX IF NOT EXISTS idx_outbox_destination ON outbox(destination_id, sheet_row);
+CREATE TABLE IF NOT EXISTS batches (
+    destination_id INTEGER NOT NULL REFERENCES destinations(id),
+    batch_key TEXT NOT NULL,
+    queued_at TEXT NOT NULL,
+    PRIMARY KEY (destination_id, batch_key)
+) WITHOUT ROWID;
+"""
+
+# Function to get the delay before retrying a destination that has failed attempts times in a row
+def retry_delay(attempts, retry_after=None):
+    delay = min(MAX_RETRY_DELAY, RETRY_DELAY * 2 ** (attempts - 1))
+    delay *= 0.5 + random.random() / 2
+    return max(delay, retry_after or 0)
+
+# Durable queue of rows to write to Google Sheets, shared by every run on this machine
+class SheetsOutbox:
+    def __init__(self, path=OUTBOX_PATH):
+        # Transactions are managed explicitly so that numbering rows can take the write lock up front
+        self.conn = sqlite3.connect(path, timeout=30, isolation_level=None)
+        self.conn.executescript(OUTBOX_SCHEMA)
+
+    def close(self):
+        self.conn.close()
+
+    @contextmanager
+    def transaction(self):
+        self.conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield
+        except BaseException:
+            self.conn.execute("ROLLBACK")
+            raise
+        self.conn.execute("COMMIT")
+
+    # Function to get the id of a destination worksheet, adding it the first time
+    def destination_id(self, sheet_url, title):
+        self.conn.execute("INSERT OR IGNORE INTO destinations (sheet_url, title) VALUES (?, ?)", (sheet_url, title))
+        return self.conn.execute("SELECT id FROM destinations WHERE sheet_url = ? AND title = ?",
+                                 (sheet_url, title)).fetchone()[0]
+
+    # Function to commit a DataFrame's rows to the outbox in one transaction; returns the number of rows
+    # A batch_key (such as a hash of the statement) makes queueing the same rows for a worksheet again a no-op
+    # that returns 0, so a retried job never sends its rows twice
+    def enqueue(self, df, sheet_url, title, batch_key=None):
+        records = df.astype(object).where(df.notna(), '').to_dict(orient='records')
+        queued_at = datetime.now().isoformat(timespec='seconds')
+        with self.transaction():
+            destination = self.destination_id(sheet_url, title)
+            if batch_key is not None:
+                cursor = self.conn.execute("INSERT OR IGNORE INTO batches (destination_id, batch_key, queued_at) "
+                                           "VALUES (?, ?, ?)", (destination, batch_key, queued_at))
+                if cursor.rowcount == 0:
+                    return 0
+            self.conn.executemany("INSERT INTO outbox (destination_id, row_values, queued_at) VALUES (?, ?, ?)",
+                                  [(destination, json.dumps(record, default=str), queued_at) for record in records])
+        metrics.count('rows_queued_for_sheets', len(records))
+        return len(records)
+
+    # Function to give the destination's new rows their row numbers and widen its header to their columns
+    def number_rows(self, destination):
+        with self.transaction():
+            header, next_row = self.conn.execute("SELECT header, next_row FROM destinations WHERE id = ?",
+                                                 (destination,)).fetchone()
+            header = json.loads(header)
+            known = set(header)
+            rows = self.conn.execute("SELECT id, row_values FROM outbox WHERE destination_id = ? AND sheet_row IS NULL "
+                                     "ORDER BY id", (destination,)).fetchall()
+            for _, row_values in rows:
+                for column in json.loads(row_values):
+                    if column not in known:
+                        known.add(column)
+                        header.append(column)
+            self.conn.executemany("UPDATE outbox SET sheet_row = ? WHERE id = ?",
+                                  [(next_row + n, row_id) for n, (row_id, _) in enumerate(rows)])
+            self.conn.execute("UPDATE destinations SET header = ?, next_row = ? WHERE id = ?",
+                              (json.dumps(header), next_row + len(rows), destination))
+
+    # Function to list the destinations with rows waiting: (id, sheet_url, title, pending rows, seconds until due)
+    def pending(self):
+        now = time.time()
+        return [(destination, sheet_url, title, count, max(0.0, next_attempt_at - now))
+                for destination, sheet_url, title, count, next_attempt_at in self.conn.execute(
+                    "SELECT d.id, d.sheet_url, d.title, COUNT(o.id), d.next_attempt_at FROM destinations d "
+                    "JOIN outbox o ON o.destination_id = d.id GROUP BY d.id ORDER BY d.id")]
+
+    # Function to get everything the flusher needs to write a destination's numbered rows
+    # Returns the header, how many header columns are in the sheet already, and the (first row, row ids, values)
+    # of each contiguous run of numbered rows
+    def numbered_rows(self, destination):
+        header, header_written = self.conn.execute("SELECT header, header_written FROM destinations WHERE id = ?",
+                                                   (destination,)).fetchone()
+        header = json.loads(header)
+        runs = []
+        for row_id, sheet_row, row_values in self.conn.execute(
+                "SELECT id, sheet_row, row_values FROM outbox WHERE destination_id = ? AND sheet_row IS NOT NULL "
+                "ORDER BY sheet_row", (destination,)):
+            record = json.loads(row_values)
+            values = [record.get(column, '') for column in header]
+            if runs and runs[-1][0] + len(runs[-1][1]) == sheet_row:
+                runs[-1][1].append(row_id)
+                runs[-1][2].append(values)
+            else:
+                runs.append((sheet_row, [row_id], [values]))
+        return header, header_written, runs
+
+    # Function to remove delivered rows from the outbox
+    def mark_delivered(self, destination, row_ids):
+        with self.transaction():
+            self.conn.executemany("DELETE FROM outbox WHERE id = ?", [(row_id,) for row_id in row_ids])
+            self.conn.execute("UPDATE destinations SET delivered_rows = delivered_rows + ? WHERE id = ?",
+                              (len(row_ids), destination))
+
+    def mark_header_written(self, destination, columns):
+        self.conn.execute("UPDATE destinations SET header_written = ? WHERE id = ?", (columns, destination))
+
+    # Function to record a successful flush of a destination
+    def mark_flushed(self, destination):
+        self.conn.execute("UPDATE destinations SET attempts = 0, next_attempt_at = 0, last_error = NULL WHERE id = ?",
+                          (destination,))
+
+    # Function to record a failed flush and schedule the next attempt; returns the delay
+    def mark_failed(self, destination, error, retry_after=None):
+        attempts = self.conn.execute("SELECT attempts FROM destinations WHERE id = ?", (destination,)).fetchone()[0] + 1
+        delay = retry_delay(attempts, retry_after)
+        self.conn.execute("UPDATE destinations SET attempts = ?, next_attempt_at = ?, last_error = ? WHERE id = ?",
+                          (attempts, time.time() + delay, error, destination))
+        return delay
+
+    # Function to summarize each destination: pending and delivered rows, failed attempts and the last error
+    def status(self):
+        return self.conn.execute("SELECT d.sheet_url, d.title, COUNT(o.id), d.delivered_rows, d.attempts, d.last_error "
+                                 "FROM destinations d LEFT JOIN outbox o ON o.destination_id = d.id "
+                                 "GROUP BY d.id ORDER BY d.id").fetchall()
+
+# Sends the outbox's rows to their worksheets, coalescing everything pending for a worksheet into
+# one resize (when the sheet is too small) and one values update per API payload
+class OutboxFlusher:
+    def __init__(self, backend=None, max_payload_bytes=MAX_PAYLOAD_BYTES):
+        self.backend = backend if backend is not None else GspreadBackend(CREDENTIALS_PATH)
+        self.max_payload_bytes = max_payload_bytes
+        self.worksheets = {}
+
+    # Function to send every destination that is due; returns the rows delivered and the seconds
+    # until the next destination with rows left is due (None when the outbox is empty)
+    def flush(self, outbox):
+        delivered = 0
+        for destination, sheet_url, title, count, due_in in outbox.pending():
+            if due_in > 0:
+                continue
+            try:
+                with metrics.stage('upload'):
+                    delivered += self.flush_destination(outbox, destination, sheet_url, title)
+                outbox.mark_flushed(destination)
+            except Exception as e:
+                retry_after = None
+                if isinstance(e, SheetsRateLimitError):
+                    retry_after = e.retry_after
+                else:
+                    # The worksheet may have been deleted or renamed; look it up again next time
+                    self.worksheets.pop(destination, None)
+                delay = outbox.mark_failed(destination, str(e) or type(e).__name__, retry_after)
+                metrics.count('upload_retries')
+                kind = 'Rate limited' if isinstance(e, SheetsRateLimitError) else 'Failed'
+                logger.warning("%s sending %s rows to %s: %s (retrying in %.1fs)", kind, count, title, e, delay)
+        waits = [due_in for _, _, _, _, due_in in outbox.pending()]
+        return delivered, (min(waits) if waits else None)
+
+    def flush_destination(self, outbox, destination, sheet_url, title):
+        outbox.number_rows(destination)
+        header, header_written, runs = outbox.numbered_rows(destination)
+        if not runs:
+            return 0
+        requests = self.backend.request_count
+        last_row = runs[-1][0] + len(runs[-1][2]) - 1
+        worksheet = self.open_worksheet(destination, sheet_url, title, last_row, len(header))
+        if worksheet.row_count < last_row or worksheet.col_count < len(header):
+            self.backend.resize_worksheet(worksheet, max(worksheet.row_count, last_row),
+                                          max(worksheet.col_count, len(header)))
+        if header_written < len(header):
+            # The header goes out with the first rows when they start right below it
+            if runs[0][0] == 2:
+                start_row, row_ids, values = runs[0]
+                runs[0] = (1, [None] + row_ids, [header] + values)
+            else:
+                self.backend.update_values(worksheet, 1, [header])
+                outbox.mark_header_written(destination, len(header))
+        delivered = 0
+        for start_row, row_ids, values in runs:
+            for chunk in chunk_rows(values, self.max_payload_bytes):
+                self.backend.update_values(worksheet, start_row, chunk)
+                chunk_ids = row_ids[:len(chunk)]
+                row_ids = row_ids[len(chunk):]
+                if chunk_ids[0] is None:
+                    outbox.mark_header_written(destination, len(header))
+                    chunk_ids = chunk_ids[1:]
+                outbox.mark_delivered(destination, chunk_ids)
+                delivered += len(chunk_ids)
+                start_row += len(chunk)
+        metrics.count('rows_uploaded', delivered)
+        metrics.count('upload_requests', self.backend.request_count - requests)
+        logger.info("Sent %s rows to %s in %s requests", delivered, title, self.backend.request_count - requests)
+        return delivered
+
+    # Function to get the destination's worksheet, creating it the first time
+    # An earlier attempt may have created it without hearing back, so it is looked up before creating it
+    def open_worksheet(self, destination, sheet_url, title, rows, cols):
+        if destination not in self.worksheets:
+            spreadsheet_id = spreadsheet_id_from_url(sheet_url)
+            worksheet = self.backend.find_worksheet(spreadsheet_id, title)
+            if worksheet is None:
+                worksheet = self.backend.create_worksheet(spreadsheet_id, title, max(rows, 1), max(cols, 1))
+            self.worksheets[destination] = worksheet
+        return self.worksheets[destination]
+
+# Thread that keeps flushing the outbox in the background, so ingestion never waits on the network
+class BackgroundFlusher:
+    def __init__(self, outbox_path=OUTBOX_PATH, backend=None, interval=FLUSH_INTERVAL):
+        self.outbox_path = outbox_path
+        self.flusher = OutboxFlusher(backend)
+        self.interval = interval
+        self.wake = threading.Event()
+        self.draining = threading.Event()
+        self.stopped = threading.Event()
+        self.deadline = None
+        self.delivered = 0
+        self.thread = threading.Thread(target=self.run, name='sheets-outbox', daemon=True)
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def run(self):
+        # SQLite connections stay in the thread that opened them
+        outbox = SheetsOutbox(self.outbox_path)
+        try:
+            while not self.stopped.is_set():
+                delivered, wait = self.flusher.flush(outbox)
+                self.delivered += delivered
+                if wait is None:
+                    if self.draining.is_set():
+                        return
+                    wait = self.interval
+                elif self.draining.is_set() and time.monotonic() + wait > self.deadline:
+                    # The next attempt would come after the run has stopped waiting
+                    return
+                self.wake.wait(wait if self.draining.is_set() else max(wait, self.interval))
+                self.wake.clear()
+        except Exception:
+            logger.exception("Sheets outbox flusher stopped")
+        finally:
+            outbox.close()
+
+    # Function to send what is left, waiting at most timeout seconds; returns the rows still in the outbox
+    # Rows that could not be sent stay in the outbox for the next run
+    def stop(self, timeout=FLUSH_TIMEOUT):
+        self.deadline = time.monotonic() + timeout
+        self.draining.set()
+        self.wake.set()
+        self.thread.join(timeout)
+        self.stopped.set()
+        self.wake.set()
+        outbox = SheetsOutbox(self.outbox_path)
+        try:
+            left = sum(count for _, _, _, count, _ in outbox.pending())
+        finally:
+            outbox.close()
+        if left:
+            logger.warning("%s rows are still waiting in %s; they are sent on the next run "
+                           "or with 'python sheets_outbox.py --flush'", left, self.outbox_path)
+        return left
+
+# Sink for streaming_pipeline that commits each chunk to the outbox while a background flusher sends them
+# Without a title the rows go to a new worksheet named after the time the sink was opened
+class OutboxSink:
+    def __init__(self, sheet_url, title=None, outbox_path=OUTBOX_PATH, backend=None, timeout=FLUSH_TIMEOUT):
+        self.sheet_url = sheet_url
+        self.title = title or new_worksheet_title()
+        self.outbox = SheetsOutbox(outbox_path)
+        self.flusher = BackgroundFlusher(outbox_path, backend).start()
+        self.timeout = timeout
+
+    def write(self, chunk):
+        self.outbox.enqueue(chunk, self.sheet_url, self.title)
+
+    def close(self):
+        self.outbox.close()
+        self.flusher.stop(self.timeout)
+
+# Function to send one DataFrame to a new worksheet through the outbox, for the one-statement scripts
+# Waits up to timeout seconds; returns the rows still waiting, which are sent on the next run
+def send_to_google_sheets(df, sheet_url, title=None, outbox_path=OUTBOX_PATH, backend=None, timeout=FLUSH_TIMEOUT):
+    title = title or new_worksheet_title()
+    outbox = SheetsOutbox(outbox_path)
+    try:
+        outbox.enqueue(df, sheet_url, title)
+    finally:
+        outbox.close()
+    left = BackgroundFlusher(outbox_path, backend).start().stop(timeout)
+    if not left:
+        logger.info("Data sent to Google Sheet: %s", title)
+    return left
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Send the rows waiting in the Google Sheets outbox.")
+    parser.add_argument('--outbox', default=OUTBOX_PATH, help="Outbox file")
+    parser.add_argument('--credentials', default=CREDENTIALS_PATH, help="Google service account key file")
+    parser.add_argument('--flush', action='store_true', help="Send the waiting rows, then exit")
+    parser.add_argument('--watch', action='store_true', help="Keep sending rows as runs add them")
+    parser.add_argument('--timeout', type=float, default=None,
+                        help="With --flush, give up after this many seconds (default: until everything is sent)")
+    add_logging_arguments(parser)
+    args = parser.parse_args(argv)
+    configure_logging(args.verbose, args.quiet)
+
+    outbox = SheetsOutbox(args.outbox)
+    try:
+        if args.flush or args.watch:
+            flusher = OutboxFlusher(GspreadBackend(args.credentials))
+            deadline = None if args.timeout is None else time.monotonic() + args.timeout
+            while True:
+                _, wait = flusher.flush(outbox)
+                if wait is None and not args.watch:
+                    break
+                wait = FLUSH_INTERVAL if wait is None else max(wait, 0.1)
+                if deadline is not None and time.monotonic() + wait > deadline:
+                    break
+                time.sleep(wait)
+        for sheet_url, title, pending, delivered, attempts, last_error in outbox.status():
+            line = f"{title} ({sheet_url}): {pending} waiting, {delivered} sent"
+            if attempts:
+                line += f", {attempts} failed attempts, last error: {last_error}"
+            print(line)
+        left = sum(count for _, _, _, count, _ in outbox.pending())
+    except KeyboardInterrupt:
+        left = 0
+    finally:
+        outbox.close()
+        report_metrics(args.metrics)
+    return 1 if left and args.flush else 0
+
+if __name__ == '__main__':
+    raise SystemExit(main())
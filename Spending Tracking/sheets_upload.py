@@ -0,0 +1,216 @@
+import time
+from collections import deque
+from datetime import datetime
+from pipeline_metrics import metrics
+
+CREDENTIALS_PATH = 'budgetizerv1-f0a6af649026.json'
+
+# Stay well under the Sheets API request size limit when sending values
+MAX_PAYLOAD_BYTES = 2_000_000
+
+# Raised by the backends when the Sheets API rejects a request for going over the rate limit
+class SheetsRateLimitError(Exception):
+    def __init__(self, message, retry_after=None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+# Function to pull the spreadsheet id out of a Google Sheets URL
+def spreadsheet_id_from_url(sheet_url):
+    return sheet_url.split('/d/')[1].split('/')[0]
+
+# Function to name a new worksheet for this run's transactions
+def new_worksheet_title():
+    return datetime.now().strftime('Transactions_%Y%m%d_%H%M%S')
+
+# Function to convert a DataFrame to plain Python rows the Sheets API accepts (header first)
+def dataframe_to_rows(df):
+    values = df.astype(object).where(df.notna(), '').values.tolist()
+    return [[str(column) for column in df.columns]] + values
+
+# Function to split rows into chunks that each fit in one API request
+def chunk_rows(rows, max_payload_bytes=MAX_PAYLOAD_BYTES):
+    chunk = []
+    size = 0
+    for row in rows:
+        # Rough JSON size of the row: quotes and separators per cell plus the text itself
+        row_size = sum(len(str(value)) + 4 for value in row) + 2
+        if chunk and size + row_size > max_payload_bytes:
+            yield chunk
+            chunk = []
+            size = 0
+        chunk.append(row)
+        size += row_size
+    if chunk:
+        yield chunk
+
+# Function to turn a column count into the A1 column letters
+def column_letter(n):
+    letters = ''
+    while n > 0:
+        n, remainder = divmod(n - 1, 26)
+        letters = chr(65 + remainder) + letters
+    return letters
+
+# Backend talking to the real Google Sheets API through gspread
+# The authorized client and opened spreadsheets are reused across uploads
+class GspreadBackend:
+    def __init__(self, credentials_path=CREDENTIALS_PATH):
+        self.credentials_path = credentials_path
+        self.client = None
+        self.spreadsheets = {}
+        self.request_count = 0
+
+    def open_spreadsheet(self, spreadsheet_id):
+        if self.client is None:
+            import gspread
+            from oauth2client.service_account import ServiceAccountCredentials
+            scope = ["https://spreadsheets.google.com/feeds", "https://www.googleapis.com/auth/drive"]
+            creds = ServiceAccountCredentials.from_json_keyfile_name(self.credentials_path, scope)
+            self.client = gspread.authorize(creds)
+        if spreadsheet_id not in self.spreadsheets:
+            self.spreadsheets[spreadsheet_id] = self.client.open_by_key(spreadsheet_id)
+            self.request_count += 1
+        return self.spreadsheets[spreadsheet_id]
+
+    # Function to make one API call, turning the API's rate limit responses into SheetsRateLimitError
+    def send(self, call, *args, **kwargs):
+        from gspread.exceptions import APIError
+        self.request_count += 1
+        try:
+            return call(*args, **kwargs)
+        except APIError as e:
+            if getattr(e.response, 'status_code', None) == 429:
+                retry_after = e.response.headers.get('Retry-After')
+                raise SheetsRateLimitError(str(e), float(retry_after) if retry_after else None) from e
+            raise
+
+    def create_worksheet(self, spreadsheet_id, title, rows, cols):
+        spreadsheet = self.open_spreadsheet(spreadsheet_id)
+        return self.send(spreadsheet.add_worksheet, title=title, rows=rows, cols=cols)
+
+    # Function to get a worksheet by title, or None when the spreadsheet has no such worksheet
+    def find_worksheet(self, spreadsheet_id, title):
+        from gspread.exceptions import WorksheetNotFound
+        spreadsheet = self.open_spreadsheet(spreadsheet_id)
+        try:
+            return self.send(spreadsheet.worksheet, title)
+        except WorksheetNotFound:
+            return None
+
+    def resize_worksheet(self, worksheet, rows, cols):
+        self.send(worksheet.resize, rows=rows, cols=cols)
+
+    def update_values(self, worksheet, start_row, rows):
+        width = max(len(row) for row in rows)
+        range_name = f"A{start_row}:{column_letter(width)}{start_row + len(rows) - 1}"
+        self.send(worksheet.update, range_name=range_name, values=rows, value_input_option='RAW')
+
+# In-process stand-in for Google Sheets, for offline tests and benchmarks
+# Worksheets are plain lists of rows and every call is counted like an API request.
+# With a quota, requests beyond quota per quota_window seconds are refused with SheetsRateLimitError
+# like the real API; fail_next() makes the next requests fail like a dropped connection.
+class FakeSheetsBackend:
+    def __init__(self, quota=None, quota_window=60.0):
+        self.spreadsheets = {}
+        self.request_count = 0
+        self.quota = quota
+        self.quota_window = quota_window
+        self.recent_requests = deque()
+        self.failures = []
+
+    # Function to make the next count requests fail with ConnectionError
+    # With after_write=True the request is carried out first, as when the response is lost on the way back
+    def fail_next(self, count=1, after_write=False):
+        self.failures.extend([after_write] * count)
+
+    # Function to count a request and refuse it when over the quota or set up to fail before writing
+    # Returns whether it should fail after writing
+    def request(self):
+        self.request_count += 1
+        if self.quota is not None:
+            now = time.monotonic()
+            while self.recent_requests and now - self.recent_requests[0] >= self.quota_window:
+                self.recent_requests.popleft()
+            if len(self.recent_requests) >= self.quota:
+                raise SheetsRateLimitError("Quota exceeded for write requests per minute",
+                                           self.quota_window - (now - self.recent_requests[0]))
+            self.recent_requests.append(now)
+        if self.failures:
+            if not self.failures[0]:
+                self.failures.pop(0)
+                raise ConnectionError("Connection reset by peer")
+            return True
+        return False
+
+    def respond(self, lost):
+        if lost:
+            self.failures.pop(0)
+            raise ConnectionError("Connection reset by peer")
+
+    def create_worksheet(self, spreadsheet_id, title, rows, cols):
+        lost = self.request()
+        worksheets = self.spreadsheets.setdefault(spreadsheet_id, {})
+        if title in worksheets:
+            raise ValueError(f"A sheet with the name {title} already exists")
+        worksheets[title] = FakeWorksheet(title, rows, cols)
+        self.respond(lost)
+        return worksheets[title]
+
+    def find_worksheet(self, spreadsheet_id, title):
+        lost = self.request()
+        worksheet = self.spreadsheets.get(spreadsheet_id, {}).get(title)
+        self.respond(lost)
+        return worksheet
+
+    def resize_worksheet(self, worksheet, rows, cols):
+        lost = self.request()
+        worksheet.row_count = int(rows)
+        worksheet.col_count = int(cols)
+        self.respond(lost)
+
+    def update_values(self, worksheet, start_row, rows):
+        lost = self.request()
+        if start_row + len(rows) - 1 > worksheet.row_count:
+            # The real API rejects values updates outside the grid
+            raise ValueError(f"Range exceeds grid limits: {worksheet.row_count} rows")
+        worksheet.set_rows(start_row, rows)
+        self.respond(lost)
+
+# Worksheet held by FakeSheetsBackend
+class FakeWorksheet:
+    def __init__(self, title, rows, cols):
+        self.title = title
+        self.row_count = int(rows)
+        self.col_count = int(cols)
+        self.values = []
+
+    def set_rows(self, start_row, rows):
+        end_row = start_row + len(rows) - 1
+        self.row_count = max(self.row_count, end_row)
+        while len(self.values) < end_row:
+            self.values.append([])
+        for offset, row in enumerate(rows):
+            self.values[start_row - 1 + offset] = list(row)
+
+# Writes a whole DataFrame to a new worksheet sized to fit it, header and rows in one values update
+# (more than one only when the rows exceed the API payload limit); benchmark.py compares it with the outbox
+class SheetsWriter:
+    def __init__(self, backend=None, max_payload_bytes=MAX_PAYLOAD_BYTES):
+        self.backend = backend if backend is not None else GspreadBackend()
+        self.max_payload_bytes = max_payload_bytes
+
+    def create_worksheet(self, sheet_url, title=None, rows=1, cols=1):
+        return self.backend.create_worksheet(spreadsheet_id_from_url(sheet_url), title or new_worksheet_title(), rows, cols)
+
+    def write_dataframe(self, df, sheet_url, title=None):
+        requests = self.backend.request_count
+        with metrics.stage('upload'):
+            rows = dataframe_to_rows(df)
+            sheet = self.create_worksheet(sheet_url, title, len(rows), max(len(df.columns), 1))
+            start_row = 1
+            for chunk in chunk_rows(rows, self.max_payload_bytes):
+                self.backend.update_values(sheet, start_row, chunk)
+                start_row += len(chunk)
+        metrics.count('rows_uploaded', len(df))
+        metrics.count('upload_requests', self.backend.request_count - requests)
+        return sheet
@@ -0,0 +1,181 @@
+import argparse
+import csv
+import os
+import subprocess
+import sys
+import time
+
+# Single entry point for the spending tools
+# Each command imports only the subsystem it needs (PDF, ML, Sheets, GUI) when it runs,
+# so headless commands never load Tk and keyword categorization never loads pandas or scikit-learn
+
+# File paths
+MODEL_PATH = 'transaction_categorizer_model.pkl'
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Cold start allowed for a headless command, measured by 'spending.py startup'
+STARTUP_BUDGET_SECONDS = 0.5
+STARTUP_RUNS = 5
+
+# Modules that must not be loaded just to start a headless command
+HEAVY_MODULES = ['pandas', 'numpy', 'sklearn', 'joblib', 'pdfplumber', 'tkinter', 'gspread', 'oauth2client']
+
+# What a headless keyword categorization imports before it reads its first row
+STARTUP_CHECK = (
+    "import sys, spending, transaction_categorizer, category_cache, pipeline_metrics; "
+    f"print(','.join(m for m in {HEAVY_MODULES!r} if m in sys.modules))"
+)
+
+# Function to read a CSV of transactions into a list of dicts
+def read_transactions_csv(path):
+    with open(path, newline='') as f:
+        return list(csv.DictReader(f))
+
+# Function to write a list of transaction dicts to a CSV, keeping the column order of the first row
+def write_transactions_csv(path, transactions, fieldnames=None):
+    fieldnames = fieldnames or (list(transactions[0].keys()) if transactions else ['date', 'description', 'amount'])
+    with open(path, 'w', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=fieldnames)
+        writer.writeheader()
+        writer.writerows(transactions)
+
+# Function to categorize the transactions in a CSV file
+def run_categorize(args):
+    from category_cache import open_keyword_cache, open_model_cache
+    from transaction_categorizer import RULES_PATH, categorize_transaction
+
+    transactions = read_transactions_csv(args.input)
+    if transactions and 'description' not in transactions[0]:
+        print(f"{args.input} has no description column")
+        return 1
+    descriptions = [t['description'] for t in transactions]
+    if args.server:
+        # A running categorization_service.py already has the model loaded
+        from categorization_service import ServiceClient
+        categories, confidences = ServiceClient(args.server).categorize(descriptions)
+        for transaction, category, confidence in zip(transactions, categories, confidences):
+            transaction['category'] = category
+            if confidence is not None:
+                transaction['confidence'] = round(confidence, 4)
+        cache = None
+    elif args.categorizer == 'ml':
+        from transaction_categorizer import load_model, predict_categories
+        cache = None if args.no_cache else open_model_cache(args.model)
+        categories, confidences = predict_categories(descriptions, load_model(args.model), cache)
+        for transaction, category, confidence in zip(transactions, categories, confidences):
+            transaction['category'] = category
+            transaction['confidence'] = round(float(confidence), 4)
+    else:
+        cache = None if args.no_cache else open_keyword_cache(RULES_PATH)
+        for transaction, description in zip(transactions, descriptions):
+            transaction['category'] = categorize_transaction(description, cache=cache)
+    if cache is not None:
+        cache.save()
+    write_transactions_csv(args.output or args.input, transactions)
+    print(f"Categorized {len(transactions)} transactions into {args.output or args.input}")
+    return 0
+
+# Function to export a statement's transactions to a local CSV without categorizing them
+def run_extract(args):
+    from statement_extractor import extract_transactions_from_pdf
+
+    transactions = extract_transactions_from_pdf(args.pdf, layout=args.layout)
+    output = args.output or os.path.splitext(args.pdf)[0] + '.csv'
+    write_transactions_csv(output, transactions, ['date', 'description', 'amount'])
+    print(f"Wrote {len(transactions)} transactions to {output}")
+    return 0
+
+# Function to hand the remaining arguments to another tool's main()
+def run_tool(module_name, argv):
+    import importlib
+    return importlib.import_module(module_name).main(argv)
+
+# Function to start one of the Tk scripts; only this command loads Tk
+def run_gui(args):
+    import runpy
+    scripts = {'converter': 'pdf_to_csv_gui.py', 'model': 'Banking Model.py'}
+    runpy.run_path(os.path.join(SCRIPT_DIR, scripts[args.app]), run_name='__main__')
+    return 0
+
+# Function to measure the cold start of a headless command in fresh interpreters
+# Returns the best time in seconds and the heavy modules it loaded
+def measure_startup(runs=STARTUP_RUNS):
+    best = None
+    loaded = ''
+    for _ in range(runs):
+        start = time.perf_counter()
+        result = subprocess.run([sys.executable, '-c', STARTUP_CHECK], cwd=SCRIPT_DIR,
+                                capture_output=True, text=True, check=True)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+        loaded = result.stdout.strip()
+    return best, [module for module in loaded.split(',') if module]
+
+# Function to check the cold start against the budget
+def run_startup(args):
+    seconds, loaded = measure_startup(args.runs)
+    print(f"Headless cold start: {seconds * 1000:.0f} ms (budget {args.budget * 1000:.0f} ms)")
+    if loaded:
+        print(f"Heavy modules loaded at startup: {', '.join(loaded)}")
+    return 0 if seconds <= args.budget and not loaded else 1
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog='spending', description="Bank statement extraction and spending categorization.")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    categorize = commands.add_parser('categorize', help="Categorize the transactions in a CSV file")
+    categorize.add_argument('input', help="CSV file with a description column")
+    categorize.add_argument('--output', default=None, help="CSV file to write (default: overwrite the input)")
+    categorize.add_argument('--categorizer', choices=['keywords', 'ml'], default='keywords',
+                            help="Use the keyword rules (default, fast to start) or the trained model")
+    categorize.add_argument('--model', default=MODEL_PATH, help="Path to the trained model file")
+    categorize.add_argument('--no-cache', action='store_true', help="Categorize every description from scratch")
+    categorize.add_argument('--server', default=None,
+                            help="Categorize through a running service at this URL (e.g. http://127.0.0.1:8765)")
+    categorize.set_defaults(run=run_categorize)
+
+    extract = commands.add_parser('extract', help="Export a statement PDF's transactions to a local CSV")
+    extract.add_argument('pdf', help="Statement PDF file")
+    extract.add_argument('--output', default=None, help="CSV file to write (default: next to the PDF)")
+    extract.add_argument('--layout', default='default', help="Bank statement layout from statement_layouts.json")
+    extract.set_defaults(run=run_extract)
+
+    # These commands take the same arguments as the scripts they run
+    for name, module_name, description in [
+        ('ingest', 'batch_ingest', "Extract and categorize a folder of statements (batch_ingest.py)"),
+        ('stream', 'streaming_pipeline', "Stream statements page by page into CSV/Sheets/ledger (streaming_pipeline.py)"),
+        ('watch', 'watch_folder', "Ingest every statement dropped into a folder (watch_folder.py)"),
+        ('ledger', 'ledger', "Query the local ledger (ledger.py)"),
+        ('merchant', 'merchant_index', "Find the known merchant nearest to a description (merchant_index.py)"),
+        ('benchmark', 'benchmark', "Time each stage on synthetic statements (benchmark.py)"),
+        ('select', 'model_selection', "Cross-validate candidate models in parallel and save the best "
+                                      "(model_selection.py)"),
+        ('outbox', 'sheets_outbox', "Send the rows waiting for Google Sheets (sheets_outbox.py)"),
+        ('serve', 'categorization_service', "Keep the categorizer loaded and serve it over local HTTP "
+                                            "(categorization_service.py)"),
+    ]:
+        tool = commands.add_parser(name, help=description, add_help=False)
+        tool.set_defaults(tool=module_name)
+
+    gui = commands.add_parser('gui', help="Open one of the desktop apps")
+    gui.add_argument('app', nargs='?', choices=['converter', 'model'], default='converter',
+                     help="converter: PDF to CSV converter (default); model: categorize with the trained model")
+    gui.set_defaults(run=run_gui)
+
+    startup = commands.add_parser('startup', help="Check the headless cold start against its budget")
+    startup.add_argument('--budget', type=float, default=STARTUP_BUDGET_SECONDS, help="Allowed cold start in seconds")
+    startup.add_argument('--runs', type=int, default=STARTUP_RUNS, help="Fresh interpreters to time; the fastest counts")
+    startup.set_defaults(run=run_startup)
+    return parser
+
+def main(argv=None):
+    parser = build_parser()
+    args, rest = parser.parse_known_args(argv)
+    if getattr(args, 'tool', None):
+        return run_tool(args.tool, rest)
+    if rest:
+        parser.error(f"unrecognized arguments: {' '.join(rest)}")
+    return args.run(args)
+
+if __name__ == '__main__':
+    raise SystemExit(main())
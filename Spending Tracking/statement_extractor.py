@@ -0,0 +1,164 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+import pdfplumber
+from extraction_cache import EXTRACTION_CACHE_DIR, cached_extraction, cached_iteration
+from pipeline_metrics import metrics
+from statement_parser import DEFAULT_LAYOUT, StatementParser, get_layout
+from table_regions import REGIONS_PATH, RegionDetector, find_region, read_page_lines, region_key, save_region
+
+# Bump this whenever parsing changes so cached extractions from the old parser are not reused
+PARSER_VERSION = 'sections-v4'
+
+# Function to get the extraction cache version for a layout; editing the layout changes it
+def parser_version(layout=DEFAULT_LAYOUT):
+    layout = get_layout(layout)
+    return f"{PARSER_VERSION}-{layout.name}-{layout.signature}"
+
+# Function to extract transactions from a PDF, reusing earlier extractions of the same file
+def extract_transactions_from_pdf(pdf_path, verbose=False, cache_dir=EXTRACTION_CACHE_DIR, layout=DEFAULT_LAYOUT):
+    with metrics.stage('extract'):
+        return cached_extraction(pdf_path, parser_version(layout), lambda path: parse_statement(path, verbose, layout),
+                                 cache_dir)
+
+# Function to stream transactions from a PDF page by page, reusing earlier extractions of the same file
+def iter_transactions_from_pdf(pdf_path, verbose=False, cache_dir=EXTRACTION_CACHE_DIR, layout=DEFAULT_LAYOUT):
+    return cached_iteration(pdf_path, parser_version(layout),
+                            lambda path: iter_statement_transactions(path, verbose, layout), cache_dir)
+
+# Function to parse every page of a PDF in order
+def parse_statement(pdf_path, verbose=False, layout=DEFAULT_LAYOUT):
+    return list(iter_statement_transactions(pdf_path, verbose, layout))
+
+# Function to yield each page's transactions as soon as that page is parsed
+def iter_statement_transactions(pdf_path, verbose=False, layout=DEFAULT_LAYOUT):
+    parser = StatementParser(layout, verbose)
+    if parser.layout.extraction == 'region':
+        yield from iter_region_transactions(pdf_path, parser)
+        return
+    with pdfplumber.open(pdf_path) as pdf:
+        for page in pdf.pages:
+            page_transactions = parser.parse_lines(page.extract_text().split('\n'))
+            metrics.count('pages')
+            # Drop pdfplumber's parsed objects for the page so memory does not grow with page count
+            page.close()
+            yield from page_transactions
+
+# Function to yield each page's transactions from the word positions inside the transaction table
+# Until a region is known for the layout and page size, pages are read whole; the region
+# is learned from them once the statement is finished, so later statements skip that step
+def iter_region_transactions(pdf_path, parser, regions_path=REGIONS_PATH):
+    layout = parser.layout
+    with pdfplumber.open(pdf_path) as pdf:
+        if not pdf.pages:
+            return
+        region = find_region(layout, pdf.pages[0], regions_path)
+        detector = RegionDetector(layout, region)
+        for page in pdf.pages:
+            lines = read_page_lines(page, region)
+            page_transactions = parse_region_page(parser, lines, region, detector, lambda: read_page_lines(page))
+            metrics.count('pages')
+            page.close()
+            yield from page_transactions
+        save_learned_region(layout, pdf.pages[0], detector, regions_path)
+
+# Function to parse one page's positioned lines in region mode
+# The page is also read whole when the crop may be missing part of the table on this statement:
+# a row cut off by the region (a date with no amount), or no section header or no transactions
+# inside it, which is how rows or headers starting outside the box look. The first page is also
+# read whole when the statement period was not inside the box. The whole-page read is used, and
+# the region widened from it, when a row was cut off or it finds more rows, headers or the period.
+def parse_region_page(parser, lines, region, detector, read_whole_page):
+    if region is None:
+        page_transactions = parser.parse_word_lines(lines)
+        detector.add(lines)
+        return page_transactions
+    before = parser.state()
+    page_transactions = parser.parse_word_lines(lines)
+    cut_off = parser.incomplete_rows > before[1]
+    missing_period = parser.period_end is None and not before[4]
+    if page_transactions and parser.headers_seen > before[2] and not cut_off and not missing_period:
+        return page_transactions
+
+    cropped = parser.state()
+    parser.restore(before)
+    whole_lines = read_whole_page()
+    whole_transactions = parser.parse_word_lines(whole_lines)
+    if cut_off or len(whole_transactions) > len(page_transactions) or parser.headers_seen > cropped[2] \
+            or (missing_period and parser.period_end is not None):
+        metrics.count('region_fallbacks')
+        detector.add(whole_lines)
+        return whole_transactions
+    parser.restore(cropped)
+    return page_transactions
+
+# Function to store the region learned or widened from a statement's whole pages
+def save_learned_region(layout, page, detector, regions_path=REGIONS_PATH):
+    region = detector.region()
+    if region is not None and layout.table_region is None:
+        save_region(region_key(layout, page), region, regions_path)
+
+# Function to extract the text lines of a range of pages (runs in a worker process)
+def extract_page_lines(pdf_path, start, stop):
+    with pdfplumber.open(pdf_path) as pdf:
+        return [pdf.pages[n].extract_text().split('\n') for n in range(start, stop)]
+
+# Function to extract the positioned lines of a range of pages, cropped to a region if one is known
+# (runs in a worker process)
+def extract_page_word_lines(pdf_path, start, stop, region=None):
+    with pdfplumber.open(pdf_path) as pdf:
+        return [read_page_lines(pdf.pages[n], region) for n in range(start, stop)]
+
+# Function to split page numbers into contiguous (start, stop) ranges
+def split_page_ranges(page_count, chunks):
+    chunks = max(1, min(chunks, page_count))
+    size, extra = divmod(page_count, chunks)
+    ranges = []
+    start = 0
+    for n in range(chunks):
+        stop = start + size + (1 if n < extra else 0)
+        ranges.append((start, stop))
+        start = stop
+    return ranges
+
+# Function to extract transactions from a PDF with its pages spread across worker processes
+# Page text is extracted in parallel, then parsed in page order so the section state
+# and the description continuation behave exactly like extract_transactions_from_pdf
+def extract_transactions_from_pdf_parallel(pdf_path, workers=None, verbose=False, cache_dir=EXTRACTION_CACHE_DIR,
+                                           layout=DEFAULT_LAYOUT):
+    with metrics.stage('extract'):
+        return cached_extraction(pdf_path, parser_version(layout),
+                                 lambda path: parse_statement_parallel(path, workers, verbose, layout), cache_dir)
+
+# Function to parse a PDF with its page text extracted across worker processes
+def parse_statement_parallel(pdf_path, workers=None, verbose=False, layout=DEFAULT_LAYOUT):
+    workers = workers or os.cpu_count()
+    layout = get_layout(layout)
+    with pdfplumber.open(pdf_path) as pdf:
+        page_count = len(pdf.pages)
+        if layout.extraction == 'region' and page_count:
+            region = find_region(layout, pdf.pages[0])
+            detector = RegionDetector(layout, region)
+            first_page = pdf.pages[0]
+    if workers < 2 or page_count < 2:
+        return parse_statement(pdf_path, verbose, layout)
+
+    # A few ranges per worker keeps the pool busy when some pages are slower than others
+    ranges = split_page_ranges(page_count, workers * 4)
+    parser = StatementParser(layout, verbose)
+    transactions = []
+    with ProcessPoolExecutor(max_workers=min(workers, len(ranges))) as executor:
+        if layout.extraction == 'region':
+            futures = [executor.submit(extract_page_word_lines, pdf_path, start, stop, region) for start, stop in ranges]
+            for (start, _), future in zip(ranges, futures):
+                for n, lines in enumerate(future.result(), start):
+                    read_whole_page = lambda: extract_page_word_lines(pdf_path, n, n + 1)[0]
+                    transactions.extend(parse_region_page(parser, lines, region, detector, read_whole_page))
+                    metrics.count('pages')
+            save_learned_region(layout, first_page, detector)
+            return transactions
+        futures = [executor.submit(extract_page_lines, pdf_path, start, stop) for start, stop in ranges]
+        for future in futures:
+            for lines in future.result():
+                transactions.extend(parser.parse_lines(lines))
+                metrics.count('pages')
+    return transactions
@@ -0,0 +1,232 @@
+import calendar
+import hashlib
+import json
+import logging
+import os
+import re
+from datetime import datetime
+from pipeline_metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+# Bank statement layouts: section headers, which sections hold the transactions to extract,
+# and what a transaction line looks like
+LAYOUTS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'statement_layouts.json')
+DEFAULT_LAYOUT = 'default'
+
+# Compiled layouts per (layout file, name), filled in by get_layout
+_compiled_layouts = {}
+
+# The statement period, e.g. '12/01/2023 - 01/02/2024' or 'December 1, 2023 through January 2, 2024';
+# a layout can give its own "period_pattern" with an 'end' group
+PERIOD_DATE = r'(?:\d{1,2}/\d{1,2}/\d{2,4}|[A-Za-z]{3,9}\.? \d{1,2},? \d{4})'
+PERIOD_PATTERN = rf'{PERIOD_DATE}\s*(?:-|to|through|thru)\s*(?P<end>{PERIOD_DATE})'
+PERIOD_DATE_FORMATS = ('%m/%d/%Y', '%m/%d/%y', '%B %d %Y', '%b %d %Y')
+
+# Function to read the end of a statement period, or None when it is not a date
+def parse_period_end(text):
+    text = ' '.join(text.replace('.', ' ').replace(',', ' ').split())
+    for date_format in PERIOD_DATE_FORMATS:
+        try:
+            return datetime.strptime(text, date_format).date()
+        except ValueError:
+            pass
+    return None
+
+# Function to get the year a 'MM/DD' date falls in when the year itself is known;
+# 02/29 in a year that is not a leap year goes to the leap year before it
+def leap_day_year(month, day, year):
+    if month == 2 and day == 29:
+        while not calendar.isleap(year):
+            year -= 1
+    return year
+
+# Function to add the year to a statement 'MM/DD' date from the end of its statement period
+# The date gets the latest year that does not put it after the period's end, so on a statement
+# ending in January, December dates fall in the year before. Dates with a year are kept.
+def date_with_year(date, period_end):
+    parts = date.split('/')
+    if len(parts) != 2:
+        return date
+    month, day = int(parts[0]), int(parts[1])
+    year = period_end.year - 1 if (month, day) > (period_end.month, period_end.day) else period_end.year
+    return f"{date}/{leap_day_year(month, day, year)}"
+
+# Function to build a pattern for a header that still matches when the PDF text drops or adds spaces
+def header_pattern(marker):
+    return r'\s*'.join(re.escape(word) for word in marker.split())
+
+# A statement layout with its patterns compiled once
+class StatementLayout:
+    def __init__(self, name, config):
+        self.name = name
+        self.sections = list(config['sections'])
+        self.capture = set(config['capture'])
+        unknown = self.capture - set(self.sections)
+        if unknown:
+            raise ValueError(f"Layout {name} captures sections it does not define: {sorted(unknown)}")
+        # One pattern finds any section header or end marker; the group that matched says which
+        markers = self.sections + list(config.get('end_markers', []))
+        self.markers = re.compile('|'.join(f"(?P<m{n}>{header_pattern(marker)})" for n, marker in enumerate(markers)))
+        self.date = re.compile(config['date_pattern'])
+        self.amount = re.compile(config['amount_pattern'])
+        self.wrapped_descriptions = config.get('wrapped_descriptions', True)
+        # 'text' parses the page text line by line; 'region' reads word positions inside the transaction table
+        self.extraction = config.get('extraction', 'text')
+        if self.extraction not in ('text', 'region'):
+            raise ValueError(f"Layout {name} has an unknown extraction mode {self.extraction!r}")
+        # A fixed table region ({"left", "right", "top"} in PDF points); without one it is learned
+        self.table_region = config.get('table_region')
+        self.period = re.compile(config.get('period_pattern', PERIOD_PATTERN))
+        # Changes to the layout change the signature, so cached extractions made with the old one are not reused
+        self.signature = hashlib.sha1(json.dumps(config, sort_keys=True).encode()).hexdigest()[:12]
+
+    # Function to find the section a header line starts; '' for an end marker, None for any other line
+    def header(self, line):
+        match = self.markers.search(line)
+        if match is None:
+            return None
+        n = int(match.lastgroup[1:])
+        return self.sections[n] if n < len(self.sections) else ''
+
+    # Function to find the end of the statement period on a line, or None
+    def period_end(self, line):
+        match = self.period.search(line)
+        return parse_period_end(match.group('end')) if match else None
+
+# Function to load the layout definitions
+def load_layouts(layouts_path=LAYOUTS_PATH):
+    with open(layouts_path) as f:
+        return json.load(f)
+
+# Function to get a compiled layout by name, compiling it only once
+def get_layout(name=DEFAULT_LAYOUT, layouts_path=LAYOUTS_PATH):
+    if isinstance(name, StatementLayout):
+        return name
+    key = (layouts_path, name)
+    if key not in _compiled_layouts:
+        layouts = load_layouts(layouts_path)
+        if name not in layouts:
+            raise ValueError(f"Unknown statement layout {name!r} (known: {', '.join(sorted(layouts))})")
+        _compiled_layouts[key] = StatementLayout(name, layouts[name])
+    return _compiled_layouts[key]
+
+# Single-pass parser for one statement
+# The current section is the state: a header line switches to its section, an end marker
+# leaves the section, and date lines ending in an amount are transactions while the
+# current section is one the layout captures. The state carries over from page to page.
+# Once the statement period has been read, transaction dates are given their year ('MM/DD/YYYY').
+class StatementParser:
+    def __init__(self, layout=DEFAULT_LAYOUT, verbose=False):
+        self.layout = get_layout(layout)
+        self.section = None
+        # Date lines in a captured section with no amount after them (see parse_word_lines)
+        self.incomplete_rows = 0
+        # Section headers and end markers parse_word_lines has passed
+        self.headers_seen = 0
+        # End of the statement period, read from the first page
+        self.period_end = None
+        self.pages = 0
+        # Every line and transaction is logged at DEBUG (INFO with verbose=True)
+        self.log_level = logging.INFO if verbose else logging.DEBUG
+
+    # Function to take the statement period's end from a line; returns whether the line gave it
+    def read_period(self, line):
+        self.period_end = self.layout.period_end(line)
+        return self.period_end is not None
+
+    # Function to save the state that carries over between pages, to parse a page again (see restore)
+    def state(self):
+        return self.section, self.incomplete_rows, self.headers_seen, self.period_end, self.pages
+
+    def restore(self, state):
+        self.section, self.incomplete_rows, self.headers_seen, self.period_end, self.pages = state
+
+    # Function to parse one page's lines and return its transactions
+    def parse_lines(self, lines):
+        layout = self.layout
+        log_lines = logger.isEnabledFor(self.log_level)
+        transactions = []
+        find_period = self.period_end is None and not self.pages
+        i = 0
+        count = len(lines)
+        while i < count:
+            line = lines[i]
+            i += 1
+            if log_lines:
+                logger.log(self.log_level, "Processing line: %s", line)
+            if find_period and self.read_period(line):
+                find_period = False
+                continue
+            if layout.date.match(line):
+                if self.section not in layout.capture:
+                    continue
+                tokens = line.split()
+                if len(tokens) < 2 or not layout.amount.match(tokens[-1]):
+                    continue
+                date = tokens[0] if self.period_end is None else date_with_year(tokens[0], self.period_end)
+                description = ' '.join(tokens[1:-1])
+                # A following line that is not a new transaction or a header finishes the description
+                if layout.wrapped_descriptions and i < count and not layout.date.match(lines[i]) \
+                        and layout.header(lines[i]) is None:
+                    description += ' ' + lines[i].strip()
+                    i += 1
+                transactions.append({'date': date, 'description': description, 'amount': tokens[-1]})
+                if log_lines:
+                    logger.log(self.log_level, "Extracted Description: %s", description)
+            else:
+                section = layout.header(line)
+                if section is not None:
+                    self.section = section or None
+        self.pages += 1
+        metrics.count('lines_scanned', count)
+        metrics.count('rows_extracted', len(transactions))
+        return transactions
+
+    # Function to parse one page's positioned lines (see table_regions.group_lines) and return its transactions
+    # The date is the first word and the amount the last; lines indented from the date column directly
+    # below a transaction finish its description, however many there are
+    def parse_word_lines(self, lines):
+        layout = self.layout
+        log_lines = logger.isEnabledFor(self.log_level)
+        transactions = []
+        find_period = self.period_end is None and not self.pages
+        row = None
+        for top, bottom, words in lines:
+            text = ' '.join(word[2] for word in words)
+            if log_lines:
+                logger.log(self.log_level, "Processing line: %s", text)
+            if find_period and self.read_period(text):
+                find_period = False
+                row = None
+                continue
+            if layout.date.match(words[0][2]):
+                row = None
+                if self.section not in layout.capture:
+                    continue
+                if len(words) < 2 or not layout.amount.match(words[-1][2]):
+                    # In a cropped page this is usually a row cut off at the edge of the region
+                    self.incomplete_rows += 1
+                    continue
+                date = words[0][2] if self.period_end is None else date_with_year(words[0][2], self.period_end)
+                row = {'date': date, 'description': ' '.join(word[2] for word in words[1:-1]), 'amount': words[-1][2]}
+                transactions.append(row)
+                row_x0, row_bottom, row_height = words[0][0], bottom, top - bottom
+                continue
+            section = layout.header(text)
+            if row is not None and section is None and layout.wrapped_descriptions \
+                    and words[0][0] > row_x0 + 1 and row_bottom - top < row_height:
+                row['description'] += ' ' + text
+                row_bottom = bottom
+                continue
+            row = None
+            if section is not None:
+                self.section = section or None
+                self.headers_seen += 1
+        self.pages += 1
+        if log_lines:
+            for transaction in transactions:
+                logger.log(self.log_level, "Extracted Description: %s", transaction['description'])
+        metrics.count('lines_scanned', len(lines))
+        metrics.count('rows_extracted', len(transactions))
+        return transactions
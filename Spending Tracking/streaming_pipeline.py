@@ -0,0 +1,183 @@
+import argparse
+import logging
+import os
+import pandas as pd
+from category_cache import CACHE_PATH, open_keyword_cache, open_model_cache
+from dedup_index import DEDUP_INDEX_PATH, DuplicateIndex
+from extraction_cache import EXTRACTION_CACHE_DIR
+from pipeline_metrics import add_logging_arguments, configure_logging, metrics, report_metrics
+from statement_extractor import iter_transactions_from_pdf
+from sheets_outbox import FLUSH_TIMEOUT
+from statement_parser import DEFAULT_LAYOUT, load_layouts
+from transaction_categorizer import (
+    RULES_PATH,
+    categorize_dataframe,
+    categorize_dataframe_ml,
+    load_model,
+    re_categorize_miscellaneous,
+)
+
+logger = logging.getLogger(__name__)
+
+# File paths
+MODEL_PATH = 'transaction_categorizer_model.pkl'
+
+# Transactions categorized (and handed to the sinks) at a time
+BATCH_SIZE = 200
+
+# Sink that appends each chunk to a CSV file, writing the header once
+class CsvSink:
+    def __init__(self, path):
+        self.path = path
+        self.file = None
+
+    def write(self, chunk):
+        header = self.file is None
+        if header:
+            self.file = open(self.path, 'w', newline='')
+        chunk.to_csv(self.file, header=header, index=False)
+        self.file.flush()
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+
+# Sink that keeps every chunk in memory, for callers that want one DataFrame at the end
+class DataFrameSink:
+    def __init__(self):
+        self.chunks = []
+
+    def write(self, chunk):
+        self.chunks.append(chunk)
+
+    def close(self):
+        pass
+
+    def to_frame(self):
+        if not self.chunks:
+            return pd.DataFrame(columns=['date', 'description', 'amount', 'category'])
+        return pd.concat(self.chunks, ignore_index=True)
+
+# Function to group an iterable into lists of at most batch_size items
+def iter_batches(items, batch_size=BATCH_SIZE):
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+# Function to categorize transactions in small batches, yielding DataFrame chunks
+def iter_categorized_chunks(transactions, model=None, cache=None, batch_size=BATCH_SIZE, source=None):
+    for batch in iter_batches(transactions, batch_size):
+        columns = ['date', 'description', 'amount']
+        if 'duplicate' in batch[0]:
+            columns.append('duplicate')
+        df = pd.DataFrame(batch, columns=columns)
+        if model is not None:
+            df = categorize_dataframe_ml(df, model, cache)
+        else:
+            df = categorize_dataframe(df, cache=cache)
+        if source is not None:
+            df['source_file'] = source
+        yield re_categorize_miscellaneous(df, model)
+
+# Function to stream one statement from PDF pages through categorization into the sinks
+# Returns the number of transactions written
+# With a DuplicateIndex, transactions already ingested are skipped or flagged before categorization
+def stream_statement(pdf_path, sinks, model=None, cache=None, batch_size=BATCH_SIZE,
+                     extraction_cache_dir=EXTRACTION_CACHE_DIR, source=None, duplicates=None, year=None,
+                     layout=DEFAULT_LAYOUT):
+    rows = 0
+    transactions = metrics.timed_iter('extract', iter_transactions_from_pdf(pdf_path, cache_dir=extraction_cache_dir,
+                                                                         layout=layout))
+    if duplicates is not None:
+        transactions = duplicates.iter_screen(transactions, year, source or pdf_path)
+    for chunk in iter_categorized_chunks(transactions, model, cache, batch_size, source):
+        for sink in sinks:
+            sink.write(chunk)
+        rows += len(chunk)
+    if cache is not None:
+        cache.save()
+    if duplicates is not None:
+        duplicates.commit()
+    return rows
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Stream bank statement PDFs page by page into CSV and/or Google Sheets.")
+    parser.add_argument('pdfs', nargs='+', help="Statement PDF files, processed in order")
+    parser.add_argument('--categorizer', choices=['ml', 'keywords'], default='ml',
+                        help="Use the trained model (default) or the keyword rules")
+    parser.add_argument('--model', default=MODEL_PATH, help="Path to the trained model file")
+    parser.add_argument('--batch-size', type=int, default=BATCH_SIZE, help="Transactions categorized at a time")
+    parser.add_argument('--csv', default=None, help="CSV file to stream the transactions to")
+    parser.add_argument('--sheet-url', default=None,
+                        help="Google Sheet to send the transactions to (through the outbox, see sheets_outbox.py)")
+    parser.add_argument('--sheet-title', default=None,
+                        help="Worksheet to add the transactions to (default: a new Transactions_<date>_<time> worksheet "
+                             "for each run; pass the same title every run to keep adding to one worksheet)")
+    parser.add_argument('--flush-timeout', type=float, default=FLUSH_TIMEOUT,
+                        help="Seconds to wait at exit for the rows to reach the sheet; the rest are sent on the next run "
+                             "(default: %(default)s)")
+    parser.add_argument('--ledger', default=None, help="SQLite ledger file to stream the transactions to")
+    parser.add_argument('--year', type=int, default=None, help="Year for the dates of statements whose period is not printed in the PDF (default: this year)")
+    parser.add_argument('--no-cache', action='store_true', help="Categorize every description from scratch")
+    parser.add_argument('--dedup', choices=['skip', 'flag'], default=None,
+                        help="Skip transactions ingested on earlier runs, or keep them with a duplicate column")
+    parser.add_argument('--dedup-index', default=DEDUP_INDEX_PATH, help="Duplicate index file shared across runs")
+    parser.add_argument('--layout', default=DEFAULT_LAYOUT, choices=sorted(load_layouts()),
+                        help="Bank statement layout from statement_layouts.json (default: %(default)s)")
+    add_logging_arguments(parser)
+    args = parser.parse_args(argv)
+    configure_logging(args.verbose, args.quiet)
+
+    sinks = []
+    if args.csv:
+        sinks.append(CsvSink(args.csv))
+    if args.sheet_url:
+        from sheets_outbox import OutboxSink
+        sinks.append(OutboxSink(args.sheet_url, args.sheet_title, timeout=args.flush_timeout))
+    if args.ledger:
+        from ledger import LedgerSink
+        sinks.append(LedgerSink(args.ledger, args.year))
+    if not sinks:
+        logger.error("Nothing to write to: pass --csv, --sheet-url and/or --ledger")
+        return 1
+
+    model = None
+    if args.categorizer == 'ml':
+        if not os.path.exists(args.model):
+            logger.error("Model file not found: %s (train it with 'Banking Model.py' or use --categorizer keywords)", args.model)
+            return 1
+        model = load_model(args.model)
+    cache = None
+    if not args.no_cache:
+        cache = open_model_cache(args.model, CACHE_PATH) if model is not None else open_keyword_cache(RULES_PATH, CACHE_PATH)
+
+    duplicates = DuplicateIndex(args.dedup_index, args.dedup) if args.dedup else None
+
+    failures = 0
+    try:
+        for pdf_path in args.pdfs:
+            try:
+                rows = stream_statement(pdf_path, sinks, model, cache, args.batch_size, source=pdf_path,
+                                        duplicates=duplicates, year=args.year, layout=args.layout)
+            except ValueError as e:
+                # e.g. a statement without a printed period cannot be checked for duplicates without --year
+                failures += 1
+                logger.error("Failed to process %s: %s", pdf_path, e)
+                continue
+            logger.info("Processed %s: %s transactions", pdf_path, rows)
+    finally:
+        for sink in sinks:
+            sink.close()
+        if duplicates is not None:
+            duplicates.close()
+            logger.info("%s %s transactions already ingested", 'Skipped' if args.dedup == 'skip' else 'Flagged', duplicates.duplicates_found)
+    report_metrics(args.metrics)
+    return 1 if failures else 0
+
+if __name__ == '__main__':
+    raise SystemExit(main())
@@ -0,0 +1,176 @@
+import json
+import logging
+import os
+import threading
+from pdfminer.layout import LTChar, LTContainer
+from pipeline_metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+# Transaction table regions learned from earlier statements, one per layout and page size
+REGIONS_PATH = 'table_regions.json'
+
+# Characters whose bottoms are within this many points are on the same line
+LINE_TOLERANCE = 3
+# A gap between characters wider than this starts a new word (as in pdfplumber)
+WORD_GAP = 3
+# Room left around a learned region so slightly shifted pages still fit
+REGION_MARGIN = 6
+
+# Regions read from each regions file, filled in by load_regions
+_regions = {}
+_regions_lock = threading.Lock()
+
+# Function to walk a page's characters as (x0, y0, x1, y1, text) in PDF coordinates
+# Reads pdfminer's layout objects directly instead of the per-character dicts pdfplumber builds for page.chars
+def iter_page_chars(container):
+    for obj in container:
+        if isinstance(obj, LTChar):
+            yield obj.x0, obj.y0, obj.x1, obj.y1, obj._text
+        elif isinstance(obj, LTContainer):
+            yield from iter_page_chars(obj)
+
+# Function to group a page's characters into lines of words, top to bottom
+# Each line is (top, bottom, words) and each word is (x0, x1, text); with a region,
+# characters outside it are dropped before any grouping is done
+def group_lines(chars, region=None):
+    rows = {}
+    if region is None:
+        for x0, y0, x1, y1, text in chars:
+            rows.setdefault(round(y0), []).append((x0, x1, y1, text))
+    else:
+        left, right, top = region['left'], region['right'], region['top']
+        for x0, y0, x1, y1, text in chars:
+            if x0 >= left and x1 <= right and y1 <= top:
+                rows.setdefault(round(y0), []).append((x0, x1, y1, text))
+
+    lines = []
+    line_y = None
+    line_chars = None
+    for y in sorted(rows, reverse=True):
+        if line_y is not None and line_y - y <= LINE_TOLERANCE:
+            line_chars.extend(rows[y])
+            continue
+        if line_chars:
+            lines.append(build_line(line_y, line_chars))
+        line_y = y
+        line_chars = list(rows[y])
+    if line_chars:
+        lines.append(build_line(line_y, line_chars))
+    return [line for line in lines if line[2]]
+
+# Function to split one line's characters into words at spaces and wide gaps
+def build_line(bottom, chars):
+    chars.sort()
+    words = []
+    top = bottom
+    start = end = None
+    text = []
+    for x0, x1, y1, char in chars:
+        top = max(top, y1)
+        if char.isspace() or (end is not None and x0 - end > WORD_GAP):
+            if text:
+                words.append((start, end, ''.join(text)))
+                text = []
+            if char.isspace():
+                end = None
+                continue
+        if not text:
+            start = x0
+        text.append(char)
+        end = x1
+    if text:
+        words.append((start, end, ''.join(text)))
+    return top, bottom, words
+
+# Function to read a page's lines, cropped to a region when one is known
+def read_page_lines(page, region=None):
+    return group_lines(iter_page_chars(page.layout), region)
+
+# Learns the region a statement's tables occupy from the full lines of its pages, one page at a time
+# The region spans every line from the first section header or transaction on a page to the last one,
+# and runs to the bottom of the page; starting from a known region widens it
+class RegionDetector:
+    def __init__(self, layout, region=None):
+        self.layout = layout
+        self.left = self.right = self.top = None
+        self.found = False
+        if region is not None:
+            self.left = region['left'] + REGION_MARGIN
+            self.right = region['right'] - REGION_MARGIN
+            self.top = region['top'] - REGION_MARGIN
+            self.found = True
+        self.pages = 0
+
+    def add(self, lines):
+        self.pages += 1
+        table = [n for n, (_, _, words) in enumerate(lines) if is_table_line(words, self.layout)]
+        if not table:
+            return
+        for top, _, words in lines[table[0]:table[-1] + 1]:
+            self.left = words[0][0] if self.left is None else min(self.left, words[0][0])
+            self.right = words[-1][1] if self.right is None else max(self.right, words[-1][1])
+            self.top = top if self.top is None else max(self.top, top)
+        self.found = self.found or any(is_transaction_line(lines[n][2], self.layout) for n in table)
+
+    # Function to get the learned region, or None when no full pages with transactions were seen
+    def region(self):
+        if not self.found or not self.pages:
+            return None
+        return {'left': self.left - REGION_MARGIN, 'right': self.right + REGION_MARGIN, 'top': self.top + REGION_MARGIN}
+
+# Function to check whether a line is a transaction: a date first and an amount last
+def is_transaction_line(words, layout):
+    return len(words) >= 2 and layout.date.match(words[0][2]) and layout.amount.match(words[-1][2])
+
+# Function to check whether a line is part of the transaction tables
+def is_table_line(words, layout):
+    return is_transaction_line(words, layout) or layout.header(' '.join(word[2] for word in words)) is not None
+
+# Function to get the key a region is stored under: layouts only share a region on pages of the same size
+def region_key(layout, page):
+    return f"{layout.name}-{layout.signature}-{page.width:.0f}x{page.height:.0f}"
+
+# Function to load the learned regions, reading the file only once per process
+def load_regions(regions_path=REGIONS_PATH):
+    with _regions_lock:
+        if regions_path not in _regions:
+            regions = {}
+            if os.path.exists(regions_path):
+                try:
+                    with open(regions_path) as f:
+                        regions = json.load(f)
+                except (OSError, ValueError):
+                    # A damaged file only means the regions are learned again
+                    logger.warning("Ignoring unreadable table regions file %s", regions_path)
+            _regions[regions_path] = regions
+        return _regions[regions_path]
+
+# Function to get the region for a page: configured in the layout, or learned from an earlier statement
+def find_region(layout, page, regions_path=REGIONS_PATH):
+    if layout.table_region is not None:
+        return layout.table_region
+    if regions_path is None:
+        return None
+    return load_regions(regions_path).get(region_key(layout, page))
+
+# Function to store a learned region, merging with regions other processes saved meanwhile
+def save_region(key, region, regions_path=REGIONS_PATH):
+    if regions_path is None:
+        return
+    with _regions_lock:
+        regions = {}
+        if os.path.exists(regions_path):
+            try:
+                with open(regions_path) as f:
+                    regions = json.load(f)
+            except (OSError, ValueError):
+                pass
+        regions[key] = region
+        temp_file = f"{regions_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(temp_file, 'w') as f:
+            json.dump(regions, f, indent=2)
+        os.replace(temp_file, regions_path)
+        _regions[regions_path] = regions
+    metrics.count('regions_learned')
+    logger.debug("Learned table region %s: %s", key, region)
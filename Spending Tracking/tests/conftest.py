@@ -0,0 +1,5 @@
+import os
+import sys
+
+# The tools are flat modules run from this folder, so the tests import them the same way
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,43 @@
+import json
+import os
+import threading
+from urllib.error import HTTPError
+import pytest
+from categorization_service import CategorizationService, ServiceClient, make_server
+
+
+@pytest.fixture
+def client(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    statements = tmp_path / 'statements'
+    statements.mkdir()
+    (tmp_path / 'secret.pdf').write_bytes(b'%PDF-1.4')
+    os.symlink(tmp_path / 'secret.pdf', statements / 'link.pdf')
+    service = CategorizationService(statement_dir=str(statements))
+    server = make_server(service, port=0)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield ServiceClient(f"http://127.0.0.1:{server.server_port}")
+    server.shutdown()
+    server.server_close()
+    service.close()
+
+
+def status_of(client, path):
+    with pytest.raises(HTTPError) as error:
+        client.request('/statement', {'path': path})
+    return error.value.code, json.loads(error.value.read())['error']
+
+
+def test_categorize_with_keywords(client):
+    categories, confidences = client.categorize(['VERIZON WIRELESS', 'SOMETHING UNHEARD OF'])
+    assert categories == ['Utilities', 'Miscellaneous']
+    assert confidences == [None, None]
+
+
+@pytest.mark.parametrize('path', ['../secret.pdf', '/etc/passwd', 'link.pdf'])
+def test_statement_paths_outside_the_folder_are_refused(client, path):
+    assert status_of(client, path)[0] == 403
+
+
+def test_missing_statement_is_not_found(client):
+    assert status_of(client, 'missing.pdf')[0] == 404
@@ -0,0 +1,63 @@
+import os
+import re
+import numpy as np
+import pandas as pd
+import pytest
+from compact_model import CompactTextModel, compact_path_for, export_model, load_compact_model
+from model_training import train_and_save_model
+from transaction_categorizer import load_model, predict_categories
+
+ROWS = [('WAWA 1234', 'Food'), ('STARBUCKS 88', 'Food'), ('CHIPOTLE ONLINE', 'Food'),
+        ('SHELL OIL 5521', 'Gas'), ('EXXON MOBIL', 'Gas'), ('SUNOCO 0042', 'Gas'),
+        ('VERIZON WIRELESS', 'Utilities'), ('PSEG BILL', 'Utilities'), ('AT&T PAYMENT', 'Utilities')] * 4
+
+
+def test_load_exports_a_missing_compact_model(tmp_path):
+    model_path = str(tmp_path / 'model.pkl')
+    train_and_save_model(pd.DataFrame(ROWS, columns=['description', 'category']), model_path)
+    compact_path = compact_path_for(model_path)
+    os.remove(compact_path)
+
+    model = load_model(model_path)
+    assert not isinstance(model, CompactTextModel)
+    assert os.path.exists(compact_path)
+    assert not [name for name in os.listdir(tmp_path) if name.endswith('.tmp')]
+
+    compact = load_model(model_path)
+    assert isinstance(compact, CompactTextModel)
+    descriptions = ['WAWA 99', 'SHELL OIL', 'VERIZON', 'SOMETHING ELSE']
+    expected, expected_confidence = predict_categories(descriptions, model)
+    categories, confidence = predict_categories(descriptions, compact)
+    assert list(categories) == list(expected)
+    assert np.allclose(confidence, expected_confidence)
+
+
+@pytest.mark.parametrize('ngram_range', [(1, 2), (1, 3), (2, 3), (1, 4)])
+def test_word_ngrams_match_scikit_learn(ngram_range):
+    from sklearn.feature_extraction.text import HashingVectorizer
+
+    vectorizer = HashingVectorizer(ngram_range=ngram_range)
+    compact = CompactTextModel.__new__(CompactTextModel)
+    compact.meta = {'lowercase': True, 'analyzer': 'word'}
+    compact.token_pattern = re.compile(vectorizer.token_pattern)
+    compact.min_n, compact.max_n = ngram_range
+    analyzer = vectorizer.build_analyzer()
+    for description in ['aa bb cc', 'POS PURCHASE WAWA 1234 HOLMDEL NJ', 'one', '']:
+        assert compact.analyze(description) == analyzer(description)
+
+
+def test_hashed_trigram_model_predicts_like_scikit_learn(tmp_path):
+    from sklearn.feature_extraction.text import HashingVectorizer
+    from sklearn.linear_model import SGDClassifier
+    from sklearn.pipeline import Pipeline
+
+    model = Pipeline([('features', HashingVectorizer(ngram_range=(1, 3), alternate_sign=False)),
+                      ('clf', SGDClassifier(loss='log_loss', random_state=0))])
+    descriptions, categories = zip(*ROWS)
+    model.fit(list(descriptions), list(categories))
+    path = str(tmp_path / 'model.npz')
+    export_model(model, path)
+    compact = load_compact_model(path)
+    tests = ['POS WAWA 1234 HOLMDEL', 'SHELL OIL 5521 EXXON', 'VERIZON WIRELESS PSEG BILL', 'aa bb cc']
+    assert list(compact.predict(tests)) == list(model.predict(tests))
+    assert np.allclose(compact.predict_proba(tests), model.predict_proba(tests))
@@ -0,0 +1,53 @@
+import pytest
+from dedup_index import DuplicateIndex, transaction_key
+
+WAWA = {'date': '03/14', 'description': 'WAWA 1234', 'amount': '-5.25'}
+SHELL = {'date': '03/15', 'description': 'SHELL OIL', 'amount': '-40.00'}
+
+
+def test_key_needs_a_year():
+    with pytest.raises(ValueError):
+        transaction_key(WAWA)
+    assert transaction_key(WAWA, 2024) != transaction_key(WAWA, 2025)
+    assert transaction_key(dict(WAWA, date='03/14/2024')) == transaction_key(WAWA, 2024)
+
+
+def test_skip_catches_reimports_across_runs(tmp_path):
+    path = str(tmp_path / 'dedup.sqlite')
+    index = DuplicateIndex(path)
+    kept, _ = index.screen([WAWA, WAWA, SHELL], 2024, 'march.pdf')
+    # Two identical purchases on one statement are both real
+    assert kept == [WAWA, WAWA, SHELL]
+    index.commit()
+    index.close()
+
+    index = DuplicateIndex(path)
+    kept, _ = index.screen([WAWA, WAWA, WAWA, SHELL], 2024, 'march-again.pdf')
+    assert kept == [WAWA]
+    assert index.duplicates_found == 3
+    # The same charges a year later are new
+    kept, _ = index.screen([WAWA, SHELL], 2025, 'next-march.pdf')
+    assert kept == [WAWA, SHELL]
+
+
+def test_uncommitted_fingerprints_are_not_recorded(tmp_path):
+    path = str(tmp_path / 'dedup.sqlite')
+    index = DuplicateIndex(path)
+    index.screen([WAWA], 2024)
+    index.close()
+    assert DuplicateIndex(path).screen([WAWA], 2024)[0] == [WAWA]
+
+
+def test_flag_mode_keeps_duplicates(tmp_path):
+    index = DuplicateIndex(str(tmp_path / 'dedup.sqlite'), 'flag')
+    assert index.screen([SHELL, SHELL], 2024)[1] == [False, False]
+    assert index.screen([SHELL], 2024)[1] == [True]
+    assert list(index.iter_screen([SHELL], 2024)) == [dict(SHELL, duplicate=True)]
+
+
+def test_statement_without_a_year_is_refused(tmp_path):
+    index = DuplicateIndex(str(tmp_path / 'dedup.sqlite'))
+    with pytest.raises(ValueError):
+        index.screen([WAWA])
+    # Dates read with their year from the statement period need no year
+    assert index.screen([dict(WAWA, date='03/14/2024')])[0] == [dict(WAWA, date='03/14/2024')]
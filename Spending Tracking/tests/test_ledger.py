@@ -0,0 +1,64 @@
+import sqlite3
+import pandas as pd
+from ledger import Ledger
+
+MARCH = pd.DataFrame({
+    'date': ['03/01/2024', '03/02/2024', '03/05/2024', '04/01/2024'],
+    'description': ['WAWA 1234', 'SHELL OIL 5541', 'WAWA 1234', 'VERIZON WIRELESS'],
+    'amount': ['-5.25', '-40.00', '-3.10', '-89.99'],
+    'category': ['Food', 'Gas', 'Food', None],
+})
+
+
+# Function to read a rollup table the way the rollups were computed, straight from the transactions
+def rollups_from_transactions(ledger):
+    return sorted(ledger.conn.execute("SELECT substr(date, 1, 7), COALESCE(category, ''), SUM(amount_cents), COUNT(*) "
+                                      "FROM transactions GROUP BY 1, 2").fetchall())
+
+
+def category_rollups(ledger):
+    return sorted(ledger.conn.execute("SELECT month, category, total_cents, count FROM category_rollups").fetchall())
+
+
+def test_rollups_follow_inserts_and_corrections(tmp_path):
+    ledger = Ledger(str(tmp_path / 'ledger.sqlite'))
+    ledger.add_transactions(MARCH, 'march.pdf')
+    assert category_rollups(ledger) == [('2024-03', 'Food', -835, 2), ('2024-03', 'Gas', -4000, 1),
+                                        ('2024-04', '', -8999, 1)]
+    assert ledger.spending_by_category('2024-03-01', '2024-04-01') == [('Food', -8.35, 2), ('Gas', -40.0, 1)]
+    assert ledger.top_merchants('2024-03', '2024-05', 1) == [('wawa 1234', -8.35, 2)]
+
+    assert ledger.recategorize_merchant('WAWA 1234', 'Groceries') == 2
+    assert category_rollups(ledger) == rollups_from_transactions(ledger)
+    assert ('2024-03', 'Food', 0, 0) not in category_rollups(ledger)
+    ledger.rebuild_rollups()
+    assert category_rollups(ledger) == rollups_from_transactions(ledger)
+
+
+def test_same_source_key_is_imported_once(tmp_path):
+    ledger = Ledger(str(tmp_path / 'ledger.sqlite'))
+    assert ledger.add_transactions(MARCH, 'march.pdf', source_key='abc') == 4
+    assert ledger.add_transactions(MARCH, 'inbox/march.pdf', source_key='abc') is None
+    # Statements without a key are always added
+    ledger.add_transactions(MARCH, 'march.pdf')
+    ledger.add_transactions(MARCH, 'march.pdf')
+    assert ledger.conn.execute("SELECT COUNT(*) FROM statements").fetchone()[0] == 3
+    assert ledger.conn.execute("SELECT COUNT(*) FROM transactions").fetchone()[0] == 12
+    assert category_rollups(ledger) == rollups_from_transactions(ledger)
+
+
+def test_old_ledger_is_upgraded(tmp_path):
+    path = str(tmp_path / 'ledger.sqlite')
+    conn = sqlite3.connect(path)
+    conn.executescript("CREATE TABLE statements (id INTEGER PRIMARY KEY, source_file TEXT, imported_at TEXT NOT NULL);"
+                       "CREATE TABLE transactions (id INTEGER PRIMARY KEY, statement_id INTEGER NOT NULL, date TEXT NOT NULL, "
+                       "description TEXT NOT NULL, merchant TEXT NOT NULL, amount_cents INTEGER NOT NULL, "
+                       "category TEXT, confidence REAL);"
+                       "INSERT INTO statements VALUES (1, 'old.pdf', '2024-01-01');"
+                       "INSERT INTO transactions VALUES (1, 1, '2024-03-01', 'WAWA 1234', 'wawa', -525, 'Food', NULL);")
+    conn.close()
+
+    ledger = Ledger(path)
+    assert category_rollups(ledger) == [('2024-03', 'Food', -525, 1)]
+    assert ledger.add_transactions(MARCH, 'march.pdf', source_key='abc') == 4
+    assert ledger.add_transactions(MARCH, 'march.pdf', source_key='abc') is None
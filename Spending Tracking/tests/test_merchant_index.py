@@ -0,0 +1,71 @@
+import json
+import os
+import pandas as pd
+import pytest
+from merchant_index import MerchantIndex, build_merchant_index, merchant_key
+from transaction_categorizer import re_categorize_miscellaneous
+
+
+@pytest.fixture
+def index():
+    index = MerchantIndex()
+    for description, category in [('POS PURCHASE SHOPRITE HOLMDEL NJ', 'Groceries'), ('POS PURCHASE STARBUCKS', 'Food'),
+                                  ('TURNING POINT HOLMDEL', 'Food'), ('VALENTINOS RESTAURANT', 'Food'),
+                                  ('SHELL OIL', 'Gas'), ('HUDSON CAFE', 'Food')]:
+        index.add(description, category)
+    return index
+
+
+def test_key_drops_bank_prefixes_and_digits():
+    assert merchant_key('POS PURCHASE WAWA 1234 HOLMDEL NJ') == 'wawaholmdelnj'
+    assert merchant_key('DEBIT CARD PURCHASE AUTHORIZED ON 03/14 SHELL OIL 5541') == 'shelloil'
+    assert merchant_key('POS PURCHASE') == ''
+
+
+@pytest.mark.parametrize('description', ['POS PURCHASE', 'POS PURCHASE WAWA 1234 HOLMDEL NJ',
+                                         'SHELL OIL SERVICE STATION HOLMDEL', 'CAFE'])
+def test_prefixes_and_short_names_do_not_match(index, description):
+    assert index.lookup(description) is None
+
+
+@pytest.mark.parametrize('description, merchant, category', [
+    ('URNINGPOINTHOLMDEL', 'turningpointholmdel', 'Food'),
+    ('VALENTINOSRESTAURANT', 'valentinosrestaurant', 'Food'),
+    ('Valentinos Rest', 'valentinosrestaurant', 'Food'),
+    ('POS PURCHASE SHOPRITE HOLMDEL 0042', 'shopriteholmdelnj', 'Groceries'),
+])
+def test_misspelled_and_glued_names_match(index, description, merchant, category):
+    found, found_category, similarity = index.lookup(description)
+    assert (found, found_category) == (merchant, category)
+    assert 0.5 <= similarity <= 1.0
+
+
+def test_most_common_category_wins(index):
+    index.add('SHELL OIL 12', 'Food')
+    index.add('SHELL OIL 13', 'Gas')
+    assert index.lookup('SHELL OIL')[1] == 'Gas'
+
+
+def test_build_only_reads_the_training_folder(tmp_path):
+    folder = tmp_path / 'ModelTrainDoc'
+    folder.mkdir()
+    pd.DataFrame({'description': ['HUDSON CAFE 12'], 'category': ['Food']}).to_csv(folder / 'month0.csv', index=False)
+    rules = tmp_path / 'rules.json'
+    rules.write_text(json.dumps({'default': 'Miscellaneous', 'rules': [{'category': 'Gas', 'keywords': ['shell oil']}]}))
+
+    index = build_merchant_index(str(rules), str(folder), str(tmp_path / 'missing.sqlite'))
+    assert os.listdir(folder) == ['month0.csv']
+    assert index.lookup('HUDSON CAFE')[1] == 'Food'
+    assert index.lookup('SHELL OIL')[1] == 'Gas'
+
+
+def test_similarity_goes_in_its_own_column(index):
+    df = pd.DataFrame({'description': ['URNINGPOINTHOLMDEL', 'POS PURCHASE', 'SHELL OIL'],
+                       'category': ['Miscellaneous', 'Miscellaneous', 'Gas'], 'confidence': [0.2, 0.3, 0.9]})
+    df = re_categorize_miscellaneous(df, index=index)
+    assert df['category'].tolist() == ['Food', 'Miscellaneous', 'Gas']
+    assert df['confidence'].tolist() == [0.2, 0.3, 0.9]
+    assert df['match_similarity'].iloc[0] == pytest.approx(index.lookup('URNINGPOINTHOLMDEL')[2])
+    assert df['match_similarity'].iloc[1:].isna().all()
+    # Added even when there is nothing to re-categorize, so streamed chunks keep the same columns
+    assert 'match_similarity' in re_categorize_miscellaneous(df[['description']].assign(category='Gas'), index=index)
@@ -0,0 +1,15 @@
+from model_selection import candidate_pairs, main, pick_winner
+
+
+def test_grid_without_candidates_is_refused(tmp_path, caplog):
+    assert candidate_pairs(['hashing'], ['logreg-C1']) == []
+    assert main(['--data', str(tmp_path), '--features', 'hashing', '--classifiers', 'logreg-C1', '--dry-run']) == 1
+    assert 'No candidates to compare' in caplog.text
+
+
+def test_winner_respects_the_latency_budget():
+    summary = [{'name': 'slow', 'accuracy': 0.95, 'latency_us': 90.0}, {'name': 'fast', 'accuracy': 0.94, 'latency_us': 10.0}]
+    assert pick_winner(summary)['name'] == 'slow'
+    assert pick_winner(summary, max_latency_us=50)['name'] == 'fast'
+    assert pick_winner(summary, tolerance=0.02)['name'] == 'fast'
+    assert pick_winner(summary, max_latency_us=5) is None
@@ -0,0 +1,78 @@
+import os
+import joblib
+import pandas as pd
+import pytest
+from model_training import is_online_model, train_and_save_model, update_model_incrementally
+
+MERCHANTS = {'Food': ['WAWA', 'STARBUCKS', 'CHIPOTLE'], 'Gas': ['SHELL OIL', 'EXXON MOBIL', 'SUNOCO'], 'Utilities': ['VERIZON WIRELESS', 'AT&T', 'PSEG']}
+
+
+def write_month(folder, name, merchants=MERCHANTS):
+    rows = [{'description': f"{merchant} {store}", 'category': category}
+            for category, names in merchants.items() for merchant in names for store in range(5)]
+    pd.DataFrame(rows).to_csv(os.path.join(folder, name), index=False)
+
+
+@pytest.fixture
+def training_folder(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    folder = tmp_path / 'ModelTrainDoc'
+    folder.mkdir()
+    write_month(str(folder), 'month0.csv')
+    return str(folder)
+
+
+def test_first_run_builds_online_model(training_folder, tmp_path):
+    model_path = str(tmp_path / 'model.pkl')
+    model = update_model_incrementally(training_folder, model_path)
+    assert is_online_model(model)
+    assert model.predict(['WAWA 9'])[0] == 'Food'
+
+
+@pytest.mark.parametrize('full', [False, True])
+def test_tfidf_model_keeps_its_type(training_folder, tmp_path, full):
+    model_path = str(tmp_path / 'model.pkl')
+    train_and_save_model(pd.read_csv(os.path.join(training_folder, 'month0.csv')), model_path)
+    write_month(training_folder, 'month1.csv')
+
+    model = update_model_incrementally(training_folder, model_path, full=full)
+    assert not is_online_model(model)
+    assert 'tfidf' in joblib.load(model_path).named_steps
+
+
+def test_online_model_learns_only_new_files(training_folder, tmp_path):
+    model_path = str(tmp_path / 'model.pkl')
+    update_model_incrementally(training_folder, model_path)
+    mtime = os.stat(model_path).st_mtime_ns
+
+    assert is_online_model(update_model_incrementally(training_folder, model_path))
+    assert os.stat(model_path).st_mtime_ns == mtime
+
+    write_month(training_folder, 'month1.csv', {'Food': ['HUDSON CAFE'], 'Gas': ['BP GAS']})
+    assert is_online_model(update_model_incrementally(training_folder, model_path))
+
+
+def test_tfidf_model_switches_to_online_once(training_folder, tmp_path):
+    model_path = str(tmp_path / 'model.pkl')
+    train_and_save_model(pd.read_csv(os.path.join(training_folder, 'month0.csv')), model_path)
+
+    assert is_online_model(update_model_incrementally(training_folder, model_path, switch_to_online=True))
+    mtime = os.stat(model_path).st_mtime_ns
+    assert is_online_model(update_model_incrementally(training_folder, model_path))
+    assert os.stat(model_path).st_mtime_ns == mtime
+
+
+def test_unlabeled_rows_do_not_force_a_rebuild(training_folder, tmp_path, monkeypatch):
+    import model_training
+
+    model_path = str(tmp_path / 'model.pkl')
+    update_model_incrementally(training_folder, model_path)
+    write_month(training_folder, 'month1.csv', {'Food': ['HUDSON CAFE']})
+    with open(os.path.join(training_folder, 'month1.csv'), 'a') as f:
+        f.write('UNLABELED STORE,\n')
+
+    def no_rebuild(*args, **kwargs):
+        raise AssertionError("rebuilt the model")
+
+    monkeypatch.setattr(model_training, 'rebuild_online_model', no_rebuild)
+    assert update_model_incrementally(training_folder, model_path).predict(['HUDSON CAFE 9'])[0] == 'Food'
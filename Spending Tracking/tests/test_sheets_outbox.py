@@ -0,0 +1,94 @@
+import time
+import pandas as pd
+import pytest
+from sheets_outbox import OutboxFlusher, SheetsOutbox, send_to_google_sheets
+from sheets_upload import FakeSheetsBackend
+
+SHEET_URL = 'https://docs.google.com/spreadsheets/d/abc123/edit'
+MARCH = pd.DataFrame({'date': ['03/01', '03/02'], 'description': ['WAWA 1234', 'SHELL OIL'], 'amount': ['5.25', '40.00']})
+APRIL = pd.DataFrame({'date': ['04/01'], 'description': ['VERIZON'], 'amount': ['89.99'], 'category': ['Phone']})
+
+
+@pytest.fixture
+def outbox(tmp_path):
+    outbox = SheetsOutbox(str(tmp_path / 'outbox.sqlite'))
+    yield outbox
+    outbox.close()
+
+
+# Function to flush until the outbox is empty, ignoring the backoff between attempts
+def flush_all(outbox, flusher, attempts=10, pause=0):
+    for _ in range(attempts):
+        outbox.conn.execute("UPDATE destinations SET next_attempt_at = 0")
+        if flusher.flush(outbox)[1] is None:
+            return
+        time.sleep(pause)
+    raise AssertionError("The outbox did not empty")
+
+
+def sheet_values(backend, title='Transactions'):
+    return backend.spreadsheets['abc123'][title].values
+
+
+EXPECTED = [['date', 'description', 'amount', 'category'],
+            ['03/01', 'WAWA 1234', '5.25', ''], ['03/02', 'SHELL OIL', '40.00', ''], ['04/01', 'VERIZON', '89.99', 'Phone']]
+
+
+@pytest.mark.parametrize('after_write', [False, True])
+def test_rows_arrive_exactly_once_despite_failures(outbox, after_write):
+    backend = FakeSheetsBackend()
+    flusher = OutboxFlusher(backend)
+    outbox.enqueue(MARCH, SHEET_URL, 'Transactions')
+    outbox.enqueue(APRIL, SHEET_URL, 'Transactions')
+    # Every request of the first attempts fails, before or after it is carried out
+    backend.fail_next(3, after_write)
+    flush_all(outbox, flusher)
+    values = sheet_values(backend)
+    # The header widened to the April column after the March rows were numbered
+    assert values[0] == EXPECTED[0]
+    assert [row + [''] * (4 - len(row)) for row in values[1:]] == EXPECTED[1:]
+    assert outbox.pending() == []
+
+
+def test_rate_limit_backs_off_and_resumes(outbox):
+    backend = FakeSheetsBackend(quota=2, quota_window=0.05)
+    flusher = OutboxFlusher(backend)
+    outbox.enqueue(pd.concat([MARCH, APRIL], ignore_index=True), SHEET_URL, 'Transactions')
+    flusher.flush(outbox)
+    assert 'Quota exceeded' in outbox.status()[0][5]
+    flush_all(outbox, flusher, attempts=20, pause=0.06)
+    assert sheet_values(backend) == EXPECTED
+
+
+def test_batch_key_is_queued_once_per_worksheet(outbox):
+    assert outbox.enqueue(MARCH, SHEET_URL, 'Transactions', 'march') == 2
+    assert outbox.enqueue(MARCH, SHEET_URL, 'Transactions', 'march') == 0
+    assert outbox.enqueue(MARCH, SHEET_URL, 'Other', 'march') == 2
+    assert sorted(count for _, _, _, count, _ in outbox.pending()) == [2, 2]
+
+
+def test_send_uses_a_new_worksheet_and_gives_up_after_the_timeout(tmp_path):
+    path = str(tmp_path / 'outbox.sqlite')
+    backend = FakeSheetsBackend()
+    assert send_to_google_sheets(MARCH, SHEET_URL, outbox_path=path, backend=backend, timeout=5) == 0
+    [title] = backend.spreadsheets['abc123']
+    assert title.startswith('Transactions_')
+
+    backend.fail_next(1000)
+    # Left in the outbox for the next run
+    assert send_to_google_sheets(APRIL, SHEET_URL, 'April', path, backend, timeout=0.2) == 1
+
+
+def test_statements_waiting_for_a_worksheet_go_out_in_one_values_update(outbox):
+    backend = FakeSheetsBackend()
+    flusher = OutboxFlusher(backend)
+    outbox.enqueue(MARCH, SHEET_URL, 'Transactions')
+    flusher.flush(outbox)
+    requests = backend.request_count
+    for _ in range(5):
+        outbox.enqueue(MARCH, SHEET_URL, 'Transactions')
+    flusher.flush(outbox)
+    # One resize for the new rows, one update with all ten of them
+    assert backend.request_count - requests == 2
+    assert sheet_values(backend) == [['date', 'description', 'amount']] + [['03/01', 'WAWA 1234', '5.25'],
+                                                                           ['03/02', 'SHELL OIL', '40.00']] * 6
@@ -0,0 +1,26 @@
+import pandas as pd
+from sheets_upload import FakeSheetsBackend, SheetsWriter, chunk_rows, dataframe_to_rows
+
+SHEET_URL = 'https://docs.google.com/spreadsheets/d/abc123/edit'
+STATEMENT = pd.DataFrame({'date': ['03/%02d' % day for day in range(1, 31)],
+                          'description': ['WAWA 1234'] * 30, 'amount': ['5.25'] * 30})
+
+
+def test_statement_is_written_in_one_values_update():
+    backend = FakeSheetsBackend()
+    sheet = SheetsWriter(backend).write_dataframe(STATEMENT, SHEET_URL, 'March')
+    # One request creates the worksheet at its final size, one sends the header and every row
+    assert backend.request_count == 2
+    assert sheet.values == dataframe_to_rows(STATEMENT)
+    assert (sheet.row_count, sheet.col_count) == (31, 3)
+
+
+def test_rows_over_the_payload_limit_are_split():
+    rows = dataframe_to_rows(STATEMENT)
+    chunks = list(chunk_rows(rows, max_payload_bytes=200))
+    assert len(chunks) > 1 and [row for chunk in chunks for row in chunk] == rows
+
+    backend = FakeSheetsBackend()
+    sheet = SheetsWriter(backend, max_payload_bytes=200).write_dataframe(STATEMENT, SHEET_URL, 'March')
+    assert backend.request_count == 1 + len(chunks)
+    assert sheet.values == rows
@@ -0,0 +1,77 @@
+import json
+import pytest
+from statement_extractor import iter_region_transactions, iter_statement_transactions
+from statement_parser import StatementLayout, StatementParser, load_layouts
+
+ROWS = [('03/01', 'WAWA 1234', '5.25'), ('03/02', 'SHELL OIL 5541', '40.00'), ('03/05', 'VERIZON WIRELESS', '89.99')]
+
+
+@pytest.fixture
+def layout():
+    return StatementLayout('test-region', dict(load_layouts()['default'], extraction='region'))
+
+
+# Function to write a one-page statement with its rows and header at the given left edges
+def write_statement(path, row_x=50, header_x=None, rows=ROWS, period=None):
+    from reportlab.lib.pagesizes import letter
+    from reportlab.pdfgen import canvas
+
+    pdf = canvas.Canvas(str(path), pagesize=letter)
+    pdf.drawString(200, 750, "Statement   Account ending 1234")
+    if period:
+        pdf.drawString(200, 736, period)
+    pdf.drawString(row_x if header_x is None else header_x, 720, "Electronic Payments")
+    y = 705
+    for date, description, amount in rows:
+        pdf.drawString(row_x, y, f"{date} {description} {amount}")
+        y -= 12
+    pdf.showPage()
+    pdf.save()
+    return str(path)
+
+
+def extract(path, layout, regions_path):
+    return [(t['date'], t['description'], t['amount'])
+            for t in iter_region_transactions(path, StatementParser(layout), str(regions_path))]
+
+
+def test_shipped_layouts_read_page_text():
+    assert {name: config.get('extraction', 'text') for name, config in load_layouts().items()} == \
+        {'default': 'text', 'deposits-and-payments': 'text'}
+
+
+def test_region_matches_text_extraction(tmp_path, layout):
+    pdf = write_statement(tmp_path / 'march.pdf')
+    assert extract(pdf, layout, tmp_path / 'regions.json') == ROWS
+    text_layout = StatementLayout('test-text', load_layouts()['default'])
+    assert [tuple(t.values()) for t in iter_statement_transactions(pdf, layout=text_layout)] == ROWS
+    # The second read is cropped to the learned box
+    assert extract(pdf, layout, tmp_path / 'regions.json') == ROWS
+
+
+@pytest.mark.parametrize('header_x', [20, 50])
+def test_rows_left_of_the_learned_box_fall_back_to_the_whole_page(tmp_path, layout, header_x):
+    regions_path = tmp_path / 'regions.json'
+    extract(write_statement(tmp_path / 'march.pdf'), layout, regions_path)
+    learned = json.loads(regions_path.read_text())
+    assert [region['left'] for region in learned.values()] == [pytest.approx(44)]
+
+    shifted = write_statement(tmp_path / 'april.pdf', row_x=20, header_x=header_x)
+    assert extract(shifted, layout, regions_path) == ROWS
+    # The box is learned again from the whole page, so the next statement is read cropped
+    assert [region['left'] for region in json.loads(regions_path.read_text()).values()] == [pytest.approx(14)]
+    assert extract(shifted, layout, regions_path) == ROWS
+
+
+def test_page_without_a_table_keeps_the_cropped_read(tmp_path, layout):
+    regions_path = tmp_path / 'regions.json'
+    extract(write_statement(tmp_path / 'march.pdf'), layout, regions_path)
+    assert extract(write_statement(tmp_path / 'empty.pdf', rows=[]), layout, regions_path) == []
+
+
+def test_period_above_the_learned_box_still_dates_the_rows(tmp_path, layout):
+    regions_path = tmp_path / 'regions.json'
+    extract(write_statement(tmp_path / 'march.pdf'), layout, regions_path)
+    pdf = write_statement(tmp_path / 'april.pdf', period="Statement Period 02/05/2024 - 03/06/2024")
+    for _ in range(2):
+        assert [row[0] for row in extract(pdf, layout, regions_path)] == ['03/01/2024', '03/02/2024', '03/05/2024']
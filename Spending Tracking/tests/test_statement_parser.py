@@ -0,0 +1,54 @@
+from datetime import date
+import pandas as pd
+import pytest
+from ledger import Ledger, to_iso_date
+from statement_parser import StatementParser, date_with_year, parse_period_end
+from transaction_frame import statement_dates
+
+
+def parse(lines):
+    return [(t['date'], t['description']) for t in StatementParser().parse_lines(lines)]
+
+
+@pytest.mark.parametrize('period', ["Statement Period: 12/01/2023 - 01/02/2024",
+                                    "December 1, 2023 through January 2, 2024",
+                                    "Dec. 1, 2023 to Jan. 2, 2024"])
+def test_year_comes_from_the_statement_period(period):
+    lines = [period, "Electronic Payments", "12/30 WAWA 1234 5.25", "01/02 SHELL OIL 40.00"]
+    assert parse(lines) == [('12/30/2023', 'WAWA 1234'), ('01/02/2024', 'SHELL OIL')]
+
+
+def test_without_a_period_dates_keep_no_year():
+    assert parse(["Electronic Payments", "12/30 WAWA 1234 5.25"]) == [('12/30', 'WAWA 1234')]
+
+
+def test_period_is_only_read_from_the_first_page():
+    parser = StatementParser()
+    parser.parse_lines(["Electronic Payments", "12/30 WAWA 1234 5.25"])
+    page = parser.parse_lines(["Transfer 11/01/2023 - 11/30/2023", "12/31 SHELL OIL 40.00"])
+    assert parser.period_end is None
+    assert page[0]['date'] == '12/31'
+
+
+def test_leap_day_goes_to_the_previous_leap_year():
+    assert date_with_year('02/29', date(2025, 3, 31)) == '02/29/2024'
+    assert date_with_year('02/29', date(2100, 3, 31)) == '02/29/2096'
+    assert to_iso_date('02/29', 2025) == '2024-02-29'
+    dates = statement_dates(pd.Series(['02/28', '02/29']), year=2025)
+    assert dates.dt.strftime('%Y-%m-%d').tolist() == ['2025-02-28', '2024-02-29']
+
+
+def test_parse_period_end():
+    assert parse_period_end('01/02/24') == date(2024, 1, 2)
+    assert parse_period_end('January 2, 2024') == date(2024, 1, 2)
+    assert parse_period_end('13/45/2024') is None
+
+
+def test_ledger_takes_dates_with_their_year_over_year(tmp_path):
+    ledger = Ledger(str(tmp_path / 'ledger.sqlite'))
+    df = pd.DataFrame({'date': ['12/30/2023', '01/02/2024', '02/29'], 'description': ['WAWA', 'SHELL', 'PSEG'],
+                       'amount': ['5.25', '40.00', '9.00'], 'category': ['Food', 'Gas', 'Utilities']})
+    ledger.add_transactions(df, 'statement.pdf', year=2025)
+    assert [row[0] for row in ledger.conn.execute("SELECT date FROM transactions ORDER BY date")] == \
+        ['2023-12-30', '2024-01-02', '2024-02-29']
+    ledger.close()
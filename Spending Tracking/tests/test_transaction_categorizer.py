@@ -0,0 +1,29 @@
+import pytest
+from category_cache import open_keyword_cache
+from transaction_categorizer import RULES_PATH, categorize_transaction
+
+
+@pytest.mark.parametrize('description', ["MATTRESS FIRM #0412", "BATTERY PLUS BULBS", "ATTIC STORAGE LLC", "PLATTSBURGH DINER"])
+def test_att_keyword_does_not_match_inside_words(description):
+    assert categorize_transaction(description) != 'Utilities'
+
+
+@pytest.mark.parametrize('description', ["AT&T WIRELESS PAYMENT", "AT&T*BILL PAYMENT", "VERIZON WIRELESS"])
+def test_utilities_keywords(description):
+    assert categorize_transaction(description) == 'Utilities'
+
+
+def test_first_matching_rule_wins():
+    # 'amazon prime' comes before 'amazon' in the rules file
+    assert categorize_transaction("AMAZON PRIME*2K4") == 'Subscriptions'
+    assert categorize_transaction("AMAZON MKTPLACE") == 'Shopping'
+
+
+def test_unknown_description_is_default():
+    assert categorize_transaction("SOMETHING UNHEARD OF") == 'Miscellaneous'
+
+
+def test_cache_keeps_ampersand_apart(tmp_path):
+    cache = open_keyword_cache(RULES_PATH, str(tmp_path / 'cache.sqlite'))
+    assert categorize_transaction("AT&T", cache=cache) == 'Utilities'
+    assert categorize_transaction("ATT", cache=cache) == 'Miscellaneous'
@@ -0,0 +1,162 @@
+import time
+import pandas as pd
+from dedup_index import DuplicateIndex
+from ledger import Ledger
+from pipeline_metrics import metrics
+from sheets_outbox import SheetsOutbox
+from watch_folder import JobQueue, WatchService
+
+SHEET_URL = 'https://docs.google.com/spreadsheets/d/abc123/edit'
+MARCH = pd.DataFrame({
+    'date': ['03/01/2024', '03/02/2024'],
+    'description': ['WAWA 1234', 'SHELL OIL 5541'],
+    'amount': ['-5.25', '-40.00'],
+    'category': ['Food', 'Gas'],
+})
+
+
+# Function to set up a service with a ledger and outbox in tmp_path, and a claimed job for march.pdf
+def claimed_job(tmp_path, duplicates=None, name='march.pdf', content=b'%PDF march'):
+    (tmp_path / 'inbox').mkdir(exist_ok=True)
+    (tmp_path / 'out').mkdir(exist_ok=True)
+    pdf = tmp_path / 'inbox' / name
+    pdf.write_bytes(content)
+    jobs = JobQueue(str(tmp_path / 'jobs.sqlite'))
+    service = WatchService(str(tmp_path / 'inbox'), jobs, str(tmp_path / 'out'), ledger_path=str(tmp_path / 'ledger.sqlite'),
+                           sheet_url=SHEET_URL, sheet_title='Transactions', duplicates=duplicates)
+    service.outbox = SheetsOutbox(str(tmp_path / 'outbox.sqlite'))
+    stat = pdf.stat()
+    jobs.enqueue(str(pdf), stat.st_size, stat.st_mtime_ns)
+    return service, jobs
+
+
+# Function to claim the next job and hash it as submit_jobs does
+def claim(service, jobs):
+    from watch_folder import file_digest
+
+    job = jobs.claim()
+    job['digest'] = file_digest(job['path'])
+    return job
+
+
+def result(df=MARCH):
+    return df, (0, 0), metrics.snapshot()
+
+
+def counts(tmp_path):
+    ledger = Ledger(str(tmp_path / 'ledger.sqlite'))
+    try:
+        rows = ledger.conn.execute("SELECT COUNT(*) FROM transactions").fetchone()[0]
+        rollups = ledger.conn.execute("SELECT SUM(count) FROM category_rollups").fetchone()[0]
+    finally:
+        ledger.close()
+    outbox = SheetsOutbox(str(tmp_path / 'outbox.sqlite'))
+    try:
+        queued = outbox.conn.execute("SELECT COUNT(*) FROM outbox").fetchone()[0]
+    finally:
+        outbox.close()
+    return rows, rollups, queued
+
+
+def test_job_recovered_after_completing_is_not_added_twice(tmp_path):
+    service, jobs = claimed_job(tmp_path)
+    job = claim(service, jobs)
+    # The watcher is killed after writing everything but before marking the job done
+    service.jobs.finish = lambda *args: None
+    service.complete(job, result(), time.monotonic())
+    del service.jobs.finish
+    assert jobs.recover() == 1
+
+    job = claim(service, jobs)
+    service.complete(job, result(), time.monotonic())
+    assert counts(tmp_path) == (2, 2, 2)
+    assert jobs.counts() == {'done': 1}
+
+
+def test_retry_after_a_failed_step_is_not_added_twice(tmp_path):
+    service, jobs = claimed_job(tmp_path)
+    enqueue = service.outbox.enqueue
+    calls = []
+
+    def flaky_enqueue(*args):
+        calls.append(args)
+        if len(calls) == 1:
+            raise RuntimeError("database is locked")
+        return enqueue(*args)
+
+    service.outbox.enqueue = flaky_enqueue
+    job = claim(service, jobs)
+    try:
+        service.complete(job, result(), time.monotonic())
+    except RuntimeError as e:
+        service.retry_or_fail(job, str(e))
+    assert jobs.counts() == {'queued': 1}
+    jobs.conn.execute("UPDATE jobs SET next_attempt_at = 0")
+
+    service.complete(claim(service, jobs), result(), time.monotonic())
+    assert counts(tmp_path) == (2, 2, 2)
+
+
+def test_same_statement_dropped_again_is_skipped(tmp_path):
+    service, jobs = claimed_job(tmp_path)
+    service.complete(claim(service, jobs), result(), time.monotonic())
+    service, jobs = claimed_job(tmp_path, name='march copy.pdf')
+    service.complete(claim(service, jobs), result(), time.monotonic())
+    assert counts(tmp_path) == (2, 2, 2)
+
+
+# Function to build what a worker returns when statements are screened before categorizing: just the transactions
+def extracted(df=MARCH):
+    return df[['date', 'description', 'amount']].to_dict(orient='records'), metrics.snapshot()
+
+
+def test_dedup_screens_a_changed_statement_before_categorizing(tmp_path, monkeypatch):
+    import batch_ingest
+
+    categorized = []
+    categorize = batch_ingest.categorize_statement_cached
+
+    def record_categorize(transactions, *args):
+        categorized.append([t['description'] for t in transactions])
+        return categorize(transactions, *args)
+
+    monkeypatch.setattr(batch_ingest, 'categorize_statement_cached', record_categorize)
+    duplicates = DuplicateIndex(str(tmp_path / 'dedup.sqlite'))
+    service, jobs = claimed_job(tmp_path, duplicates)
+    service.complete(claim(service, jobs), extracted(), time.monotonic())
+
+    # Re-saved with different bytes and one more transaction
+    april = pd.concat([MARCH, pd.DataFrame({'date': ['04/01/2024'], 'description': ['VERIZON WIRELESS'],
+                                            'amount': ['-89.99'], 'category': [None]})], ignore_index=True)
+    service, jobs = claimed_job(tmp_path, duplicates, content=b'%PDF march, re-saved')
+    job = claim(service, jobs)
+    # The first try fails after screening; its fingerprints must not count as seen on the retry
+    service.ledger_path = str(tmp_path / 'missing' / 'ledger.sqlite')
+    try:
+        service.complete(job, extracted(april), time.monotonic())
+    except Exception as e:
+        service.retry_or_fail(job, str(e))
+    service.ledger_path = str(tmp_path / 'ledger.sqlite')
+    jobs.conn.execute("UPDATE jobs SET next_attempt_at = 0")
+
+    service.complete(claim(service, jobs), extracted(april), time.monotonic())
+    assert counts(tmp_path) == (3, 3, 3)
+    assert list(pd.read_csv(tmp_path / 'out' / 'march.csv')['description']) == ['VERIZON WIRELESS']
+    # Only the new transaction was ever categorized after the first statement
+    assert categorized[1:] == [['VERIZON WIRELESS'], ['VERIZON WIRELESS']]
+
+
+def test_statement_without_a_year_fails_without_retries(tmp_path):
+    from concurrent.futures import Future
+
+    service, jobs = claimed_job(tmp_path, DuplicateIndex(str(tmp_path / 'dedup.sqlite')))
+    job = claim(service, jobs)
+    future = Future()
+    future.set_result(extracted(MARCH.assign(date=['03/01', '03/02'])))
+    service.running = {future: (job, time.monotonic())}
+    service.collect(0)
+
+    [failed] = jobs.recent()
+    assert (failed['status'], failed['attempts']) == ('failed', 1)
+    assert 'pass --year' in failed['error']
+    assert service.failed == 1 and counts(tmp_path) == (0, None, 0)
@@ -0,0 +1,117 @@
+import json
+import os
+import pandas as pd
+from category_cache import file_signature
+
+# The consolidated corpus lives inside the training folder
+CORPUS_FOLDER_NAME = '.corpus'
+# Segments are merged back into one file once there are this many
+MAX_SEGMENTS = 20
+
+# Function to list the training CSV files in a folder
+def list_training_files(folder_path):
+    return sorted(f for f in os.listdir(folder_path) if f.endswith('.csv'))
+
+# Function to read one training CSV with only the columns and types training needs
+def read_training_csv(path):
+    data = pd.read_csv(path, usecols=['description', 'category'], dtype=str)
+    return data.dropna()
+
+# Function to get the corpus folder for a training folder
+def corpus_path_for(folder_path):
+    return os.path.join(folder_path, CORPUS_FOLDER_NAME)
+
+# Function to load the corpus manifest: source files already ingested and the segment files
+def load_corpus_manifest(corpus_path):
+    path = os.path.join(corpus_path, 'manifest.json')
+    if not os.path.exists(path):
+        return {'files': {}, 'segments': [], 'next_segment': 1}
+    with open(path) as f:
+        return json.load(f)
+
+# Function to save the corpus manifest
+def save_corpus_manifest(corpus_path, manifest):
+    with open(os.path.join(corpus_path, 'manifest.json'), 'w') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+
+# Function to describe a source file; the hash is only recomputed when its size or mtime moved
+def describe_source_file(path, previous=None):
+    stat = os.stat(path)
+    if previous and previous['size'] == stat.st_size and previous['mtime'] == stat.st_mtime_ns:
+        return previous
+    return {'size': stat.st_size, 'mtime': stat.st_mtime_ns, 'sha1': file_signature(path)}
+
+# Function to write a segment as uncompressed Feather so it can be memory-mapped on load
+def write_segment(corpus_path, manifest, data):
+    name = f"segment_{manifest['next_segment']:05d}.feather"
+    manifest['next_segment'] += 1
+    data = data.reset_index(drop=True)
+    data['category'] = data['category'].astype('category')
+    data.to_feather(os.path.join(corpus_path, name), compression='uncompressed')
+    manifest['segments'].append(name)
+
+# Function to read all corpus segments memory-mapped
+def read_segments(corpus_path, manifest):
+    import pyarrow.feather as feather
+    return [feather.read_table(os.path.join(corpus_path, name), memory_map=True).to_pandas()
+            for name in manifest['segments']]
+
+# Function to delete every segment file and start an empty manifest
+def reset_corpus(corpus_path, manifest):
+    for name in manifest['segments']:
+        path = os.path.join(corpus_path, name)
+        if os.path.exists(path):
+            os.remove(path)
+    return {'files': {}, 'segments': [], 'next_segment': manifest['next_segment']}
+
+# Function to combine frames into one deduplicated corpus with a categorical category column
+def combine_frames(frames):
+    if not frames:
+        return pd.DataFrame({'description': pd.Series(dtype=str), 'category': pd.Series(dtype='category')})
+    corpus = pd.concat([frame.astype({'category': str}) for frame in frames], ignore_index=True)
+    corpus = corpus.drop_duplicates(ignore_index=True)
+    corpus['category'] = corpus['category'].astype('category')
+    return corpus
+
+# Function to load the training corpus, ingesting only CSV files that have not been ingested yet
+# New files are appended as a new segment; a changed or removed file rebuilds the whole store
+# because its old rows cannot be picked back out of the segments
+def load_training_corpus(folder_path, rebuild=False):
+    corpus_path = corpus_path_for(folder_path)
+    os.makedirs(corpus_path, exist_ok=True)
+    manifest = load_corpus_manifest(corpus_path)
+
+    sources = {}
+    for name in list_training_files(folder_path):
+        sources[name] = describe_source_file(os.path.join(folder_path, name), manifest['files'].get(name))
+    stale = any(sources.get(name, {}).get('sha1') != info['sha1'] for name, info in manifest['files'].items())
+    if rebuild or stale:
+        manifest = reset_corpus(corpus_path, manifest)
+
+    # Refresh stat info for unchanged files so the next load can skip hashing them
+    for name in manifest['files']:
+        manifest['files'][name] = sources[name]
+
+    segments = read_segments(corpus_path, manifest)
+    new_files = [name for name in sources if name not in manifest['files']]
+    if new_files:
+        new_data = combine_frames([read_training_csv(os.path.join(folder_path, name)) for name in new_files])
+        if segments:
+            existing = combine_frames(segments)
+            seen = pd.MultiIndex.from_frame(existing.astype({'category': str}))
+            new_data = new_data[~pd.MultiIndex.from_frame(new_data.astype({'category': str})).isin(seen)]
+        if len(new_data):
+            write_segment(corpus_path, manifest, new_data)
+            segments.append(new_data)
+        for name in new_files:
+            manifest['files'][name] = sources[name]
+
+    corpus = combine_frames(segments)
+    if len(manifest['segments']) > MAX_SEGMENTS:
+        # Compact the store back into a single segment
+        files = manifest['files']
+        manifest = reset_corpus(corpus_path, manifest)
+        manifest['files'] = files
+        write_segment(corpus_path, manifest, corpus)
+    save_corpus_manifest(corpus_path, manifest)
+    return corpus
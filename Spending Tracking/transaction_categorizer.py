@@ -0,0 +1,213 @@
+import json
+import logging
+import os
+import re
+from pipeline_metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+# Keyword rules used by categorize_transaction, checked in file order
+RULES_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'category_rules.json')
+DEFAULT_CATEGORY = 'Miscellaneous'
+
+# Compiled rules per rules file, filled in by get_category_matcher
+_compiled_rules = {}
+
+# Function to normalize the description
+def normalize_description(description):
+    description = re.sub(r'[^a-zA-Z0-9\s]', '', description).lower()
+    return description
+
+# Function to prepare a description or keyword for the keyword rules
+# Like normalize_description, but '&' is kept so 'at&t' matches AT&T and not MATTRESS or BATTERY
+def normalize_rule_text(text):
+    return re.sub(r'[^a-zA-Z0-9\s&]', '', text).lower()
+
+# Function to load the ordered category -> keywords table from the rules file
+def load_category_rules(rules_path=RULES_PATH):
+    with open(rules_path) as f:
+        return json.load(f)
+
+# Function to build a regex that matches any of the keywords, factored as a prefix trie
+# so each position is checked one character at a time instead of keyword by keyword
+def build_trie_pattern(keywords):
+    trie = {}
+    for keyword in keywords:
+        node = trie
+        for ch in keyword:
+            node = node.setdefault(ch, {})
+        node[''] = True
+
+    def emit(node):
+        branches = [re.escape(ch) + emit(child) for ch, child in sorted(node.items()) if ch]
+        if not branches:
+            return ''
+        body = branches[0] if len(branches) == 1 else '(?:' + '|'.join(branches) + ')'
+        # A keyword ends here, so the longer continuations are optional (tried first)
+        if '' in node:
+            body = '(?:' + body + ')?'
+        return body
+
+    return emit(trie)
+
+# Function to compile the rules into one automaton that classifies a description in a single scan
+# Every position reports the longest keyword starting there; keywords that have a
+# higher-priority keyword as a prefix can never win and are dropped, so the longest
+# match is also the highest-priority one and the first-match order of the rules file is kept
+def compile_category_rules(rules):
+    categories = []
+    priorities = {}
+    for rule in rules['rules']:
+        categories.append(rule['category'])
+        for keyword in rule['keywords']:
+            keyword = normalize_rule_text(keyword)
+            if keyword:
+                priorities.setdefault(keyword, len(categories) - 1)
+    keywords = [keyword for keyword, priority in priorities.items()
+                if not any(priorities.get(keyword[:n], priority) < priority for n in range(1, len(keyword)))]
+    pattern = re.compile('(?=(' + build_trie_pattern(keywords) + '))') if keywords else None
+    return pattern, priorities, categories, rules.get('default', DEFAULT_CATEGORY)
+
+# Function to get the compiled rules for a rules file, compiling them only once
+def get_category_matcher(rules_path=RULES_PATH):
+    if rules_path not in _compiled_rules:
+        _compiled_rules[rules_path] = compile_category_rules(load_category_rules(rules_path))
+    return _compiled_rules[rules_path]
+
+# Function to categorize transactions based on the description
+# A CategoryCache from open_keyword_cache can be passed to memoize results across runs
+def categorize_transaction(description, rules_path=RULES_PATH, cache=None):
+    description = normalize_rule_text(description)
+    if cache is not None:
+        entry = cache.get(description)
+        if entry is not None:
+            return entry[0]
+    pattern, priorities, categories, default = get_category_matcher(rules_path)
+    best = None
+    if pattern is not None:
+        for match in pattern.finditer(description):
+            priority = priorities[match.group(1)]
+            if best is None or priority < best:
+                best = priority
+                if best == 0:
+                    break
+    category = categories[best] if best is not None else default
+    if cache is not None:
+        cache.put(description, category)
+    return category
+
+# Function to load the model
+# joblib and numpy are imported where they are used, so keyword-only callers start without them.
+# A compact .npz export of the same model (see compact_model.py) is used instead of the pickle
+# when there is one, so scikit-learn is not loaded at all; pass an .npz path to require it.
+# The .npz is a generated file: when it is missing or stale it is exported from the pickle here.
+def load_model(model_path):
+    from compact_model import compact_path_for, is_compact_current, load_compact_model
+    if model_path.endswith('.npz'):
+        return load_compact_model(model_path)
+    compact_path = compact_path_for(model_path)
+    if is_compact_current(compact_path, model_path):
+        return load_compact_model(compact_path)
+    import joblib
+    model = joblib.load(model_path)
+    export_compact_model(model, model_path, compact_path)
+    return model
+
+# Function to export a loaded pickled model to its compact .npz for the next run
+# Written to a temporary file first so parallel workers never read half an export
+def export_compact_model(model, model_path, compact_path):
+    from category_cache import file_signature
+    from compact_model import export_model
+    temp_path = f"{compact_path}.{os.getpid()}.tmp"
+    try:
+        export_model(model, temp_path, file_signature(model_path))
+        os.replace(temp_path, compact_path)
+    except (ValueError, AttributeError, OSError) as e:
+        logger.debug("Not exporting %s to %s: %s", model_path, compact_path, e)
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+
+# Function to categorize transactions using the trained model
+# A CategoryCache from open_model_cache can be passed to memoize results across runs
+def categorize_transaction_ml(description, model, cache=None):
+    if cache is not None:
+        return predict_categories([description], model, cache)[0][0]
+    return model.predict([description])[0]
+
+# Function to categorize many descriptions with a single model call
+# Returns the predicted categories and the model's confidence in each of them.
+# With a cache, only descriptions whose normalized form has not been seen are sent to the model.
+def predict_categories(descriptions, model, cache=None):
+    import numpy as np
+    descriptions = list(descriptions)
+    if not descriptions:
+        return np.array([], dtype=object), np.array([], dtype=float)
+    if cache is None:
+        probabilities = model.predict_proba(descriptions)
+        best = probabilities.argmax(axis=1)
+        return model.classes_[best], probabilities[np.arange(len(descriptions)), best]
+
+    keys = [normalize_description(description) for description in descriptions]
+    results = {}
+    misses = {}
+    for key, description in zip(keys, descriptions):
+        if key in results or key in misses:
+            continue
+        entry = cache.get(key)
+        if entry is not None:
+            results[key] = entry
+        else:
+            misses[key] = description
+    if misses:
+        categories, confidences = predict_categories(list(misses.values()), model)
+        for key, category, confidence in zip(misses, categories, confidences):
+            results[key] = (category, float(confidence))
+            cache.put(key, category, float(confidence))
+    categories = np.array([results[key][0] for key in keys], dtype=object)
+    confidences = np.array([results[key][1] for key in keys], dtype=float)
+    return categories, confidences
+
+# Function to add a keyword category column to a transactions DataFrame
+def categorize_dataframe(df, rules_path=RULES_PATH, cache=None):
+    with metrics.stage('categorize'):
+        df['category'] = df['description'].apply(lambda x: categorize_transaction(x, rules_path, cache))
+    metrics.count('rows_categorized', len(df))
+    return df
+
+# Function to add ML category and confidence columns to a transactions DataFrame
+def categorize_dataframe_ml(df, model, cache=None):
+    with metrics.stage('categorize'):
+        df['category'], df['confidence'] = predict_categories(df['description'], model, cache)
+    metrics.count('rows_categorized', len(df))
+    return df
+
+# Function to re-categorize transactions if initially classified as 'Miscellaneous'
+# Each one takes the category of the nearest known merchant (see merchant_index.py) when one is close enough.
+# The similarity to that merchant goes in a match_similarity column (empty for other rows); the model's
+# confidence column is left as the model gave it. model is accepted for older callers but not needed.
+# Each change is logged at DEBUG (INFO with verbose=True)
+def re_categorize_miscellaneous(df, model=None, verbose=False, index=None):
+    # Always added, so every chunk of a streamed statement has the same columns
+    if 'match_similarity' not in df.columns:
+        df['match_similarity'] = float('nan')
+    positions = (df['category'] == 'Miscellaneous').to_numpy().nonzero()[0]
+    if not len(positions):
+        return df
+    if index is None:
+        from merchant_index import get_merchant_index
+        index = get_merchant_index()
+    level = logging.INFO if verbose else logging.DEBUG
+    category_column = df.columns.get_loc('category')
+    similarity_column = df.columns.get_loc('match_similarity')
+    with metrics.stage('re_categorize'):
+        for position in positions:
+            description = df['description'].iat[position]
+            match = index.lookup(description)
+            if match is None:
+                continue
+            merchant, category, similarity = match
+            df.iat[position, category_column] = category
+            df.iat[position, similarity_column] = similarity
+            metrics.count('rows_recategorized')
+            logger.log(level, "Re-categorized: %s as %s (like %s)", description, category, merchant)
+    return df
@@ -0,0 +1,74 @@
+from datetime import date
+import numpy as np
+import pandas as pd
+from statement_parser import leap_day_year
+
+# Function to normalize a whole column of descriptions at once, exactly like normalize_description
+# Repeated descriptions are only normalized once
+def normalize_descriptions(descriptions):
+    codes, uniques = pd.factorize(descriptions.astype(str))
+    normalized = pd.Series(uniques, dtype=object).str.replace(r'[^a-zA-Z0-9\s]', '', regex=True).str.lower()
+    return pd.Series(normalized.to_numpy()[codes], index=descriptions.index)
+
+# Function to convert a column of statement amounts such as '1,234.56', '-12.00' or '$5' to int64 cents
+def amounts_to_cents(amounts):
+    if pd.api.types.is_numeric_dtype(amounts):
+        values = amounts.astype(float)
+    else:
+        values = pd.to_numeric(amounts.astype(str).str.replace(r'[,$\s]', '', regex=True), errors='coerce')
+        if values.isna().any():
+            raise ValueError(f"Not an amount: {amounts[values.isna()].iloc[0]!r}")
+    return pd.Series(np.rint(values.to_numpy() * 100).astype('int64'), index=amounts.index)
+
+# Function to turn a column of statement 'MM/DD' dates into real dates
+# Statements leave out the year, so each date gets the latest year that does not put it after the
+# end of the statement period: with period_end in January, December dates fall in the year before.
+# year fixes the period to that calendar year; without either the period ends today.
+# 02/29 in a year that is not a leap year goes to the leap year before it.
+# Dates that carry their own year ('MM/DD/YYYY') keep it.
+def statement_dates(dates, year=None, period_end=None):
+    if period_end is None:
+        period_end = date(year, 12, 31) if year else date.today()
+    # A statement has at most a few hundred distinct dates, so each is only parsed once
+    codes, uniques = pd.factorize(dates.astype(str).str.strip())
+    result = parse_statement_dates(pd.Series(uniques, dtype=object), period_end)
+    return pd.Series(result.to_numpy()[codes], index=dates.index)
+
+# Function to parse distinct statement dates against the end of the statement period
+def parse_statement_dates(dates, period_end):
+    parts = dates.str.extract(r'^(\d{1,2})/(\d{1,2})(?:/(\d{4}))?$')
+    if parts[0].isna().any():
+        raise ValueError(f"Not a statement date: {dates[parts[0].isna()].iloc[0]!r}")
+    month = parts[0].astype(int)
+    day = parts[1].astype(int)
+    after_end = (month > period_end.month) | ((month == period_end.month) & (day > period_end.day))
+    years = pd.Series(np.where(after_end, period_end.year - 1, period_end.year), index=dates.index)
+    leap_days = (month == 2) & (day == 29)
+    if leap_days.any():
+        years[leap_days] = years[leap_days].map(lambda year: leap_day_year(2, 29, year))
+    years = years.where(parts[2].isna(), pd.to_numeric(parts[2]))
+    result = pd.to_datetime(pd.DataFrame({'year': years, 'month': month, 'day': day}), errors='coerce')
+    if result.isna().any():
+        raise ValueError(f"Not a calendar date: {dates[result.isna()].iloc[0]!r}")
+    return result
+
+# Function to convert extracted or categorized transactions into a typed frame in one vectorized pass
+# Takes a DataFrame or a list of transaction dicts with date, description and amount columns.
+# The frame has date (datetime64), description, merchant (normalized description), amount_cents (int64)
+# and category, plus confidence and source_file when present; merchant, category and source_file are categorical
+def to_transaction_frame(transactions, year=None, period_end=None):
+    df = transactions if isinstance(transactions, pd.DataFrame) else \
+        pd.DataFrame(transactions, columns=['date', 'description', 'amount'])
+    frame = pd.DataFrame({
+        'date': statement_dates(df['date'], year, period_end),
+        'description': df['description'].astype(str),
+        'merchant': normalize_descriptions(df['description']).astype('category'),
+        'amount_cents': amounts_to_cents(df['amount']),
+    }, index=df.index)
+    frame['category'] = (df['category'] if 'category' in df.columns else pd.Series(None, index=df.index, dtype=object)) \
+        .astype('category')
+    if 'confidence' in df.columns:
+        frame['confidence'] = df['confidence'].astype(float)
+    if 'source_file' in df.columns:
+        frame['source_file'] = df['source_file'].astype('category')
+    return frame.reset_index(drop=True)
@@ -0,0 +1,521 @@
+import argparse
+import ctypes
+import ctypes.util
+import hashlib
+import logging
+import os
+import select
+import sqlite3
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+from datetime import datetime
+from pipeline_metrics import add_logging_arguments, configure_logging, metrics, report_metrics
+
+logger = logging.getLogger(__name__)
+
+# File paths
+MODEL_PATH = 'transaction_categorizer_model.pkl'
+JOBS_PATH = 'ingest_jobs.sqlite'
+OUTPUT_DIR = 'categorized'
+
+# A file is only queued once its size and modification time have stayed the same this long,
+# so statements still being copied into the inbox are not read half-written
+SETTLE_SECONDS = 1.0
+# How often the inbox is listed when inotify is not available
+POLL_INTERVAL = 2.0
+# How often it is listed anyway with inotify, which does not see files written from other machines to a network share
+RESCAN_INTERVAL = 30.0
+
+# Failed jobs are retried after RETRY_DELAY, doubling each time, until MAX_ATTEMPTS have failed
+MAX_ATTEMPTS = 3
+RETRY_DELAY = 5.0
+
+# inotify event masks (see inotify(7))
+IN_CREATE = 0x100
+IN_DELETE = 0x200
+IN_CLOSE_WRITE = 0x8
+IN_MOVED_TO = 0x80
+
+JOBS_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY,
+    path TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    status TEXT NOT NULL DEFAULT 'queued',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    next_attempt_at REAL NOT NULL DEFAULT 0,
+    queued_at TEXT NOT NULL,
+    started_at TEXT,
+    finished_at TEXT,
+    rows INTEGER,
+    output TEXT,
+    error TEXT,
+    UNIQUE (path, size, mtime_ns)
+);
+CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs(status, next_attempt_at);
+"""
+
+# Raised for a statement that fails the same way however often it is tried, so its job fails at once
+class PermanentJobError(Exception):
+    pass
+
+# Function to get the current time for job records
+def now_iso():
+    return datetime.now().isoformat(timespec='seconds')
+
+# Persistent queue of statements to ingest, one job per version of a file
+# Jobs go queued -> running -> done, or back to queued to be retried after a failure and
+# failed once MAX_ATTEMPTS have failed. A job left running by a crash is queued again on open.
+class JobQueue:
+    def __init__(self, path=JOBS_PATH, max_attempts=MAX_ATTEMPTS, retry_delay=RETRY_DELAY):
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self.conn = sqlite3.connect(path, timeout=30)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.executescript(JOBS_SCHEMA)
+
+    def close(self):
+        self.conn.close()
+
+    # Function to queue the jobs a crashed or killed watcher left running; returns how many there were
+    def recover(self):
+        with self.conn:
+            return self.conn.execute("UPDATE jobs SET status = 'queued', started_at = NULL "
+                                     "WHERE status = 'running'").rowcount
+
+    # Function to queue a version of a file; returns False when that version was queued before
+    def enqueue(self, path, size, mtime_ns):
+        with self.conn:
+            cursor = self.conn.execute("INSERT OR IGNORE INTO jobs (path, size, mtime_ns, queued_at) VALUES (?, ?, ?, ?)",
+                                       (path, size, mtime_ns, now_iso()))
+        return cursor.rowcount > 0
+
+    # Function to take the oldest job that is due and mark it running; None when there is none
+    def claim(self):
+        with self.conn:
+            job = self.conn.execute("SELECT * FROM jobs WHERE status = 'queued' AND next_attempt_at <= ? "
+                                    "ORDER BY next_attempt_at, id LIMIT 1", (time.time(),)).fetchone()
+            if job is None:
+                return None
+            self.conn.execute("UPDATE jobs SET status = 'running', attempts = attempts + 1, started_at = ?, error = NULL "
+                              "WHERE id = ?", (now_iso(), job['id']))
+        return dict(job, attempts=job['attempts'] + 1)
+
+    # Function to mark a job done
+    def finish(self, job, rows, output):
+        with self.conn:
+            self.conn.execute("UPDATE jobs SET status = 'done', finished_at = ?, rows = ?, output = ? WHERE id = ?",
+                              (now_iso(), rows, output, job['id']))
+
+    # Function to record a failed attempt: the job is retried later unless it is out of attempts or retry is False
+    # Returns the job's new status
+    def fail(self, job, error, retry=True):
+        if retry and job['attempts'] < self.max_attempts:
+            delay = self.retry_delay * 2 ** (job['attempts'] - 1)
+            with self.conn:
+                self.conn.execute("UPDATE jobs SET status = 'queued', next_attempt_at = ?, error = ? WHERE id = ?",
+                                  (time.time() + delay, error, job['id']))
+            return 'queued'
+        with self.conn:
+            self.conn.execute("UPDATE jobs SET status = 'failed', finished_at = ?, error = ? WHERE id = ?",
+                              (now_iso(), error, job['id']))
+        return 'failed'
+
+    # Function to queue failed jobs again with fresh attempts; returns how many there were
+    def retry_failed(self):
+        with self.conn:
+            return self.conn.execute("UPDATE jobs SET status = 'queued', attempts = 0, next_attempt_at = 0, "
+                                     "finished_at = NULL WHERE status = 'failed'").rowcount
+
+    # Function to get the seconds until the next queued job is due (0 if one is due now, None if none are queued)
+    def seconds_until_due(self):
+        due = self.conn.execute("SELECT MIN(next_attempt_at) FROM jobs WHERE status = 'queued'").fetchone()[0]
+        return None if due is None else max(0.0, due - time.time())
+
+    # Function to count the jobs in each status
+    def counts(self):
+        return dict(self.conn.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall())
+
+    # Function to list the most recent jobs, newest first
+    def recent(self, limit=20):
+        return [dict(row) for row in self.conn.execute("SELECT * FROM jobs ORDER BY id DESC LIMIT ?", (limit,))]
+
+# Wakes the watcher as soon as files in the inbox are written, moved in or removed, through Linux inotify
+# Events are only used as a wake-up; the inbox is listed afterwards to see what changed
+class InotifyWatcher:
+    def __init__(self, folder):
+        libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        self.fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        mask = IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE | IN_DELETE
+        if libc.inotify_add_watch(self.fd, os.fsencode(folder), mask) < 0:
+            error = ctypes.get_errno()
+            os.close(self.fd)
+            raise OSError(error, f"Cannot watch {folder}")
+        self.interval = RESCAN_INTERVAL
+
+    # Function to wait up to timeout seconds for changes; returns True when there were any
+    def wait(self, timeout):
+        readable, _, _ = select.select([self.fd], [], [], timeout)
+        if not readable:
+            return False
+        try:
+            while os.read(self.fd, 65536):
+                pass
+        except BlockingIOError:
+            pass
+        return True
+
+    def close(self):
+        os.close(self.fd)
+
+# Lists the inbox every POLL_INTERVAL seconds, where inotify is not available
+class PollingWatcher:
+    def __init__(self, folder, interval=POLL_INTERVAL):
+        self.interval = interval
+
+    def wait(self, timeout):
+        time.sleep(timeout)
+        return True
+
+    def close(self):
+        pass
+
+# Function to watch a folder with inotify where possible, falling back to polling
+def open_watcher(folder, poll=False):
+    if not poll and sys.platform.startswith('linux'):
+        try:
+            return InotifyWatcher(folder)
+        except (OSError, AttributeError) as e:
+            logger.warning("inotify is not available (%s), polling %s instead", e, folder)
+    return PollingWatcher(folder)
+
+# Function to hash a statement's content, identifying it in the ledger, outbox and duplicate index
+def file_digest(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as file:
+        for block in iter(lambda: file.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+# Function to write a CSV through a temporary file, so readers never see a half-written one
+def write_csv_atomically(df, path):
+    temp_file = f"{path}.{os.getpid()}.tmp"
+    df.to_csv(temp_file, index=False)
+    os.replace(temp_file, path)
+
+# Watches an inbox folder and ingests every new or changed statement PDF through a bounded worker pool
+# Each statement is extracted and categorized in a worker (see batch_ingest.process_statement);
+# its CSV and ledger rows are written here, one statement at a time. With a duplicate index the
+# workers only extract, and each statement is screened and then categorized here, in order.
+# Every output is keyed by a hash of the PDF, so a job retried or recovered after a crash part way
+# through completing, or the same statement dropped in again, is never added twice
+class WatchService:
+    def __init__(self, inbox, jobs, output_dir=OUTPUT_DIR, model_path=None, cache_path=None, extraction_cache_dir=None,
+                 layout=None, workers=None, ledger_path=None, year=None, settle_seconds=SETTLE_SECONDS, poll=False,
+                 sheet_url=None, sheet_title=None, duplicates=None, flush_timeout=None):
+        from statement_parser import DEFAULT_LAYOUT
+
+        self.inbox = inbox
+        self.jobs = jobs
+        self.output_dir = output_dir
+        self.initargs = (model_path, cache_path, extraction_cache_dir, layout or DEFAULT_LAYOUT)
+        self.workers = workers or os.cpu_count()
+        self.ledger_path = ledger_path
+        self.year = year
+        self.settle_seconds = settle_seconds
+        self.poll = poll
+        self.sheet_url = sheet_url
+        self.sheet_title = sheet_title
+        self.duplicates = duplicates
+        self.flush_timeout = flush_timeout
+        # Categorizer used here when statements are screened before categorizing
+        self.model = None
+        self.cache = None
+        self.outbox = None
+        # path -> (size, mtime_ns, when that version was first seen, whether it was queued)
+        self.seen = {}
+        self.executor = None
+        self.running = {}
+        # Jobs given up on during this run
+        self.failed = 0
+
+    # Function to list the inbox and queue every PDF that has settled since it last changed
+    # Returns True while some files are still settling
+    def scan(self):
+        now = time.monotonic()
+        present = set()
+        settling = False
+        for entry in os.scandir(self.inbox):
+            if not entry.name.lower().endswith('.pdf') or not entry.is_file():
+                continue
+            try:
+                stat = entry.stat()
+            except FileNotFoundError:
+                continue
+            present.add(entry.path)
+            previous = self.seen.get(entry.path)
+            if previous is None or previous[:2] != (stat.st_size, stat.st_mtime_ns):
+                self.seen[entry.path] = (stat.st_size, stat.st_mtime_ns, now, False)
+                settling = True
+            elif not previous[3]:
+                if now - previous[2] < self.settle_seconds:
+                    settling = True
+                    continue
+                if self.jobs.enqueue(entry.path, stat.st_size, stat.st_mtime_ns):
+                    logger.info("Queued %s", entry.path)
+                self.seen[entry.path] = previous[:3] + (True,)
+        for path in set(self.seen) - present:
+            del self.seen[path]
+        return settling
+
+    def start_pool(self):
+        from batch_ingest import init_worker
+        initargs = self.initargs
+        if self.duplicates is not None:
+            # Workers only extract, so they need no model or category cache
+            initargs = (None, None) + initargs[2:]
+        self.executor = ProcessPoolExecutor(max_workers=self.workers, initializer=init_worker, initargs=initargs)
+
+    # Function to load the categorizer in this process, for screening statements before categorizing them
+    def open_categorizer(self):
+        from batch_ingest import open_category_cache
+        from transaction_categorizer import load_model
+        model_path, cache_path = self.initargs[:2]
+        self.model = load_model(model_path) if model_path else None
+        self.cache = open_category_cache(model_path, cache_path)
+
+    # Function to hand due jobs to the pool until every worker is busy
+    def submit_jobs(self):
+        from batch_ingest import extract_statement, process_statement
+
+        task = process_statement if self.duplicates is None else extract_statement
+        while len(self.running) < self.workers:
+            job = self.jobs.claim()
+            if job is None:
+                return
+            try:
+                job['digest'] = file_digest(job['path'])
+            except FileNotFoundError:
+                self.jobs.fail(job, "File was removed from the inbox", retry=False)
+                self.failed += 1
+                logger.warning("Skipped %s: it was removed from the inbox", job['path'])
+                continue
+            logger.info("Processing %s (attempt %s of %s)", job['path'], job['attempts'], self.jobs.max_attempts)
+            self.running[self.executor.submit(task, job['path'])] = (job, time.monotonic())
+
+    # Function to write out a finished statement and mark its job done
+    # Each step can be repeated: the CSV is replaced, and the ledger, outbox and duplicate index
+    # skip what they already hold for this PDF's hash
+    def complete(self, job, result, started):
+        if self.duplicates is None:
+            df, _, snapshot = result
+            metrics.merge(snapshot)
+        else:
+            from batch_ingest import screen_and_categorize
+            transactions, snapshot = result
+            metrics.merge(snapshot)
+            try:
+                df, _ = screen_and_categorize(transactions, job['path'], self.model, self.cache, self.duplicates,
+                                              self.year, job['digest'])
+            except ValueError as e:
+                # e.g. a statement without a printed period and no --year cannot be fingerprinted
+                raise PermanentJobError(str(e)) from e
+        stem = os.path.splitext(os.path.basename(job['path']))[0]
+        output = os.path.join(self.output_dir, f"{stem}.csv")
+        with metrics.stage('write_csv'):
+            write_csv_atomically(df, output)
+        if self.ledger_path:
+            from ledger import Ledger
+            with metrics.stage('ledger'):
+                ledger = Ledger(self.ledger_path)
+                try:
+                    if ledger.add_transactions(df, job['path'], self.year, job['digest']) is None:
+                        logger.info("%s is already in the ledger", job['path'])
+                finally:
+                    ledger.close()
+        if self.outbox is not None:
+            self.outbox.enqueue(df, self.sheet_url, self.sheet_title, job['digest'])
+        if self.duplicates is not None:
+            self.duplicates.commit()
+        self.jobs.finish(job, len(df), output)
+        metrics.count('statements_ingested')
+        logger.info("Ingested %s: %s transactions in %.1fs -> %s", job['path'], len(df), time.monotonic() - started, output)
+
+    # Function to collect the jobs that finished within timeout seconds
+    def collect(self, timeout):
+        done, _ = wait(self.running, timeout=timeout, return_when=FIRST_COMPLETED)
+        broken = False
+        for future in done:
+            job, started = self.running.pop(future)
+            try:
+                self.complete(job, future.result(), started)
+            except BrokenProcessPool:
+                broken = True
+                self.retry_or_fail(job, "Worker process died")
+            except PermanentJobError as e:
+                self.retry_or_fail(job, str(e), retry=False)
+            except Exception as e:
+                self.retry_or_fail(job, str(e) or type(e).__name__)
+        if broken:
+            # Every job still on the dead pool is lost with it
+            for job, _ in self.running.values():
+                self.retry_or_fail(job, "Worker process died")
+            self.running.clear()
+            self.executor.shutdown(cancel_futures=True)
+            self.start_pool()
+
+    def retry_or_fail(self, job, error, retry=True):
+        if self.duplicates is not None:
+            # The statement was not written out, so its transactions must not count as seen
+            self.duplicates.rollback()
+        status = self.jobs.fail(job, error, retry)
+        metrics.count('job_failures')
+        if status == 'queued':
+            logger.warning("Failed to process %s: %s (will retry)", job['path'], error)
+        elif not retry:
+            self.failed += 1
+            logger.error("Failed to process %s: %s (not retried)", job['path'], error)
+        else:
+            self.failed += 1
+            logger.error("Failed to process %s: %s (giving up after %s attempts)", job['path'], error, job['attempts'])
+
+    # Function to run until interrupted, or with once=True until the inbox has been ingested
+    def run(self, once=False):
+        os.makedirs(self.output_dir, exist_ok=True)
+        recovered = self.jobs.recover()
+        if recovered:
+            logger.warning("Queued %s jobs again that were interrupted by a crash", recovered)
+        watcher = open_watcher(self.inbox, self.poll)
+        flusher = None
+        if self.sheet_url:
+            from sheets_outbox import FLUSH_TIMEOUT, BackgroundFlusher, SheetsOutbox
+            from sheets_upload import new_worksheet_title
+            # Without a title, the rows of this run go to a new worksheet
+            self.sheet_title = self.sheet_title or new_worksheet_title()
+            self.outbox = SheetsOutbox()
+            flusher = BackgroundFlusher().start()
+        if self.duplicates is not None:
+            self.open_categorizer()
+        self.start_pool()
+        logger.info("Watching %s with %s workers (%s)", self.inbox, self.workers,
+                    'inotify' if isinstance(watcher, InotifyWatcher) else 'polling')
+        try:
+            while True:
+                settling = self.scan()
+                self.submit_jobs()
+                due = self.jobs.seconds_until_due()
+                if once and not settling and not self.running and due is None:
+                    return
+                # Sleep until a worker finishes, the inbox changes, a file settles or a retry is due
+                timeout = watcher.interval
+                if settling:
+                    timeout = min(timeout, self.settle_seconds / 2)
+                if due is not None:
+                    timeout = min(timeout, max(due, 0.05))
+                if self.running:
+                    self.collect(min(timeout, 0.25))
+                    watcher.wait(0)
+                else:
+                    watcher.wait(timeout)
+        finally:
+            # Jobs still running stay marked running and are queued again by recover() on the next start
+            watcher.close()
+            self.executor.shutdown(wait=not self.running, cancel_futures=True)
+            if flusher is not None:
+                self.outbox.close()
+                flusher.stop(FLUSH_TIMEOUT if self.flush_timeout is None else self.flush_timeout)
+
+# Function to print the job counts and the most recent jobs
+def print_status(jobs, limit=20):
+    counts = jobs.counts()
+    print(', '.join(f"{counts.get(status, 0)} {status}" for status in ('queued', 'running', 'done', 'failed')))
+    for job in jobs.recent(limit):
+        detail = f"{job['rows']} transactions" if job['status'] == 'done' else (job['error'] or '')
+        print(f"{job['id']:>5}  {job['status']:<8} {job['attempts']} tries  {job['path']}  {detail}")
+
+def main(argv=None):
+    from category_cache import CACHE_PATH
+    from dedup_index import DEDUP_INDEX_PATH, DuplicateIndex
+    from extraction_cache import EXTRACTION_CACHE_DIR
+    from sheets_outbox import FLUSH_TIMEOUT
+    from statement_parser import DEFAULT_LAYOUT, load_layouts
+
+    parser = argparse.ArgumentParser(description="Watch a folder and ingest every statement PDF dropped into it.")
+    parser.add_argument('inbox', nargs='?', default=None, help="Folder to watch for statement PDFs")
+    parser.add_argument('--output-dir', default=OUTPUT_DIR, help="Folder to write one categorized CSV per statement to")
+    parser.add_argument('--jobs', default=JOBS_PATH, help="Job queue file")
+    parser.add_argument('--categorizer', choices=['ml', 'keywords'], default='ml',
+                        help="Use the trained model (default) or the keyword rules")
+    parser.add_argument('--model', default=MODEL_PATH, help="Path to the trained model file")
+    parser.add_argument('--workers', type=int, default=None, help="Number of worker processes (default: one per core)")
+    parser.add_argument('--no-cache', action='store_true', help="Categorize every description from scratch")
+    parser.add_argument('--ledger', default=None, help="Also add the transactions to this SQLite ledger file")
+    parser.add_argument('--dedup', choices=['skip', 'flag'], default=None,
+                        help="Skip or flag transactions already ingested from another statement")
+    parser.add_argument('--dedup-index', default=DEDUP_INDEX_PATH, help="Duplicate index file shared across runs")
+    parser.add_argument('--year', type=int, default=None, help="Year for the dates of statements whose period is not printed in the PDF (default: this year)")
+    parser.add_argument('--sheet-url', default=None,
+                        help="Also send the transactions to this Google Sheet (through the outbox, see sheets_outbox.py)")
+    parser.add_argument('--sheet-title', default=None,
+                        help="Worksheet to add the transactions to (default: a new Transactions_<date>_<time> worksheet "
+                             "for each run; pass the same title every run to keep adding to one worksheet)")
+    parser.add_argument('--flush-timeout', type=float, default=FLUSH_TIMEOUT,
+                        help="Seconds to wait at exit for the rows to reach the sheet; the rest are sent on the next run "
+                             "(default: %(default)s)")
+    parser.add_argument('--layout', default=DEFAULT_LAYOUT, choices=sorted(load_layouts()),
+                        help="Bank statement layout from statement_layouts.json (default: %(default)s)")
+    parser.add_argument('--settle', type=float, default=SETTLE_SECONDS,
+                        help="Seconds a file must stay unchanged before it is ingested")
+    parser.add_argument('--poll', action='store_true', help="List the folder every few seconds instead of using inotify")
+    parser.add_argument('--once', action='store_true', help="Ingest what is in the folder, then exit")
+    parser.add_argument('--status', action='store_true', help="Show the job queue and exit")
+    parser.add_argument('--retry-failed', action='store_true', help="Queue the failed jobs again")
+    add_logging_arguments(parser)
+    args = parser.parse_args(argv)
+    configure_logging(args.verbose, args.quiet)
+
+    jobs = JobQueue(args.jobs)
+    if args.retry_failed:
+        logger.info("Queued %s failed jobs again", jobs.retry_failed())
+    if args.status:
+        print_status(jobs)
+        return 0
+    if args.inbox is None:
+        if args.retry_failed:
+            return 0
+        parser.error("the inbox folder is required")
+    if not os.path.isdir(args.inbox):
+        logger.error("Inbox folder not found: %s", args.inbox)
+        return 1
+
+    model_path = None
+    if args.categorizer == 'ml':
+        if not os.path.exists(args.model):
+            logger.error("Model file not found: %s (train it with 'Banking Model.py' or use --categorizer keywords)", args.model)
+            return 1
+        model_path = args.model
+
+    duplicates = DuplicateIndex(args.dedup_index, args.dedup) if args.dedup else None
+    service = WatchService(args.inbox, jobs, args.output_dir, model_path, None if args.no_cache else CACHE_PATH,
+                           EXTRACTION_CACHE_DIR, args.layout, args.workers, args.ledger, args.year, args.settle, args.poll,
+                           args.sheet_url, args.sheet_title, duplicates, args.flush_timeout)
+    try:
+        service.run(args.once)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        jobs.close()
+        if duplicates is not None:
+            logger.info("%s %s transactions already ingested", 'Skipped' if args.dedup == 'skip' else 'Flagged',
+                        duplicates.duplicates_found)
+            duplicates.close()
+        report_metrics(args.metrics)
+    return 1 if service.failed else 0
+
+if __name__ == '__main__':
+    raise SystemExit(main())